@@ -0,0 +1,213 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from mesh_builder import top_vertices, perimeter_loop, base_vertices, wall_and_base_faces
+
+# Upper bound on the number of depth samples examined per batch while
+# measuring cell errors, to keep the temporary arrays small.
+ERROR_BATCH_SAMPLES = 1 << 22
+
+
+def _fan_weights(size):
+    """
+    Interpolation weights of the four-triangle fan over a square cell.
+
+    The fan connects the cell centre to each side. Weights are ordered as
+    (top-left, top-right, bottom-left, bottom-right, centre), where "top" is
+    the first row of the cell.
+
+    Args:
+        size (int): Cell size in pixels.
+
+    Returns:
+        numpy.ndarray: Weight array of shape (5, size + 1, size + 1).
+    """
+    v, u = np.meshgrid(np.linspace(0, 1, size + 1), np.linspace(0, 1, size + 1), indexing='ij')
+    weights = np.zeros((5, size + 1, size + 1))
+
+    # Split the cell into the four triangles of the fan. For each triangle,
+    # t is the distance from its outer edge and a the position along it.
+    dx, dy = u - 0.5, v - 0.5
+    sectors = [
+        (dy <= -np.abs(dx), v, u, 0, 1),
+        (dy >= np.abs(dx), 1 - v, u, 2, 3),
+        ((dx < -np.abs(dy)), u, v, 0, 2),
+        ((dx > np.abs(dy)), 1 - u, v, 1, 3),
+    ]
+    for mask, t, a, start, end in sectors:
+        weights[start][mask] = (1 - a - t)[mask]
+        weights[end][mask] = (a - t)[mask]
+        weights[4][mask] = 2 * t[mask]
+    return weights
+
+
+def _cell_errors(windows, rows, cols, size):
+    """
+    Maximum deviation between the depth map and the fan interpolant of cells.
+
+    Args:
+        windows (numpy.ndarray): Strided (size + 1) x (size + 1) windows of the
+            padded depth map, one per cell of this level.
+        rows (numpy.ndarray): Row indices of the cells to measure.
+        cols (numpy.ndarray): Column indices of the cells to measure.
+        size (int): Cell size in pixels.
+
+    Returns:
+        numpy.ndarray: Maximum absolute error per cell.
+    """
+    weights = _fan_weights(size)
+    half = size // 2
+    errors = np.empty(len(rows))
+    batch = max(1, ERROR_BATCH_SAMPLES // ((size + 1) ** 2))
+    for start in range(0, len(rows), batch):
+        blocks = windows[rows[start:start + batch], cols[start:start + batch]]
+        samples = np.stack([
+            blocks[:, 0, 0], blocks[:, 0, size], blocks[:, size, 0], blocks[:, size, size], blocks[:, half, half],
+        ], axis=1)
+        interpolated = np.tensordot(samples, weights, axes=1)
+        errors[start:start + batch] = np.abs(blocks - interpolated).max(axis=(1, 2))
+    return errors
+
+
+def _leaf_levels(depth_image, max_error):
+    """
+    Find the quadtree leaves of an error-bounded merge of grid cells.
+
+    Cells are merged bottom-up: a cell of size 2s is kept whole when its four
+    children are kept whole and the fan interpolant stays within
+    max_error / 2 of every depth sample it covers. Splitting the fan edges at
+    the corners of smaller neighbours later changes the surface by at most
+    another max_error / 2, so the final mesh stays within max_error.
+
+    Args:
+        depth_image (numpy.ndarray): 2D array of depths.
+        max_error (float): Maximum vertical deviation in depth units.
+
+    Returns:
+        list: One boolean leaf mask per level, level k holding cells of size 2**k.
+    """
+    height, width = depth_image.shape
+    extent = 1
+    while extent < max(height - 1, width - 1):
+        extent *= 2
+    padded = np.pad(depth_image, ((0, extent + 1 - height), (0, extent + 1 - width)), mode='edge')
+
+    cells = extent
+    keep = [np.zeros((cells, cells), dtype=bool)]
+    keep[0][:height - 1, :width - 1] = True
+    size = 1
+    while cells > 1:
+        size *= 2
+        cells //= 2
+        children = keep[-1].reshape(cells, 2, cells, 2).all(axis=(1, 3))
+        rows, cols = np.nonzero(children)
+        if len(rows):
+            windows = sliding_window_view(padded, (size + 1, size + 1))[::size, ::size]
+            accepted = _cell_errors(windows, rows, cols, size) <= max_error / 2
+            children[rows[~accepted], cols[~accepted]] = False
+        keep.append(children)
+        if not children.any():
+            break
+
+    leaves = []
+    for level, kept in enumerate(keep):
+        if level + 1 < len(keep):
+            parent = keep[level + 1].repeat(2, axis=0).repeat(2, axis=1)
+            leaves.append(kept & ~parent)
+        else:
+            leaves.append(kept)
+    return leaves
+
+
+def _fan_faces(rows, cols, size, used, width):
+    """
+    Triangulate quadtree leaves as fans around their centres.
+
+    Every used vertex on a leaf's border (its corners and the corners of
+    smaller neighbours) becomes a fan vertex, so neighbouring leaves share
+    edges exactly and the surface has no T-junctions.
+
+    Args:
+        rows (numpy.ndarray): Leaf row indices at this level.
+        cols (numpy.ndarray): Leaf column indices at this level.
+        size (int): Leaf size in pixels.
+        used (numpy.ndarray): Flat boolean mask of used grid vertices.
+        width (int): Number of vertex columns.
+
+    Returns:
+        numpy.ndarray: Face array in grid vertex indices.
+    """
+    r0, c0 = (rows * size)[:, np.newaxis], (cols * size)[:, np.newaxis]
+    r1, c1 = r0 + size, c0 + size
+    t = np.arange(size)
+    # Counter-clockwise border walk, matching the winding of the top faces
+    border = np.concatenate([
+        r0 * width + c0 + t,
+        (r0 + t) * width + c1,
+        r1 * width + c1 - t,
+        (r1 - t) * width + c0,
+    ], axis=1)
+    centres = (r0 + size // 2) * width + c0 + size // 2
+
+    leaf, position = np.nonzero(used[border])
+    current = border[leaf, position]
+    # The next fan vertex is the following used border vertex of the same
+    # leaf, wrapping around to the first one.
+    following = np.roll(current, -1)
+    last = np.r_[leaf[1:] != leaf[:-1], True]
+    first = np.r_[True, leaf[1:] != leaf[:-1]]
+    following[last] = current[first]
+    return np.stack([centres[leaf, 0], current, following], axis=1)
+
+
+def adaptive_mesh(depth_image, max_error, x_scale, base_thickness):
+    """
+    Build a closed heightfield mesh with an error-bounded adaptive top surface.
+
+    Flat regions are covered by large quadtree cells instead of two triangles
+    per pixel, while the top surface never deviates from the depth map by more
+    than max_error at any pixel. The mesh is closed with the same perimeter
+    walls and bottom as the "closed" topology.
+
+    Args:
+        depth_image (numpy.ndarray): 2D array of depths.
+        max_error (float): Maximum vertical deviation in depth units (mm).
+        x_scale (float): Size of one pixel in output units.
+        base_thickness (float): Thickness added below the depth map.
+
+    Returns:
+        tuple: (vertices, faces) arrays of the closed mesh.
+    """
+    height, width = depth_image.shape
+    leaves = _leaf_levels(depth_image, max_error)
+
+    used = np.zeros((height, width), dtype=bool)
+    for level, leaf in enumerate(leaves):
+        size = 2 ** level
+        rows, cols = np.nonzero(leaf)
+        for dr in (0, size):
+            for dc in (0, size):
+                used[rows * size + dr, cols * size + dc] = True
+        if size > 1:
+            used[rows * size + size // 2, cols * size + size // 2] = True
+    used = used.ravel()
+
+    faces = []
+    for level, leaf in enumerate(leaves):
+        rows, cols = np.nonzero(leaf)
+        if level == 0:
+            v1 = rows * width + cols
+            v2, v3 = v1 + 1, v1 + width
+            faces.append(np.stack([v1, v2, v3, v2, v3 + 1, v3], axis=1).reshape(-1, 3))
+        elif len(rows):
+            faces.append(_fan_faces(rows, cols, 2 ** level, used, width))
+
+    # Renumber the used grid vertices compactly
+    new_index = np.cumsum(used) - 1
+    vertices = top_vertices(depth_image, x_scale, base_thickness)[used]
+    faces = new_index[np.concatenate(faces)]
+
+    loop = perimeter_loop(height, width)
+    loop = new_index[loop[used[loop]]]
+    vertices = np.concatenate([vertices, base_vertices(vertices, loop)])
+    faces = np.concatenate([faces, wall_and_base_faces(loop, np.count_nonzero(used))])
+    return vertices, faces
@@ -1,11 +1,22 @@
+import gzip
+import json
+import logging
 import os
 import threading
-import traceback
-import uuid
-from flask import Flask, request, render_template, jsonify, url_for, send_file
-from werkzeug.utils import secure_filename
-from image_processing import LithophaneCreator
+import time
+from flask import Flask, request, render_template, jsonify, url_for, send_file, redirect, Response, stream_with_context, abort
 from config import Config
+from jobs import JobManager, JobRejected, DONE, FAILED, report_progress
+from result_cache import ResultCache, image_digest, cache_key
+from mesh_formats import FORMATS, MIMETYPES, format_of, read_lod_table
+from mesh_repair import REPAIRED
+import metrics
+
+# The conversion engine (image_processing, with OpenCV) is imported by the
+# functions that need it rather than here, so the server starts quickly and
+# routes that only serve files never load it; see warm_up.
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
@@ -18,6 +29,81 @@ if not os.path.exists(app.config['UPLOAD_FOLDER']):
 if not os.path.exists(app.config['OUTPUT_FOLDER']):
     os.makedirs(app.config['OUTPUT_FOLDER'])
 
+def job_memory_budget():
+    """
+    Compute the admission budget of the conversion jobs in flight.
+
+    The job workers keep their stage caches, STAGE_CACHE_MB between them,
+    allocated from one job to the next, so the jobs get the rest of
+    ADMISSION_BUDGET_MB.
+
+    Returns:
+        int: Budget in bytes, or None when admission control is disabled.
+    """
+    if not Config.ADMISSION_BUDGET_MB:
+        return None
+    # A budget the caches use up still admits small jobs only, rather than
+    # turning admission control off
+    return max(1, Config.ADMISSION_BUDGET_MB - Config.STAGE_CACHE_MB) * 2**20
+
+def init_job_worker():
+    """
+    Size the stage caches of a job worker process to its share of
+    STAGE_CACHE_MB.
+    """
+    from image_processing import set_stage_cache_budget
+    set_stage_cache_budget(Config.STAGE_CACHE_MB * 2**20 // max(1, Config.WORKERS))
+
+job_manager = JobManager(
+    max_workers=Config.WORKERS,
+    memory_budget=job_memory_budget(),
+    max_queued=Config.ADMISSION_QUEUE,
+    initializer=init_job_worker,
+)
+
+# Jobs that are still running, by cache key, so identical requests share a job
+pending_jobs = {}
+pending_lock = threading.RLock()
+
+pending_gauge = metrics.registry.gauge('lithophane_jobs_pending', 'Conversion jobs queued or running.')
+cache_bytes_gauge = metrics.registry.gauge('lithophane_result_cache_bytes', 'Size of the cached files by folder.')
+queued_gauge = metrics.registry.gauge('lithophane_jobs_queued', 'Conversion jobs waiting for the admission budget.')
+in_flight_bytes_gauge = metrics.registry.gauge(
+    'lithophane_admission_in_flight_bytes', 'Estimated memory of the conversion jobs in flight.'
+)
+budget_bytes_gauge = metrics.registry.gauge('lithophane_admission_budget_bytes', 'Admission budget for conversion jobs.')
+rejected_counter = metrics.registry.counter('lithophane_jobs_rejected_total', 'Conversion requests rejected by admission control.')
+
+# Previews are built in the web process; one at a time bounds their CPU use,
+# and uploads arriving meanwhile skip theirs instead of waiting
+preview_lock = threading.Lock()
+
+# Seconds between comments on idle progress streams, so closed connections
+# are noticed
+EVENTS_KEEPALIVE_SECONDS = 15
+
+# Ranges of the integer conversion parameters that variants may change
+PARAM_RANGES = {'max_depth': (1, 10), 'base_thickness': (1, 5), 'output_width': (100, 2000)}
+# Maximum number of variants in one request
+MAX_VARIANTS = 16
+
+# Parameters a preview depends on; it always uses the closed topology
+PREVIEW_PARAMS = ('max_depth', 'base_thickness', 'output_width', 'resolution', 'smoothness', 'top_surface_smoothness', 'invert', 'grayscale')
+
+def get_result_cache():
+    """
+    Return the result cache for the configured output and upload folders.
+
+    Returns:
+        ResultCache: The cache, created on first use.
+    """
+    folders = (app.config['OUTPUT_FOLDER'], app.config['UPLOAD_FOLDER'])
+    cache = app.extensions.get('result_cache')
+    if cache is None or (cache.outputs.folder, cache.uploads.folder) != folders:
+        cache = ResultCache(*folders, Config.OUTPUT_CACHE_MB * 2**20, Config.UPLOAD_CACHE_MB * 2**20)
+        app.extensions['result_cache'] = cache
+    return cache
+
 def allowed_file(filename):
     """
     Check if the uploaded file is allowed based on its extension.
@@ -72,12 +158,65 @@ def validate_float_input(value, min_value, max_value, default_value):
     except:
         return default_value
 
-def process_image(filepath, output_filepath, max_depth, base_thickness, output_width, invert, resolution, smoothness, grayscale, top_surface_smoothness, repair_mesh):
+def create_processor(max_depth, base_thickness, output_width, invert, resolution, smoothness, grayscale, top_surface_smoothness, repair_mesh, topology, max_error, output_format='stl'):
+    """
+    Create the LithophaneCreator for a conversion, generating the mesh in
+    bands or in parallel where configured and possible. Takes the
+    conversion parameters of process_image.
+
+    Returns:
+        LithophaneCreator: The processor.
+    """
+    from image_processing import LithophaneCreator
+    # Repair and adaptive triangulation need the whole mesh in memory
+    whole_mesh = repair_mesh or max_error > 0
+    return LithophaneCreator(
+        max_depth=max_depth,
+        base_thickness=base_thickness,
+        output_width=output_width,
+        invert=invert,
+        resolution=resolution,
+        smoothness=smoothness,
+        grayscale=grayscale,
+        top_surface_smoothness=top_surface_smoothness,
+        repair_mesh=repair_mesh,
+        topology=topology,
+        max_error=max_error,
+        memory_budget_mb=None if whole_mesh or output_format not in ('stl', 'stl.gz') else Config.MEMORY_BUDGET_MB or None,
+        workers=1 if whole_mesh or output_format != 'stl' else Config.MESH_WORKERS,
+        output_format=output_format
+    )
+
+def estimate_job_cost(image_bytes, params, variants=None):
+    """
+    Estimate the cost of a conversion from the image header, without
+    decoding the image.
+
+    Args:
+        image_bytes (bytes): The uploaded image.
+        params (dict): Normalized conversion parameters.
+        variants (list): Variants of a process_variants job, which always
+            builds whole meshes, or None for process_image.
+
+    Returns:
+        costs.JobCost: The estimate, or None for an unreadable header, in
+        which case the job fails as soon as it decodes the image.
+    """
+    from image_processing import LithophaneCreator, read_image_header
+    header = read_image_header(image_bytes)
+    if header is None:
+        return None
+    if variants is not None:
+        # Built as process_variants builds it, never in bands
+        return LithophaneCreator(**params).estimate_cost(header[1], header[2], variants=len(variants))
+    return create_processor(**params).estimate_cost(header[1], header[2])
+
+def process_image(image, output_filepath, max_depth, base_thickness, output_width, invert, resolution, smoothness, grayscale, top_surface_smoothness, repair_mesh, topology, max_error, output_format='stl'):
     """
     Process the image and create a lithophane STL file.
 
     Args:
-        filepath (str): Path to the input image file.
+        image: Path to the input image file, or the uploaded image as bytes.
         output_filepath (str): Path to the output STL file.
         max_depth (int): Maximum depth for the lithophane.
         base_thickness (int): Base thickness for the lithophane.
@@ -88,26 +227,132 @@ def process_image(filepath, output_filepath, max_depth, base_thickness, output_w
         grayscale (bool): Flag to convert the image to grayscale.
         top_surface_smoothness (int): Smoothness factor for the top surface.
         repair_mesh (bool): Flag to perform mesh repair using PyMeshFix.
+        topology (str): Mesh layout, "grid" or "closed".
+        max_error (float): Maximum vertical error in mm for adaptive triangulation.
+        output_format (str): Mesh file format, one of mesh_formats.FORMATS.
 
     Returns:
-        str: Path to the fixed STL file.
+        dict: The output file name, the name of its levels of detail for the
+        viewer (None when disabled or failed), the name of the unit depth map file
+        shared with the other workers, if any (see
+        LithophaneCreator.depth_folder), and the mesh statistics of the
+        processor.
+
+    Raises:
+        Exception: Any error of the conversion, with depth_file and stats
+        set as in the result, the stats holding the spans of the stages run.
     """
+    processor = create_processor(
+        max_depth, base_thickness, output_width, invert, resolution, smoothness, grayscale,
+        top_surface_smoothness, repair_mesh, topology, max_error, output_format
+    )
+    processor.progress = report_progress
+    # Other workers, and later jobs on any of them, reuse the depth map
+    processor.depth_folder = os.path.dirname(output_filepath)
+    fixed_output_filepath = output_filepath.replace(".stl", "_fixed.stl")
+    folder, name = os.path.split(output_filepath)
+    lod_filepath = os.path.join(folder, name.split('.', 1)[0] + '.lod') if Config.LOD_SIZES else None
     try:
-        processor = LithophaneCreator(
-            max_depth=max_depth,
-            base_thickness=base_thickness,
-            output_width=output_width,
-            invert=invert,
-            resolution=resolution,
-            smoothness=smoothness,
-            grayscale=grayscale,
-            top_surface_smoothness=top_surface_smoothness,
-            repair_mesh=repair_mesh
-        )
-        return processor.create_lithophane(filepath, output_filepath)
-    except Exception as e:
-        print(f"Error processing image: {str(e)}")
-        traceback.print_exc()
+        output_path = processor.create_lithophane(image, output_filepath)
+    except Exception as error:
+        # Never leave partial outputs behind for the result cache to pick up
+        for path in (output_filepath, fixed_output_filepath, lod_filepath):
+            if path is None:
+                continue
+            if os.path.exists(path):
+                os.remove(path)
+        # The depth map file is complete, so the result cache tracks it anyway
+        error.depth_file = processor.depth_file
+        error.stats = processor.stats
+        raise
+    if output_path != output_filepath:
+        # Only the repaired mesh is served
+        os.remove(output_filepath)
+    if lod_filepath:
+        # The viewer falls back to the full mesh, so the conversion still succeeds
+        try:
+            processor.create_lods(image, lod_filepath, Config.LOD_SIZES)
+        except Exception:
+            logger.exception("Error creating levels of detail")
+            if os.path.exists(lod_filepath):
+                os.remove(lod_filepath)
+            lod_filepath = None
+    return {
+        "filename": os.path.basename(output_path),
+        "lod": os.path.basename(lod_filepath) if lod_filepath else None,
+        "depth": processor.depth_file,
+        "stats": processor.stats,
+    }
+
+def process_variants(image, output_filepath, variants, **params):
+    """
+    Create a zip of STL files of one image in several variants.
+
+    Args:
+        image: Path to the input image file, or the uploaded image as bytes.
+        output_filepath (str): Path to the output zip file.
+        variants (list): Dicts overriding some of VARIANT_PARAMS.
+        **params: Conversion parameters, see process_image.
+
+    Returns:
+        dict: The output file name, the name of the unit depth map file and
+        the mesh statistics of the processor.
+
+    Raises:
+        Exception: Any error of the conversion, with depth_file and stats
+        set as in the result.
+    """
+    from image_processing import LithophaneCreator
+    processor = LithophaneCreator(progress=report_progress, depth_folder=os.path.dirname(output_filepath), **params)
+    try:
+        processor.create_variants(image, output_filepath, variants)
+    except Exception as error:
+        if os.path.exists(output_filepath):
+            os.remove(output_filepath)
+        error.depth_file = processor.depth_file
+        error.stats = processor.stats
+        raise
+    return {"filename": os.path.basename(output_filepath), "lod": None, "depth": processor.depth_file, "stats": processor.stats}
+
+def create_preview(cache, digest, image_bytes, params):
+    """
+    Build, or fetch from the result cache, the quick preview of a conversion.
+
+    Previews are skipped rather than waited for, so that building one never
+    holds an upload past PREVIEW_BUDGET_MS: when another preview is being
+    built, or when the image is estimated to take longer, e.g. a large PNG,
+    which is decoded at full size.
+
+    Args:
+        cache (ResultCache): Result cache for the output folder.
+        digest (str): Digest of the uploaded image.
+        image_bytes (bytes): The uploaded image.
+        params (dict): Normalized conversion parameters.
+
+    Returns:
+        tuple: (filename, skipped), the output file name of the preview, or
+        None with skipped "busy" or "too_large" as the reason.
+    """
+    from image_processing import LithophaneCreator, estimate_preview_seconds, read_image_header
+    preview_params = {name: params[name] for name in PREVIEW_PARAMS}
+    preview_params["preview"] = Config.PREVIEW_SIZE
+    key = cache_key(digest, preview_params)
+    filename = cache.lookup(key)
+    if filename is not None:
+        return filename, None
+    header = read_image_header(image_bytes)
+    if header is not None and estimate_preview_seconds(header) * 1000 > Config.PREVIEW_BUDGET_MS:
+        return None, "too_large"
+    if not preview_lock.acquire(blocking=False):
+        return None, "busy"
+    try:
+        filename = f"{key}.stl"
+        processor = LithophaneCreator(repair_mesh=False, **{name: params[name] for name in PREVIEW_PARAMS})
+        processor.create_preview(image_bytes, os.path.join(app.config['OUTPUT_FOLDER'], filename), Config.PREVIEW_SIZE)
+        cache.store(key, filename)
+    finally:
+        preview_lock.release()
+    return filename, None
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
@@ -125,55 +370,420 @@ def index():
             if file.filename == '':
                 return jsonify({"success": False, "error": "No selected file"})
             if file and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
+                image_bytes = file.read()
 
                 # Get form data and validate
-                max_depth = validate_int_input(request.form.get('max_depth'), 1, 10, Config.MAX_DEPTH)
-                base_thickness = validate_int_input(request.form.get('base_thickness'), 1, 5, Config.BASE_THICKNESS)
-                output_width = validate_int_input(request.form.get('output_width'), 100, 2000, Config.OUTPUT_WIDTH)
-                resolution = validate_float_input(request.form.get('resolution'), 0.1, 10.0, Config.RESOLUTION)
-                smoothness = validate_int_input(request.form.get('smoothness'), 1, 20, Config.SMOOTHNESS)
-                top_surface_smoothness = validate_int_input(request.form.get('top_surface_smoothness'), 1, 20, Config.TOP_SURFACE_SMOOTHNESS)
-
-                invert = request.form.get('invert', 'false').lower() == 'true'
-                grayscale = request.form.get('grayscale', 'false').lower() == 'true'
-                repair_mesh = request.form.get('repair_mesh', 'false').lower() == 'true'
-
-                unique_filename = f"{uuid.uuid4().hex}.stl"
-                output_filepath = os.path.join(app.config['OUTPUT_FOLDER'], unique_filename)
-
-                thread = threading.Thread(
-                    target=process_image, 
-                    args=(filepath, output_filepath, max_depth, base_thickness, output_width, invert, resolution, smoothness, grayscale, top_surface_smoothness, repair_mesh)
-                )
-                thread.start()
-                thread.join()
+                params = parse_params(request.form)
+
+                # Serve repeated conversions from the result cache
+                cache = get_result_cache()
+                digest = image_digest(image_bytes)
+                key = cache_key(digest, params)
+                cached_filename = cache.lookup(key)
+                if cached_filename is not None:
+                    response = {
+                        "success": True,
+                        "status": DONE,
+                        "cached": True,
+                        "stl_url": url_for('download_file', filename=cached_filename),
+                    }
+                    if cache.companion(key, '.lod'):
+                        response["lod_url"] = url_for('lod_index', key=key)
+                    return jsonify(response)
 
-                fixed_output_filename = unique_filename.replace(".stl", "_fixed.stl") if repair_mesh else unique_filename
-                return jsonify({"success": True, "stl_url": url_for('download_file', filename=fixed_output_filename)})
+                job = start_job(
+                    cache, key, process_image, image_bytes, f"{key}.{params['output_format']}", params,
+                    estimate_job_cost(image_bytes, params)
+                )
+                response = {
+                    "success": True,
+                    "job_id": job.id,
+                    "status": job.status,
+                    "status_url": url_for('job_status', job_id=job.id),
+                    "events_url": url_for('job_events', job_id=job.id),
+                }
+                if Config.PREVIEW_SIZE:
+                    # The preview is only a convenience; the job reports any real error
+                    try:
+                        preview_filename, skipped = create_preview(cache, digest, image_bytes, params)
+                        if preview_filename is not None:
+                            response["preview_url"] = url_for('download_file', filename=preview_filename)
+                        else:
+                            response["preview_skipped"] = skipped
+                    except Exception:
+                        logger.exception("Error creating preview")
+                return jsonify(response), 202
+        except JobRejected as e:
+            return rejected_response(e)
         except Exception as e:
-            traceback.print_exc()
+            logger.exception("Error handling upload")
             return jsonify({"success": False, "error": str(e)})
 
     return render_template('index.html', config=Config)
 
+@app.route('/variants', methods=['POST'])
+def variants():
+    """
+    Handle a request for several lithophanes of one image, differing in
+    max_depth, base_thickness or output_width.
+
+    The form holds the image and the conversion parameters, as for the index
+    route, plus "variants": a JSON list of objects overriding some of the
+    variant parameters. One job computes the depth map and faces once and
+    writes a zip of STL files, one per variant.
+
+    Returns:
+        str: JSON response with the job status URL, or the zip URL when
+        served from the result cache.
+    """
+    try:
+        file = request.files.get('file')
+        if file is None or not allowed_file(file.filename):
+            return jsonify({"success": False, "error": "No image file"}), 400
+        image_bytes = file.read()
+        params = parse_params(request.form)
+        params["output_format"] = 'stl'
+        try:
+            variants = parse_variants(request.form.get('variants', ''))
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+
+        cache = get_result_cache()
+        key = cache_key(image_digest(image_bytes), {**params, "variants": variants})
+        cached_filename = cache.lookup(key)
+        if cached_filename is not None:
+            return jsonify({
+                "success": True,
+                "status": DONE,
+                "cached": True,
+                "stl_url": url_for('download_file', filename=cached_filename),
+            })
+
+        cost = estimate_job_cost(image_bytes, params, variants)
+        job = start_job(cache, key, process_variants, image_bytes, f"{key}.zip", params, cost, variants=variants)
+        return jsonify({
+            "success": True,
+            "job_id": job.id,
+            "status": job.status,
+            "status_url": url_for('job_status', job_id=job.id),
+            "events_url": url_for('job_events', job_id=job.id),
+        }), 202
+    except JobRejected as e:
+        return rejected_response(e)
+    except Exception as e:
+        logger.exception("Error handling variants")
+        return jsonify({"success": False, "error": str(e)})
+
+def parse_params(form):
+    """
+    Validate the conversion parameters of a form, falling back to the
+    configured defaults.
+
+    Args:
+        form (werkzeug.datastructures.MultiDict): Submitted form.
+
+    Returns:
+        dict: Normalized conversion parameters.
+    """
+    from image_processing import TOPOLOGIES
+    params = {
+        "max_depth": validate_int_input(form.get('max_depth'), *PARAM_RANGES['max_depth'], Config.MAX_DEPTH),
+        "base_thickness": validate_int_input(form.get('base_thickness'), *PARAM_RANGES['base_thickness'], Config.BASE_THICKNESS),
+        "output_width": validate_int_input(form.get('output_width'), *PARAM_RANGES['output_width'], Config.OUTPUT_WIDTH),
+        "resolution": validate_float_input(form.get('resolution'), 0.1, 10.0, Config.RESOLUTION),
+        "smoothness": validate_int_input(form.get('smoothness'), 1, 20, Config.SMOOTHNESS),
+        "top_surface_smoothness": validate_int_input(form.get('top_surface_smoothness'), 1, 20, Config.TOP_SURFACE_SMOOTHNESS),
+        "max_error": validate_float_input(form.get('max_error'), 0.0, 2.0, Config.MAX_ERROR),
+        "invert": form.get('invert', 'false').lower() == 'true',
+        "grayscale": form.get('grayscale', 'false').lower() == 'true',
+        "repair_mesh": form.get('repair_mesh', 'false').lower() == 'true',
+        "topology": form.get('topology', Config.TOPOLOGY),
+        "output_format": form.get('output_format', Config.OUTPUT_FORMAT),
+    }
+    if params["topology"] not in TOPOLOGIES:
+        params["topology"] = Config.TOPOLOGY
+    if params["output_format"] not in FORMATS:
+        params["output_format"] = Config.OUTPUT_FORMAT
+
+    # Closed and adaptive meshes are watertight by construction, so repair is never needed
+    if params["topology"] == 'closed' or params["max_error"] > 0:
+        params["repair_mesh"] = False
+    return params
+
+def parse_variants(text):
+    """
+    Validate the variants of a variants request.
+
+    Args:
+        text (str): JSON list of objects with some of VARIANT_PARAMS.
+
+    Returns:
+        list: Variants as dicts of integers.
+
+    Raises:
+        ValueError: If the list is malformed, empty, too long or has
+            unknown or out of range values.
+    """
+    from image_processing import VARIANT_PARAMS
+    try:
+        variants = json.loads(text)
+    except json.JSONDecodeError:
+        raise ValueError("variants must be a JSON list")
+    if not isinstance(variants, list) or not variants:
+        raise ValueError("variants must be a non-empty JSON list")
+    if len(variants) > MAX_VARIANTS:
+        raise ValueError(f"At most {MAX_VARIANTS} variants are allowed")
+    normalized = []
+    for variant in variants:
+        if not isinstance(variant, dict) or set(variant) - set(VARIANT_PARAMS):
+            raise ValueError(f"Each variant must be an object with some of {', '.join(VARIANT_PARAMS)}")
+        for name, value in variant.items():
+            low, high = PARAM_RANGES[name]
+            if not isinstance(value, int) or isinstance(value, bool) or not low <= value <= high:
+                raise ValueError(f"{name} must be an integer from {low} to {high}")
+        normalized.append(dict(sorted(variant.items())))
+    return normalized
+
+def start_job(cache, key, fn, image_bytes, output_filename, params, cost, **kwargs):
+    """
+    Submit a conversion job, or join the running job with the same key.
+
+    Args:
+        cache (ResultCache): Cache the output is stored in when done.
+        key (str): Cache key of the conversion.
+        fn (callable): process_image or process_variants.
+        image_bytes (bytes): The uploaded image, decoded in memory by the job.
+        output_filename (str): Output file name in the output folder.
+        params (dict): Normalized conversion parameters.
+        cost (costs.JobCost): Estimated cost of the job.
+        **kwargs: Further arguments for fn.
+
+    Returns:
+        jobs.Job: The new or running job.
+
+    Raises:
+        JobRejected: If admission control rejects the job.
+    """
+    with pending_lock:
+        job = pending_jobs.get(key)
+        if job is None:
+            output_filepath = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
+            job = job_manager.submit(fn, image_bytes, output_filepath, cost=cost, **kwargs, **params)
+            pending_jobs[key] = job
+            traced = {**params, **kwargs}
+            job.future.add_done_callback(lambda future, key=key, job=job: finish_job(cache, key, job, traced))
+    return job
+
+def rejected_response(error):
+    """
+    Build the response to a request rejected by admission control.
+
+    Args:
+        error (JobRejected): The rejection.
+
+    Returns:
+        tuple: JSON response and status, 429 with a Retry-After header when
+        the queue is full, 413 when the job never fits the budget.
+    """
+    with metrics.registry.updating():
+        rejected_counter.inc(reason='queue_full' if error.retry_after else 'too_large')
+    response = jsonify({"success": False, "error": str(error), "retry_after": error.retry_after})
+    if error.retry_after is None:
+        return response, 413
+    return response, 429, {"Retry-After": str(error.retry_after)}
+
+def finish_job(cache, key, job, params):
+    """
+    Record the output of a finished job in the result cache and its trace in
+    the metrics. The unit depth map file of a failed job is recorded too.
+
+    Args:
+        cache (ResultCache): Cache the job was submitted for.
+        key (str): Cache key of the job.
+        job (jobs.Job): The finished job.
+        params (dict): Conversion parameters of the job.
+    """
+    with pending_lock:
+        pending_jobs.pop(key, None)
+    info = job.to_dict()
+    seconds = time.time() - job.submitted_at
+    if info["status"] == DONE:
+        cache.store(key, info["result"]["filename"])
+        for companion in (info["result"].get("lod"), info["result"].get("depth")):
+            if companion:
+                cache.add_companion(companion, protected=[info["result"]["filename"]])
+        metrics.record_job(job.id, DONE, params, seconds, stats=info["result"]["stats"])
+    else:
+        error = None if job.future.cancelled() else job.future.exception()
+        metrics.record_job(job.id, FAILED, params, seconds, stats=getattr(error, 'stats', None), error=info["error"])
+        depth_file = getattr(error, 'depth_file', None)
+        if depth_file:
+            cache.add_companion(depth_file)
+
+def job_response(job):
+    """
+    Build the JSON description of a job.
+
+    Args:
+        job (jobs.Job): The job to describe.
+
+    Returns:
+        dict: Job id and status, plus the STL URL, the viewer levels of
+        detail URL and mesh statistics when done, or the error message when
+        failed. Jobs whose mesh repair fell back to the unrepaired mesh are
+        flagged with repair_fallback and a warning.
+    """
+    info = job.to_dict()
+    result = info.pop("result", None)
+    info["success"] = info["status"] != FAILED
+    if result is not None:
+        info["stl_url"] = url_for('download_file', filename=result["filename"])
+        if result.get("lod"):
+            info["lod_url"] = url_for('lod_index', key=result["lod"].split('.', 1)[0])
+        info["stats"] = result["stats"]
+        repair = result["stats"].get("repair")
+        if repair and repair["outcome"] != REPAIRED:
+            # Served, but not what was asked for
+            info["repair_fallback"] = True
+            info["warning"] = f"{repair['error']}; the unrepaired mesh is served"
+    return info
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """
+    Report the status of a conversion job.
+
+    Args:
+        job_id (str): Job identifier returned by the index route.
+
+    Returns:
+        str: JSON response with the job status.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Unknown job"}), 404
+    return jsonify(job_response(job))
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """
+    Stream the progress of a conversion job as server-sent events.
+
+    A "progress" event carries the stage and its completed fraction each
+    time the job reports progress, and a final "done" event the job status
+    as returned by /jobs/<job_id>. The stream waits on the job for updates,
+    so idle watchers cost no CPU.
+
+    Args:
+        job_id (str): Job identifier returned by the index route.
+
+    Returns:
+        Response: An event stream, or a JSON error for unknown jobs.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Unknown job"}), 404
+
+    def events():
+        version = 0
+        while not job.future.done():
+            latest, progress = job.wait_for_progress(version, EVENTS_KEEPALIVE_SECONDS)
+            if latest != version:
+                version = latest
+                yield f"event: progress\ndata: {json.dumps(progress)}\n\n"
+            elif not job.future.done():
+                yield ": keep-alive\n\n"
+        yield f"event: done\ndata: {json.dumps(job_response(job))}\n\n"
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Proxies must not buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    """
+    Redirect to the STL of a finished job.
+
+    Args:
+        job_id (str): Job identifier returned by the index route.
+
+    Returns:
+        str: A redirect to the download when done, otherwise a JSON response
+        with the job status (202 while pending, 500 when failed).
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Unknown job"}), 404
+    info = job_response(job)
+    if info["status"] == DONE:
+        return redirect(info["stl_url"])
+    return jsonify(info), 500 if info["status"] == FAILED else 202
+
+@app.route('/cache/stats')
+def cache_stats():
+    """
+    Report the result cache counters.
+
+    Returns:
+        str: JSON response with hit/miss counts and folder sizes.
+    """
+    return jsonify(get_result_cache().stats())
+
+@app.route('/queue/stats')
+def queue_stats():
+    """
+    Report the job queue depth and admission budget usage.
+
+    Returns:
+        str: JSON response with the job counts and budget in bytes.
+    """
+    return jsonify(job_manager.stats())
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """
+    Expose stage, job and cache metrics for Prometheus.
+
+    Returns:
+        Response: Metrics in the Prometheus text exposition format.
+    """
+    cache = get_result_cache()
+    with metrics.registry.updating():
+        with pending_lock:
+            pending_gauge.set(len(pending_jobs))
+        queue = job_manager.stats()
+        queued_gauge.set(queue["queued"])
+        in_flight_bytes_gauge.set(queue["in_flight_bytes"])
+        budget_bytes_gauge.set(queue["memory_budget_bytes"])
+        cache_bytes_gauge.set(cache.outputs.total_bytes, folder='outputs')
+        cache_bytes_gauge.set(cache.uploads.total_bytes, folder='uploads')
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/logs')
 def logs():
     """
-    Handle the logs endpoint to return log messages.
+    Handle the logs endpoint to return the traces of recent jobs.
+
+    Each trace holds the job parameters, depth map size, triangle count and
+    the duration and memory of every pipeline stage that ran.
 
     Returns:
-        str: JSON response with log messages.
+        str: JSON response with the most recent traces first.
     """
-    return jsonify({"logs": []})
+    limit = validate_int_input(request.args.get('limit'), 1, metrics.TRACE_HISTORY, metrics.TRACE_HISTORY)
+    return jsonify({"logs": metrics.recent_traces(limit)})
 
 @app.route('/download/<filename>')
 def download_file(filename):
     """
     Handle file download requests.
 
+    Gzip-compressed STL files are sent as they are with a gzip
+    Content-Encoding when the client accepts it, so browsers and download
+    tools see a plain STL; other clients get the STL decompressed on the fly.
+
     Args:
         filename (str): Name of the file to download.
 
@@ -181,7 +791,103 @@ def download_file(filename):
         str: The file to download.
     """
     filepath = os.path.join(app.config['OUTPUT_FOLDER'], filename)
-    return send_file(filepath, as_attachment=True)
+    output_format = format_of(filename)
+    if output_format != 'stl.gz':
+        return send_file(filepath, as_attachment=True, mimetype=MIMETYPES.get(output_format))
+
+    download_name = filename[:-len('.gz')]
+    if 'gzip' in request.accept_encodings:
+        response = send_file(filepath, as_attachment=True, download_name=download_name, mimetype=MIMETYPES['stl'])
+        response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def decompress():
+        with gzip.open(filepath, 'rb') as f:
+            while chunk := f.read(1 << 20):
+                yield chunk
+
+    if not os.path.exists(filepath):
+        abort(404)
+    response = Response(stream_with_context(decompress()), mimetype=MIMETYPES['stl'])
+    response.headers['Content-Disposition'] = f'attachment; filename={download_name}'
+    response.vary.add('Accept-Encoding')
+    return response
+
+def lod_table(key):
+    """
+    Read the level table of the levels of detail of a conversion.
+
+    Args:
+        key (str): Cache key of the conversion.
+
+    Returns:
+        tuple: (path, table), see mesh_formats.read_lod_table. Aborts with
+        404 if the levels are not cached.
+    """
+    filename = get_result_cache().companion(key, '.lod')
+    if filename is None:
+        abort(404)
+    filepath = os.path.join(app.config['OUTPUT_FOLDER'], filename)
+    try:
+        return filepath, read_lod_table(filepath)
+    except (OSError, ValueError):
+        abort(404)
+
+@app.route('/lod/<key>')
+def lod_index(key):
+    """
+    List the levels of detail of a conversion for the viewer.
+
+    Returns:
+        str: JSON response with the URL, vertex and triangle count of each
+        level, coarsest first.
+    """
+    _, table = lod_table(key)
+    levels = [
+        {
+            "url": url_for('lod_level', key=key, level=level),
+            "vertices": int(entry['vertices']),
+            "triangles": int(entry['faces']),
+        }
+        for level, entry in enumerate(table)
+    ]
+    return jsonify({"levels": levels})
+
+@app.route('/lod/<key>/<int:level>')
+def lod_level(key, level):
+    """
+    Send one level of detail as float32 vertices followed by uint32 faces,
+    little endian.
+
+    Args:
+        key (str): Cache key of the conversion.
+        level (int): Level index, 0 being the coarsest.
+
+    Returns:
+        Response: The level, streamed from the levels of detail file.
+    """
+    filepath, table = lod_table(key)
+    if level >= len(table):
+        abort(404)
+    offset, size = int(table[level]['offset']), 12 * (int(table[level]['vertices']) + int(table[level]['faces']))
+
+    def read_level():
+        with open(filepath, 'rb') as f:
+            f.seek(offset)
+            remaining = size
+            while remaining:
+                chunk = f.read(min(remaining, 1 << 20))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    response = Response(stream_with_context(read_level()), mimetype='application/octet-stream')
+    response.headers['Content-Length'] = str(size)
+    # Levels are content addressed, so they never change
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
 
 @app.route('/viewer')
 def viewer():
@@ -193,5 +899,30 @@ def viewer():
     """
     return render_template('viewer.html')
 
+def warm_up():
+    """
+    Load the conversion engine and compile the page templates before the
+    first request.
+
+    Meant for the master process of a prefork server (see wsgi.py): workers
+    forked afterwards, and the job worker processes they fork in turn, share
+    the loaded modules copy-on-write instead of each importing them on
+    their first conversion. Must run before any job is submitted, since it
+    does not start the job worker pool.
+
+    Returns:
+        float: Seconds spent.
+    """
+    from image_processing import warm_up as warm_up_engine
+    start = time.perf_counter()
+    warm_up_engine()
+    for template in ('index.html', 'viewer.html'):
+        app.jinja_env.get_template(template)
+    seconds = time.perf_counter() - start
+    logger.info("Warmed up in %.2fs", seconds)
+    return seconds
+
 if __name__ == '__main__':
+    if Config.WARM_UP:
+        warm_up()
     app.run(debug=True)
@@ -0,0 +1,108 @@
+"""
+Compare the original loop-based mesh construction with the vectorized builder.
+
+Usage:
+    python benchmarks/bench_mesh_builder.py [--sizes 100 200 400]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mesh_builder import grid_vertices, grid_faces, faces_to_triangles
+
+
+def loop_mesh(depth_image, x_scale, base_thickness):
+    """
+    Build the triangle array the way create_lithophane originally did.
+
+    Args:
+        depth_image (numpy.ndarray): 2D array of depths.
+        x_scale (float): Size of one pixel in output units.
+        base_thickness (float): Thickness added below the depth map.
+
+    Returns:
+        numpy.ndarray: Triangle array of shape (m, 3, 3).
+    """
+    height, width = depth_image.shape
+    vertices = []
+    faces = []
+    for y in range(height):
+        for x in range(width):
+            vertices.append([x * x_scale, y * x_scale, depth_image[y, x] + base_thickness])
+    for y in range(height):
+        for x in range(width):
+            vertices.append([x * x_scale, y * x_scale, 0])
+    for y in range(height - 1):
+        for x in range(width - 1):
+            v1 = y * width + x
+            faces.append([v1, v1 + 1, v1 + width])
+            faces.append([v1 + 1, v1 + width + 1, v1 + width])
+    offset = height * width
+    for y in range(height - 1):
+        for x in range(width - 1):
+            v1 = y * width + x + offset
+            faces.append([v1, v1 + width, v1 + 1])
+            faces.append([v1 + 1, v1 + width, v1 + width + 1])
+    for y in range(height - 1):
+        for x in range(width - 1):
+            v1 = y * width + x
+            faces.append([v1, v1 + 1, v1 + offset])
+            faces.append([v1 + 1, v1 + offset + 1, v1 + offset])
+            v3 = v1 + width
+            faces.append([v3, v3 + 1, v3 + offset])
+            faces.append([v3 + 1, v3 + offset + 1, v3 + offset])
+    vertices = np.array(vertices)
+    faces = np.array(faces)
+    triangles = np.zeros((faces.shape[0], 3, 3), dtype=np.float32)
+    for i, face in enumerate(faces):
+        for j in range(3):
+            triangles[i][j] = vertices[face[j], :]
+    return triangles
+
+
+def vectorized_mesh(depth_image, x_scale, base_thickness):
+    """
+    Build the triangle array with the vectorized mesh builder.
+
+    Args:
+        depth_image (numpy.ndarray): 2D array of depths.
+        x_scale (float): Size of one pixel in output units.
+        base_thickness (float): Thickness added below the depth map.
+
+    Returns:
+        numpy.ndarray: Triangle array of shape (m, 3, 3).
+    """
+    height, width = depth_image.shape
+    vertices = grid_vertices(depth_image, x_scale, base_thickness)
+    faces = grid_faces(height, width)
+    return faces_to_triangles(vertices, faces).astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 200, 400])
+    args = parser.parse_args()
+
+    print(f"{'size':>6} {'triangles':>10} {'loop (s)':>10} {'vectorized (s)':>15} {'speedup':>8}")
+    for size in args.sizes:
+        depth_image = np.random.default_rng(size).random((size, size)) * 10
+
+        start = time.perf_counter()
+        expected = loop_mesh(depth_image, 1.0, 4)
+        loop_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = vectorized_mesh(depth_image, 1.0, 4)
+        vectorized_time = time.perf_counter() - start
+
+        assert np.array_equal(expected, actual)
+        print(f"{size:>6} {len(actual):>10} {loop_time:>10.3f} {vectorized_time:>15.4f} {loop_time / vectorized_time:>7.0f}x")
+
+
+if __name__ == '__main__':
+    main()
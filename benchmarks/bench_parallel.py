@@ -0,0 +1,70 @@
+"""
+Measure how parallel band meshing scales with the number of worker processes.
+
+Usage:
+    python benchmarks/bench_parallel.py [--size 3000] [--workers 1 2 4 8] [--topology closed]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mesh_builder import grid_vertices, grid_faces, closed_vertices, closed_faces
+from parallel_mesh import write_parallel_stl
+from stl_writer import write_binary_stl
+
+
+def serial_stl(path, unit_depth, topology):
+    """
+    Write the STL in a single process, the way create_lithophane does.
+
+    Args:
+        path (str): Path to the output STL file.
+        unit_depth (numpy.ndarray): 2D depth map in [0, 1].
+        topology (str): Mesh layout, "grid" or "closed".
+    """
+    depth_image = unit_depth * 10
+    height, width = depth_image.shape
+    if topology == 'closed':
+        vertices, faces = closed_vertices(depth_image, 0.1, 4), closed_faces(height, width)
+    else:
+        vertices, faces = grid_vertices(depth_image, 0.1, 4), grid_faces(height, width)
+    write_binary_stl(path, vertices, faces)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', type=int, default=3000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--topology', choices=['grid', 'closed'], default='closed')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    unit_depth = np.random.default_rng(args.size).random((args.size, args.size))
+    path = os.path.join(tempfile.mkdtemp(), 'bench_parallel.stl')
+
+    def best_of(fn):
+        times = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    serial_time = best_of(lambda: serial_stl(path, unit_depth, args.topology))
+    print(f"{os.cpu_count()} CPUs, {args.size}x{args.size} {args.topology} mesh")
+    print(f"{'workers':>8} {'time (s)':>10} {'speedup':>8}")
+    print(f"{'serial':>8} {serial_time:>10.3f} {1:>7.2f}x")
+    for workers in args.workers:
+        elapsed = best_of(lambda: write_parallel_stl(path, unit_depth, 10, 0.1, 4, args.topology, workers))
+        print(f"{workers:>8} {elapsed:>10.3f} {serial_time / elapsed:>7.2f}x")
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+"""
+Benchmark the conversion pipeline across image sizes and options.
+
+Every case runs LithophaneCreator.create_lithophane on a synthetic image
+twice, each time in a fresh process: a timed run, whose per-stage wall times
+come from the processor's stage spans, and an untimed run under tracemalloc
+that records the peak traced memory of each stage, the peak RSS of the
+process and that of the mesh repair process. Results are written as JSON;
+--compare flags regressions against a stored baseline, such as
+benchmarks/baseline.json.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--sizes 100 1000 4000] [--output results.json]
+    python benchmarks/bench_pipeline.py --compare benchmarks/baseline.json [--output results.json]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_processing import LithophaneCreator
+
+DEFAULT_SIZES = [100, 500, 1000, 2000, 4000]
+# Settings every case starts from; each case changes one of them.
+BASE_OPTIONS = {'resolution': 1.0, 'smoothness': 1, 'repair_mesh': False}
+VARIATIONS = [{}, {'resolution': 0.5}, {'smoothness': 9}, {'repair_mesh': True}]
+
+
+def synthetic_image(path, size):
+    """
+    Write a deterministic test image with smooth areas, noise and sharp edges.
+
+    Args:
+        path (str): Path to the output PNG file.
+        size (int): Width of the image; the height is three quarters of it.
+    """
+    height = size * 3 // 4
+    y, x = np.mgrid[0:height, 0:size]
+    image = 128 + 60 * np.sin(x / (size / 7)) * np.cos(y / (height / 5))
+    image += np.random.default_rng(size).normal(0, 8, image.shape)
+    image = np.clip(image, 0, 255).astype(np.uint8)
+    cv2.putText(image, 'Lithophane', (size // 10, height // 2), cv2.FONT_HERSHEY_SIMPLEX, size / 300, 255, max(1, size // 150))
+    cv2.imwrite(path, image)
+
+
+def case_name(size, options):
+    return f"size={size} resolution={options['resolution']} smoothness={options['smoothness']} repair={options['repair_mesh']}"
+
+
+def create_processor(options, progress=None):
+    return LithophaneCreator(
+        max_depth=10,
+        base_thickness=4,
+        output_width=200,
+        invert=False,
+        grayscale=True,
+        top_surface_smoothness=9,
+        progress=progress,
+        **options
+    )
+
+
+def remove_outputs(output_path):
+    # A repair that fell back leaves no _fixed file
+    for path in (output_path, output_path.replace('.stl', '_fixed.stl')):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def time_case(image_path, output_path, size, options):
+    """
+    Run create_lithophane once and time each of its stages.
+
+    Meant to run in a fresh process, so no stage is served from the stage
+    caches.
+
+    Args:
+        image_path (str): Path to the synthetic image.
+        output_path (str): Path to the output STL file.
+        size (int): Width of the synthetic image.
+        options (dict): resolution, smoothness and repair_mesh.
+
+    Returns:
+        dict: Case parameters, per-stage seconds, total seconds and the
+        triangle count.
+    """
+    processor = create_processor(options)
+    start = time.perf_counter()
+    processor.create_lithophane(image_path, output_path)
+    total_seconds = time.perf_counter() - start
+    remove_outputs(output_path)
+
+    stages = {}
+    for span in processor.stats['spans']:
+        stage = stages.setdefault(span['stage'], {'seconds': 0.0})
+        stage['seconds'] += span['seconds']
+    width, height = processor.stats['image_size']
+    return {
+        'case': case_name(size, options),
+        'size': size,
+        **options,
+        'pixels': width * height,
+        'triangles': processor.stats['triangles'],
+        'stages': stages,
+        'total_seconds': total_seconds,
+    }
+
+
+def measure_case(image_path, output_path, options):
+    """
+    Run create_lithophane once under tracemalloc and measure its memory.
+
+    The traced peak of each stage is taken between the start and end
+    progress reports of the stage. Meant to run in a fresh process, so the
+    peak RSS belongs to this case.
+
+    Args:
+        image_path (str): Path to the synthetic image.
+        output_path (str): Path to the output STL file.
+        options (dict): resolution, smoothness and repair_mesh.
+
+    Returns:
+        dict: Peak traced MB per stage and overall, peak RSS in MB, and the
+        peak RSS of the repair process in MB, or None without repair.
+    """
+    peaks = {}
+    running = set()
+
+    def progress(stage, fraction):
+        peak = tracemalloc.get_traced_memory()[1]
+        for name in running:
+            peaks[name] = max(peaks[name], peak)
+        tracemalloc.reset_peak()
+        if fraction == 0.0:
+            running.add(stage)
+            peaks.setdefault(stage, 0)
+        elif fraction >= 1.0:
+            running.discard(stage)
+
+    processor = create_processor(options, progress)
+    tracemalloc.start()
+    processor.create_lithophane(image_path, output_path)
+    peak_traced = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    remove_outputs(output_path)
+
+    # ru_maxrss is in kilobytes on Linux; the only children are repair processes
+    repair_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return {
+        'stage_peak_mb': {name: peak / 2**20 for name, peak in peaks.items()},
+        'peak_traced_mb': max([peak_traced, *peaks.values()]) / 2**20,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'repair_peak_rss_mb': repair_rss if options['repair_mesh'] else None,
+    }
+
+
+def run_in_fresh_process(context, fn, *args):
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(fn, *args).result()
+
+
+def run_benchmarks(sizes, repair_max_size):
+    """
+    Run every case, timed and measured in separate fresh processes.
+
+    Args:
+        sizes (list): Widths of the synthetic images.
+        repair_max_size (int): Largest size that is also run with repair.
+
+    Returns:
+        list: Results of time_case with the measurements of measure_case
+        added, in run order.
+    """
+    folder = tempfile.mkdtemp()
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for size in sizes:
+        image_path = os.path.join(folder, f'bench_{size}.png')
+        synthetic_image(image_path, size)
+        for variation in VARIATIONS:
+            options = {**BASE_OPTIONS, **variation}
+            if options['repair_mesh'] and size > repair_max_size:
+                continue
+            output_path = os.path.join(folder, 'bench.stl')
+            result = run_in_fresh_process(context, time_case, image_path, output_path, size, options)
+            memory = run_in_fresh_process(context, measure_case, image_path, output_path, options)
+            for name, stage in result['stages'].items():
+                stage['peak_mb'] = memory['stage_peak_mb'].get(name)
+            result.update({name: value for name, value in memory.items() if name != 'stage_peak_mb'})
+            results.append(result)
+            stages = ' '.join(f"{name}={stage['seconds']:.3f}s" for name, stage in result['stages'].items())
+            print(f"{result['case']:<55} {result['triangles']:>10} tris {result['peak_rss_mb']:>8.1f} MB  {stages}")
+        os.remove(image_path)
+    os.rmdir(folder)
+    return results
+
+
+def compare(results, baseline, threshold, min_seconds):
+    """
+    Compare results against a baseline and report regressions.
+
+    A stage regresses when it takes more than threshold longer than in the
+    baseline and at least min_seconds longer; memory regresses when the peak
+    RSS grows by more than threshold.
+
+    Args:
+        results (list): Current results.
+        baseline (list): Baseline results.
+        threshold (float): Allowed relative slowdown, e.g. 0.1 for 10%.
+        min_seconds (float): Slowdowns below this are treated as noise.
+
+    Returns:
+        list: Descriptions of the regressions found.
+    """
+    previous = {result['case']: result for result in baseline}
+    regressions = []
+    print(f"\n{'case':<55} {'metric':<14} {'baseline':>10} {'current':>10} {'change':>8}")
+    for result in results:
+        old = previous.get(result['case'])
+        if old is None:
+            continue
+        metrics = [(f'{name} s', stage['seconds'], old['stages'].get(name, {}).get('seconds'))
+                   for name, stage in result['stages'].items()]
+        metrics.append(('total s', result['total_seconds'], old['total_seconds']))
+        metrics.append(('peak RSS MB', result['peak_rss_mb'], old['peak_rss_mb']))
+        for metric, current, before in metrics:
+            if not before:
+                continue
+            change = current / before - 1
+            regressed = change > threshold and (metric.endswith('MB') or current - before >= min_seconds)
+            flag = '  REGRESSION' if regressed else ''
+            print(f"{result['case']:<55} {metric:<14} {before:>10.3f} {current:>10.3f} {change:>+7.1%}{flag}")
+            if regressed:
+                regressions.append(f"{result['case']}: {metric} {before:.3f} -> {current:.3f} ({change:+.1%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--repair-max-size', type=int, default=100,
+                        help="largest size also run with repair (PyMeshFix is slow on large meshes)")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--compare', help="baseline JSON file to compare against")
+    parser.add_argument('--threshold', type=float, default=0.1, help="allowed relative slowdown (default: 0.1)")
+    parser.add_argument('--min-seconds', type=float, default=0.01, help="ignore slowdowns below this (default: 0.01)")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.repair_max_size)
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold, args.min_seconds)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s):")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regressions")
+
+
+if __name__ == '__main__':
+    main()
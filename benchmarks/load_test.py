@@ -0,0 +1,455 @@
+"""
+Load test the conversion service.
+
+Starts app.py in a fresh server process (or targets a running one with
+--url), then submits conversions to the / POST endpoint at a target rate,
+drawing each request from a mix of image sizes and option sets. Every
+request is timed from its scheduled send time until its job is done,
+following the job's event stream, so time spent waiting for a free client
+thread counts too. Reports throughput, latency percentiles, the error rate and
+the resident memory of the server and its job workers; results can be
+written as JSON to compare execution models on the same machine.
+
+Usage:
+    python benchmarks/load_test.py [--rate 2] [--duration 30] [--sizes 256 1024]
+    python benchmarks/load_test.py --options topology=closed "topology=grid,repair_mesh=true" \
+        --server-env WORKERS=2 --output results.json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_pipeline import synthetic_image
+
+DEFAULT_SIZES = [256, 512, 1024]
+DEFAULT_OPTIONS = ['topology=closed', 'topology=grid', 'topology=closed,max_error=0.1']
+# Requests sent this many seconds after their scheduled time are counted as
+# late: the client, not the server, could not keep up with the rate.
+LATE_SECONDS = 0.05
+# Starts the app with the threaded development server, as app.py does when
+# run directly but without the reloader.
+SERVER_SCRIPT = """
+import sys
+from app import app, warm_up
+from config import Config
+if Config.WARM_UP:
+    warm_up()
+app.run(host='127.0.0.1', port=int(sys.argv[1]), threaded=True)
+"""
+
+
+def parse_options(text):
+    """
+    Parse an option set.
+
+    Args:
+        text (str): Comma separated name=value form fields, e.g.
+            "topology=grid,repair_mesh=true".
+
+    Returns:
+        dict: Form fields.
+    """
+    fields = {}
+    for item in filter(None, text.split(',')):
+        name, _, value = item.partition('=')
+        fields[name.strip()] = value.strip()
+    return fields
+
+
+def percentile(values, fraction):
+    """
+    Returns:
+        float: The value below which the given fraction of values falls, or
+        None without values.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def tree_rss(pid):
+    """
+    Resident memory of a process and of its descendants, such as the job
+    workers of the server.
+
+    Args:
+        pid (int): Process id.
+
+    Returns:
+        tuple: (process bytes, total bytes), or (None, None) where /proc is
+        not available.
+    """
+    children = {}
+    rss = {}
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    try:
+        entries = [entry for entry in os.listdir('/proc') if entry.isdigit()]
+    except OSError:
+        return None, None
+    for entry in entries:
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name may contain spaces; the fields after it do not
+                fields = f.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        children.setdefault(int(fields[1]), []).append(int(entry))
+        rss[int(entry)] = int(fields[21]) * page_size
+    total = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        total += rss.get(current, 0)
+        stack.extend(children.get(current, []))
+    return rss.get(pid), total
+
+
+def encode_multipart(fields, filename, data):
+    """
+    Encode a form with one file as multipart/form-data.
+
+    Returns:
+        tuple: (body, content type).
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f'Content-Type: image/jpeg\r\n\r\n'.encode() + data + b'\r\n'
+    )
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class ImageSource:
+    """
+    JPEG uploads of the synthetic benchmark images.
+
+    Unless repeat is set, every image gets a distinct stamp in its corner so
+    that no request is answered from the result cache or joins another job.
+    """
+    def __init__(self, sizes, repeat=False):
+        self.repeat = repeat
+        self.images = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        with tempfile.TemporaryDirectory() as folder:
+            for size in sizes:
+                path = os.path.join(folder, f'load_{size}.png')
+                synthetic_image(path, size)
+                self.images[size] = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+
+    def get(self, size):
+        """
+        Returns:
+            bytes: A JPEG image of the given width.
+        """
+        image = self.images[size]
+        if not self.repeat:
+            with self._lock:
+                self._count += 1
+                count = self._count
+            image = image.copy()
+            image[0, :8] = np.frombuffer(count.to_bytes(8, 'little'), dtype=np.uint8)
+        return cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+def wait_for_job(base_url, response, timeout):
+    """
+    Follow the event stream of a job, or poll its status, until it finishes.
+
+    Args:
+        base_url (str): Server URL.
+        response (dict): JSON response of the upload.
+        timeout (float): Seconds to wait.
+
+    Returns:
+        dict: Final job status.
+    """
+    if response.get('events_url'):
+        with urllib.request.urlopen(base_url + response['events_url'], timeout=timeout) as stream:
+            done = False
+            for line in stream:
+                line = line.decode().rstrip('\n')
+                if line == 'event: done':
+                    done = True
+                elif done and line.startswith('data: '):
+                    return json.loads(line[len('data: '):])
+        raise RuntimeError("Event stream ended before the job finished")
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with urllib.request.urlopen(base_url + response['status_url'], timeout=timeout) as f:
+            status = json.load(f)
+        if status['status'] in ('done', 'failed'):
+            return status
+        time.sleep(0.1)
+    raise TimeoutError("Job did not finish")
+
+
+def run_request(base_url, images, size, fields, timeout, scheduled=None):
+    """
+    Upload one image and wait for its conversion.
+
+    Args:
+        scheduled (float): time.perf_counter() time the request was due to
+            be sent, which its latencies are measured from; None sends it
+            now.
+
+    Returns:
+        dict: Size, options, outcome ("ok", "failed", "rejected" or
+        "error"), seconds from the scheduled time until the upload was
+        answered and until the conversion was done, seconds the request
+        started late, and the error message if any.
+    """
+    start = time.perf_counter() if scheduled is None else scheduled
+    record = {'size': size, 'options': fields, 'start_delay': time.perf_counter() - start}
+    body, content_type = encode_multipart(fields, 'load.jpg', images.get(size))
+    try:
+        request = urllib.request.Request(base_url + '/', data=body, headers={'Content-Type': content_type})
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as f:
+                response = json.load(f)
+        except urllib.error.HTTPError as e:
+            record['submit_seconds'] = time.perf_counter() - start
+            record['outcome'] = 'rejected' if e.code in (413, 429) else 'error'
+            record['error'] = f"HTTP {e.code}"
+            return record
+        record['submit_seconds'] = time.perf_counter() - start
+        if not response.get('success'):
+            record['outcome'] = 'error'
+            record['error'] = response.get('error')
+            return record
+        if response['status'] != 'done':
+            response = wait_for_job(base_url, response, timeout)
+        record['seconds'] = time.perf_counter() - start
+        record['outcome'] = 'ok' if response['status'] == 'done' else 'failed'
+        if response.get('error'):
+            record['error'] = response['error']
+    except Exception as e:
+        record['outcome'] = 'error'
+        record['error'] = f"{type(e).__name__}: {e}"
+    return record
+
+
+def start_server(port, env):
+    """
+    Start app.py in a server process working in a temporary folder.
+
+    Args:
+        port (int): Port to listen on.
+        env (dict): Extra environment variables, e.g. WORKERS.
+
+    Returns:
+        tuple: (process, working folder).
+    """
+    folder = tempfile.mkdtemp()
+    process_env = {**os.environ, **env, 'PYTHONPATH': os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')]))}
+    process = subprocess.Popen(
+        [sys.executable, '-c', SERVER_SCRIPT, str(port)], cwd=folder, env=process_env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        # A process group, so the job workers are stopped with the server
+        start_new_session=True,
+    )
+    return process, folder
+
+
+def wait_until_ready(base_url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(base_url + '/queue/stats', timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server at {base_url} did not start")
+
+
+def run_load(base_url, images, sizes, option_sets, rate, duration, concurrency, timeout, server_pid=None, seed=0):
+    """
+    Submit requests at a fixed rate and collect their results.
+
+    Requests are started on schedule whether or not earlier ones finished
+    (an open loop), up to the concurrency limit, so an overloaded server
+    shows up as growing latency rather than a lower request rate. Latencies
+    are measured from the scheduled time, so requests held back by the
+    concurrency limit count their wait, and are recorded as late.
+
+    Returns:
+        tuple: (request records, elapsed seconds, RSS samples as
+        (server bytes, total bytes) tuples).
+    """
+    rng = random.Random(seed)
+    samples = []
+    stop = threading.Event()
+
+    def sample_rss():
+        while not stop.wait(0.25):
+            samples.append(tree_rss(server_pid))
+
+    sampler = None
+    if server_pid is not None:
+        sampler = threading.Thread(target=sample_rss, daemon=True)
+        sampler.start()
+
+    futures = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for index in range(int(rate * duration)):
+            scheduled = start + index / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            size, fields = rng.choice(sizes), rng.choice(option_sets)
+            futures.append(executor.submit(run_request, base_url, images, size, fields, timeout, scheduled))
+        records = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+    stop.set()
+    if sampler is not None:
+        sampler.join()
+    return records, elapsed, samples
+
+
+def summarize(records, elapsed, samples):
+    """
+    Aggregate request records.
+
+    Returns:
+        dict: Request counts by outcome, throughput in conversions per
+        second, latency percentiles in seconds, the error rate, the number
+        of requests that started late with the longest delay, and the peak
+        RSS of the server and of the server with its job workers in MB.
+    """
+    outcomes = {}
+    for record in records:
+        outcomes[record['outcome']] = outcomes.get(record['outcome'], 0) + 1
+    latencies = [record['seconds'] for record in records if record['outcome'] == 'ok']
+    submits = [record['submit_seconds'] for record in records if 'submit_seconds' in record]
+    samples = [sample for sample in samples if sample[0] is not None]
+    return {
+        'requests': len(records),
+        'outcomes': outcomes,
+        'seconds': elapsed,
+        'throughput': len(latencies) / elapsed if elapsed else 0,
+        'error_rate': (len(records) - len(latencies)) / len(records) if records else 0,
+        'latency': {name: percentile(latencies, fraction) for name, fraction in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))},
+        'submit_latency': {name: percentile(submits, fraction) for name, fraction in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))},
+        'late_requests': sum(record['start_delay'] > LATE_SECONDS for record in records),
+        'max_start_delay': max((record['start_delay'] for record in records), default=0),
+        'peak_server_rss_mb': max((sample[0] for sample in samples), default=0) / 2**20 or None,
+        'peak_total_rss_mb': max((sample[1] for sample in samples), default=0) / 2**20 or None,
+    }
+
+
+def print_report(summary, records):
+    def seconds(value):
+        return f"{value:.3f}s" if value is not None else '-'
+
+    print(f"{summary['requests']} requests in {summary['seconds']:.1f}s: "
+          + ', '.join(f"{count} {outcome}" for outcome, count in sorted(summary['outcomes'].items())))
+    print(f"throughput   {summary['throughput']:.2f} conversions/s, error rate {summary['error_rate']:.1%}")
+    for name, label in (('latency', 'latency'), ('submit_latency', 'upload')):
+        print(f"{label:<13}" + '  '.join(f"{p} {seconds(value)}" for p, value in summary[name].items()))
+    if summary['late_requests']:
+        print(f"late starts  {summary['late_requests']} requests, up to {summary['max_start_delay']:.3f}s: "
+              "the concurrency limit or the client held them back")
+    if summary['peak_server_rss_mb']:
+        print(f"peak RSS     server {summary['peak_server_rss_mb']:.1f} MB, with job workers {summary['peak_total_rss_mb']:.1f} MB")
+
+    groups = {}
+    for record in records:
+        if record['outcome'] == 'ok':
+            label = f"size={record['size']} " + ','.join(f"{name}={value}" for name, value in record['options'].items())
+            groups.setdefault(label, []).append(record['seconds'])
+    print(f"\n{'case':<55} {'count':>6} {'p50':>9} {'p95':>9}")
+    for label, latencies in sorted(groups.items()):
+        print(f"{label:<55} {len(latencies):>6} {seconds(percentile(latencies, 0.5)):>9} {seconds(percentile(latencies, 0.95)):>9}")
+    errors = sorted({record['error'] for record in records if record.get('error')})
+    for error in errors[:5]:
+        print(f"error: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', help="load test a running server instead of starting one")
+    parser.add_argument('--port', type=int, default=5055, help="port of the started server (default: %(default)s)")
+    parser.add_argument('--server-env', nargs='*', default=[], metavar='NAME=VALUE',
+                        help="environment of the started server, e.g. WORKERS=2 ADMISSION_BUDGET_MB=0")
+    parser.add_argument('--rate', type=float, default=1.0, help="requests per second (default: %(default)s)")
+    parser.add_argument('--duration', type=float, default=30.0, help="seconds to submit requests for (default: %(default)s)")
+    parser.add_argument('--concurrency', type=int, default=64, help="maximum requests in flight (default: %(default)s)")
+    parser.add_argument('--timeout', type=float, default=300.0, help="seconds to wait for each conversion (default: %(default)s)")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="widths of the uploaded images")
+    parser.add_argument('--options', nargs='+', default=DEFAULT_OPTIONS, metavar='NAME=VALUE,...',
+                        help="option sets, as comma separated form fields (default: %(default)s)")
+    parser.add_argument('--repeat-images', action='store_true',
+                        help="upload identical images, so repeated requests are served from the result cache")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the request mix")
+    parser.add_argument('--output', help="write the summary and request records to this JSON file")
+    args = parser.parse_args()
+
+    images = ImageSource(args.sizes, args.repeat_images)
+    option_sets = [parse_options(options) for options in args.options]
+    server_env = dict(item.split('=', 1) for item in args.server_env)
+
+    process = folder = None
+    if args.url:
+        base_url = args.url.rstrip('/')
+    else:
+        base_url = f'http://127.0.0.1:{args.port}'
+        process, folder = start_server(args.port, server_env)
+    try:
+        wait_until_ready(base_url)
+        records, elapsed, samples = run_load(
+            base_url, images, args.sizes, option_sets, args.rate, args.duration, args.concurrency, args.timeout,
+            server_pid=process.pid if process else None, seed=args.seed,
+        )
+    finally:
+        if process is not None:
+            os.killpg(process.pid, signal.SIGTERM)
+            process.wait()
+            shutil.rmtree(folder, ignore_errors=True)
+
+    summary = summarize(records, elapsed, samples)
+    print_report(summary, records)
+    if args.output:
+        report = {
+            'meta': {
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'url': args.url,
+                'server_env': server_env,
+                'rate': args.rate,
+                'duration': args.duration,
+                'sizes': args.sizes,
+                'options': option_sets,
+                'cpus': os.cpu_count(),
+            },
+            'summary': summary,
+            'requests': records,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
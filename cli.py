@@ -0,0 +1,237 @@
+"""
+Convert images to lithophane meshes in bulk.
+
+Usage:
+    python cli.py photos/ catalog/*.jpg -o outputs/ [--workers 8] [--topology closed]
+
+Inputs may be image files, directories (searched for images, recursively
+with --recursive) or glob patterns. Outputs are written to the output
+folder, mirroring the layout below each input directory; outputs newer than
+their image are skipped unless --force is given. Images of different inputs
+that would write the same output, such as photos/x.png and catalog/x.jpg,
+are reported and nothing is converted.
+"""
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from config import Config
+from image_processing import LithophaneCreator, TOPOLOGIES
+from mesh_formats import FORMATS
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def find_images(inputs, recursive=False):
+    """
+    Expand input files, directories and glob patterns into image paths.
+
+    Args:
+        inputs (list): Paths or glob patterns.
+        recursive (bool): Search directories recursively.
+
+    Yields:
+        tuple: (image_path, relative_path), where relative_path is the path
+        of the image below its input directory, or its file name.
+    """
+    seen = set()
+    for pattern in inputs:
+        paths = [pattern] if os.path.exists(pattern) else sorted(glob.glob(pattern, recursive=True))
+        for path in paths:
+            if os.path.isdir(path):
+                if recursive:
+                    walk = ((root, files) for root, _, files in os.walk(path))
+                else:
+                    walk = [(path, os.listdir(path))]
+                candidates = [
+                    os.path.join(root, name) for root, files in walk for name in files
+                    if name.lower().endswith(IMAGE_EXTENSIONS)
+                ]
+                entries = [(candidate, os.path.relpath(candidate, path)) for candidate in sorted(candidates)]
+            elif path.lower().endswith(IMAGE_EXTENSIONS):
+                entries = [(path, os.path.basename(path))]
+            else:
+                entries = []
+            for image_path, relative_path in entries:
+                key = os.path.abspath(image_path)
+                if key not in seen and os.path.isfile(image_path):
+                    seen.add(key)
+                    yield image_path, relative_path
+
+
+def output_path_for(relative_path, output_folder, output_format):
+    """
+    Returns:
+        str: Output path of an image, mirroring its relative path.
+    """
+    return os.path.join(output_folder, f"{os.path.splitext(relative_path)[0]}.{output_format}")
+
+
+def is_up_to_date(image_path, output_path):
+    """
+    Returns:
+        bool: True if the output exists and is newer than the image.
+    """
+    return os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(image_path)
+
+
+def current_umask():
+    """
+    Returns:
+        int: The umask of this process, which can only be read by setting it.
+    """
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+def convert_image(image_path, output_path, options):
+    """
+    Convert one image in a worker process.
+
+    The mesh is written under a unique temporary name and moved into place
+    when complete, so an interrupted run never leaves an output that looks
+    up to date.
+
+    Args:
+        image_path (str): Path to the input image.
+        output_path (str): Path to the output mesh.
+        options (dict): LithophaneCreator parameters.
+
+    Returns:
+        dict: Triangle count, conversion time in seconds and the repair
+        outcome, if any (see LithophaneCreator.stats).
+    """
+    start = time.perf_counter()
+    folder, name = os.path.split(output_path)
+    os.makedirs(folder or '.', exist_ok=True)
+    stem = name[:-len(options['output_format']) - 1]
+    fd, partial_path = tempfile.mkstemp(dir=folder or '.', prefix=f".{stem}.", suffix=f".partial.{options['output_format']}")
+    os.close(fd)
+    # mkstemp makes the file private; give it the mode of a newly created file
+    os.chmod(partial_path, 0o666 & ~current_umask())
+    processor = LithophaneCreator(**options)
+    try:
+        result_path = processor.create_lithophane(image_path, partial_path)
+        os.replace(result_path, output_path)
+    finally:
+        # The unrepaired STL, or everything on failure
+        for path in (partial_path, partial_path.replace(".stl", "_fixed.stl")):
+            if os.path.exists(path):
+                os.remove(path)
+    return {"triangles": processor.stats['triangles'], "seconds": time.perf_counter() - start, "repair": processor.stats.get('repair')}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('inputs', nargs='+', help="image files, directories or glob patterns")
+    parser.add_argument('-o', '--output', default='outputs', help="output folder (default: outputs)")
+    parser.add_argument('-r', '--recursive', action='store_true', help="search input directories recursively")
+    parser.add_argument('-f', '--force', action='store_true', help="convert images even if their output is up to date")
+    parser.add_argument('-j', '--workers', type=int, default=Config.WORKERS, help="worker processes (default: %(default)s)")
+    parser.add_argument('--max-depth', type=int, default=Config.MAX_DEPTH)
+    parser.add_argument('--base-thickness', type=int, default=Config.BASE_THICKNESS)
+    parser.add_argument('--output-width', type=int, default=Config.OUTPUT_WIDTH)
+    parser.add_argument('--resolution', type=float, default=Config.RESOLUTION)
+    parser.add_argument('--smoothness', type=int, default=Config.SMOOTHNESS)
+    parser.add_argument('--top-surface-smoothness', type=int, default=Config.TOP_SURFACE_SMOOTHNESS)
+    parser.add_argument('--invert', action=argparse.BooleanOptionalAction, default=Config.INVERT)
+    parser.add_argument('--grayscale', action=argparse.BooleanOptionalAction, default=Config.GRAY_SCALE)
+    parser.add_argument('--repair', action=argparse.BooleanOptionalAction, default=True,
+                        help="repair grid meshes with PyMeshFix (closed and adaptive meshes never need it)")
+    parser.add_argument('--topology', choices=TOPOLOGIES, default=Config.TOPOLOGY)
+    parser.add_argument('--max-error', type=float, default=Config.MAX_ERROR)
+    parser.add_argument('--format', dest='output_format', choices=FORMATS, default=Config.OUTPUT_FORMAT)
+    parser.add_argument('--memory-budget-mb', type=int, default=Config.MEMORY_BUDGET_MB,
+                        help="generate unrepaired STL meshes in bands within this budget (0: off)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    repair_mesh = args.repair and args.topology == 'grid' and args.max_error == 0
+    tiled = not repair_mesh and args.max_error == 0 and args.output_format in ('stl', 'stl.gz')
+    options = {
+        "max_depth": args.max_depth,
+        "base_thickness": args.base_thickness,
+        "output_width": args.output_width,
+        "invert": args.invert,
+        "resolution": args.resolution,
+        "smoothness": args.smoothness,
+        "grayscale": args.grayscale,
+        "top_surface_smoothness": args.top_surface_smoothness,
+        "repair_mesh": repair_mesh,
+        "topology": args.topology,
+        "max_error": args.max_error,
+        "output_format": args.output_format,
+        "memory_budget_mb": args.memory_budget_mb if tiled and args.memory_budget_mb else None,
+    }
+
+    images = list(find_images(args.inputs, args.recursive))
+    sources = {}
+    for image_path, relative_path in images:
+        sources.setdefault(output_path_for(relative_path, args.output, args.output_format), []).append(image_path)
+    collisions = {output_path: paths for output_path, paths in sources.items() if len(paths) > 1}
+    if collisions:
+        for output_path, paths in sorted(collisions.items()):
+            print(f"{', '.join(paths)} would all be written to {output_path}", file=sys.stderr)
+        print("Rename the images or convert the inputs to separate output folders", file=sys.stderr)
+        return 2
+    total = len(images)
+    converted = skipped = failed = triangles = 0
+    start = time.perf_counter()
+
+    def report(done, message):
+        print(f"[{done}/{total}] {message}", flush=True)
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        # Keep a bounded number of images in flight so progress streams and
+        # results are never buffered
+        pending = {}
+        queue = iter(images)
+        done = 0
+        while True:
+            while len(pending) < 2 * args.workers:
+                entry = next(queue, None)
+                if entry is None:
+                    break
+                image_path, relative_path = entry
+                output_path = output_path_for(relative_path, args.output, args.output_format)
+                if not args.force and is_up_to_date(image_path, output_path):
+                    skipped += 1
+                    done += 1
+                    report(done, f"{image_path}: up to date")
+                    continue
+                pending[executor.submit(convert_image, image_path, output_path, options)] = (image_path, output_path)
+            if not pending:
+                break
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                image_path, output_path = pending.pop(future)
+                done += 1
+                try:
+                    result = future.result()
+                except Exception as e:
+                    failed += 1
+                    report(done, f"{image_path}: failed: {e}")
+                    continue
+                converted += 1
+                triangles += result["triangles"]
+                message = f"{image_path} -> {output_path} ({result['triangles']} triangles, {result['seconds']:.2f}s)"
+                if result["repair"] and result["repair"].get("error"):
+                    message += f", unrepaired: {result['repair']['error']}"
+                report(done, message)
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"Converted {converted}, skipped {skipped}, failed {failed} of {total} images in {elapsed:.2f}s: "
+        f"{converted / elapsed if elapsed else 0:.2f} images/s, {triangles / elapsed if elapsed else 0:,.0f} triangles/s"
+    )
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
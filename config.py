@@ -1,7 +1,28 @@
-from dotenv import load_dotenv
 import os
 
-load_dotenv()
+def load_env_file():
+    """
+    Load variables from the nearest .env file in the folder of this module
+    or its parents, as python-dotenv would, importing python-dotenv only
+    when there is such a file; deployments configured through the
+    environment skip it.
+
+    Returns:
+        str: Path to the loaded file, or None if there is none.
+    """
+    folder = os.path.dirname(os.path.abspath(__file__))
+    while True:
+        path = os.path.join(folder, '.env')
+        if os.path.isfile(path):
+            from dotenv import load_dotenv
+            load_dotenv(path)
+            return path
+        parent = os.path.dirname(folder)
+        if parent == folder:
+            return None
+        folder = parent
+
+load_env_file()
 
 class Config:
     """
@@ -16,6 +37,37 @@ class Config:
         GRAY_SCALE (bool): Flag to convert the image to grayscale.
         TOP_SURFACE_SMOOTHNESS (int): Smoothness factor for the top surface.
         INVERT (bool): Flag to invert the depth of the lithophane.
+        TOPOLOGY (str): Mesh layout, "grid" or "closed" (watertight, no repair needed).
+        MAX_ERROR (float): Maximum vertical error in mm for adaptive triangulation (0 disables it).
+        WORKERS (int): Number of worker processes for conversion jobs (default: CPU count).
+        OUTPUT_CACHE_MB (int): Size budget of the generated STL cache in outputs/.
+        UPLOAD_CACHE_MB (int): Size budget of the uploaded images in uploads/.
+        STAGE_CACHE_MB (int): Memory budget for cached pipeline stages, split evenly
+            between the job workers (a CLI run gets all of it). It is taken out of
+            ADMISSION_BUDGET_MB, since the caches stay allocated between jobs.
+        MEMORY_BUDGET_MB (int): Working memory budget for generating meshes without
+            repair or adaptive triangulation in bands (0 builds the whole mesh at once).
+        MESH_WORKERS (int): Processes meshing bands of one conversion without repair or
+            adaptive triangulation in parallel (1 meshes in the job's own process).
+        PREVIEW_SIZE (int): Longest side in pixels of the quick preview mesh returned
+            while the full resolution mesh is built (0 disables previews).
+        PREVIEW_BUDGET_MS (int): Longest time an upload may spend building its preview;
+            images estimated to take longer, or uploads arriving while another
+            preview is being built, get none.
+        OUTPUT_FORMAT (str): Default mesh file format, "stl", "stl.gz", "3mf" or "ply".
+        LOD_SIZES (tuple): Longest sides in pixels of the levels of detail built for the
+            in-browser viewer, comma separated (empty disables them).
+        ADMISSION_BUDGET_MB (int): Estimated memory of the conversion jobs in flight plus
+            STAGE_CACHE_MB; jobs beyond it wait in a queue (0 admits every job at once).
+        ADMISSION_QUEUE (int): Jobs that may wait for the admission budget before new
+            ones are rejected with HTTP 429.
+        REPAIR_TIMEOUT (float): Seconds a mesh repair may run before the unrepaired mesh
+            is served instead (0: no limit).
+        REPAIR_MEMORY_MB (int): Memory a mesh repair may allocate before the unrepaired
+            mesh is served instead (0: no limit). Keep it below ADMISSION_BUDGET_MB, or
+            jobs with repair are rejected as too large.
+        WARM_UP (bool): Load the conversion engine and run a small conversion at startup
+            (wsgi.py, or app.py run directly) instead of on the first request.
     """
     MAX_DEPTH = int(os.getenv('MAX_DEPTH', 10))
     BASE_THICKNESS = int(os.getenv('BASE_THICKNESS', 4))
@@ -25,3 +77,20 @@ class Config:
     GRAY_SCALE = os.getenv('GRAY_SCALE', 'True').lower() == 'true'
     TOP_SURFACE_SMOOTHNESS = int(os.getenv('TOP_SURFACE_SMOOTHNESS', 9))
     INVERT = os.getenv('INVERT', 'False').lower() == 'true'
+    TOPOLOGY = os.getenv('TOPOLOGY', 'grid')
+    MAX_ERROR = float(os.getenv('MAX_ERROR', 0.0))
+    WORKERS = int(os.getenv('WORKERS', os.cpu_count() or 1))
+    OUTPUT_CACHE_MB = int(os.getenv('OUTPUT_CACHE_MB', 1024))
+    UPLOAD_CACHE_MB = int(os.getenv('UPLOAD_CACHE_MB', 256))
+    STAGE_CACHE_MB = int(os.getenv('STAGE_CACHE_MB', 512))
+    MEMORY_BUDGET_MB = int(os.getenv('MEMORY_BUDGET_MB', 0))
+    MESH_WORKERS = int(os.getenv('MESH_WORKERS', 1))
+    PREVIEW_SIZE = int(os.getenv('PREVIEW_SIZE', 128))
+    PREVIEW_BUDGET_MS = int(os.getenv('PREVIEW_BUDGET_MS', 300))
+    OUTPUT_FORMAT = os.getenv('OUTPUT_FORMAT', 'stl')
+    LOD_SIZES = tuple(int(size) for size in os.getenv('LOD_SIZES', '64,256,1024').split(',') if size.strip())
+    ADMISSION_BUDGET_MB = int(os.getenv('ADMISSION_BUDGET_MB', 4608))
+    ADMISSION_QUEUE = int(os.getenv('ADMISSION_QUEUE', 32))
+    REPAIR_TIMEOUT = float(os.getenv('REPAIR_TIMEOUT', 300))
+    REPAIR_MEMORY_MB = int(os.getenv('REPAIR_MEMORY_MB', 2048))
+    WARM_UP = os.getenv('WARM_UP', 'True').lower() == 'true'
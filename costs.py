@@ -0,0 +1,6 @@
+from collections import namedtuple
+
+# Estimated peak memory in bytes and run time in seconds of a conversion, see
+# LithophaneCreator.estimate_cost. Kept apart from jobs so that the conversion
+# engine does not depend on the job layer, which admits jobs by it.
+JobCost = namedtuple('JobCost', ['memory_bytes', 'seconds'])
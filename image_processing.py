@@ -1,8 +1,195 @@
+import copy
+import functools
+import gzip
+import hashlib
 import os
+import struct
+import tempfile
+import time
+import zipfile
+from contextlib import contextmanager
+from fractions import Fraction
 import cv2
 import numpy as np
-from stl import mesh
-import pymeshfix
+from mesh_builder import grid_vertices, grid_faces, closed_vertices, closed_faces, grid_triangle_count, closed_triangle_count
+from stl_writer import write_binary_stl, BinaryStlWriter
+from parallel_mesh import band_mesh, write_parallel_stl
+from mesh_formats import FORMATS, GZIP_LEVEL, write_mesh, write_lod
+from adaptive_mesh import adaptive_mesh
+from mesh_repair import repair_arrays, RepairError, REPAIRED
+from stage_cache import StageCache
+from metrics import span
+from costs import JobCost
+from config import Config
+
+# Mesh layouts supported by LithophaneCreator: "grid" is the original layout
+# with internal side walls, "closed" is watertight by construction.
+TOPOLOGIES = ('grid', 'closed')
+
+# Settings that only move vertices, so variants differing in them share the
+# depth map and face index array (see create_variants).
+VARIANT_PARAMS = ('max_depth', 'base_thickness', 'output_width')
+
+# Per-process caches of the pipeline stages, shared by all LithophaneCreator
+# instances: decoded images, unit depth maps and face index arrays.
+decode_cache = StageCache(Config.STAGE_CACHE_MB * 2**20 // 4)
+depth_cache = StageCache(Config.STAGE_CACHE_MB * 2**20 // 4)
+faces_cache = StageCache(Config.STAGE_CACHE_MB * 2**20 // 2)
+
+# Extension of the unit depth map files kept in LithophaneCreator.depth_folder.
+DEPTH_FILE_EXTENSION = '.depth.npy'
+
+# Rough memory cost of tiled generation, used to size the bands: bytes per
+# pixel for the depth computation and per triangle for the band faces.
+TILED_BYTES_PER_PIXEL = 160
+TILED_BYTES_PER_TRIANGLE = 24
+# Bytes per triangle while gathering and packing a chunk of STL records.
+TILED_BYTES_PER_RECORD = 256
+
+# Estimated peak memory in bytes and run time in seconds per depth map pixel
+# of whole mesh generation by mesh layout ("adaptive" for a positive
+# max_error), and what mesh repair adds; measured on 1000x1000 images (100x100
+# for repair, where PyMeshFix is far slower and larger than meshing).
+COST_BYTES_PER_PIXEL = {'grid': 560, 'closed': 170, 'adaptive': 160}
+COST_SECONDS_PER_PIXEL = {'grid': 5e-6, 'closed': 1.5e-6, 'adaptive': 0.7e-6}
+REPAIR_BYTES_PER_PIXEL = 8000
+REPAIR_SECONDS_PER_PIXEL = 8e-3
+
+# Estimated run time in seconds per source image pixel of create_preview by
+# format, where JPEG images are shrunk while decoding and PNG images are not,
+# plus a fixed part; measured with 128 pixel previews of 1 to 36 MP images.
+PREVIEW_SECONDS_PER_PIXEL = {'png': 75e-9, 'jpeg': 16e-9}
+PREVIEW_SECONDS = 0.015
+
+# JPEG start of frame markers, which hold the image size.
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# Reduced size decoding of JPEG images by the scale factors libjpeg supports,
+# largest first: (factor, grayscale flag, color flag).
+REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_GRAYSCALE_8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_GRAYSCALE_4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_GRAYSCALE_2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+def is_image_buffer(image):
+    """
+    Returns:
+        bool: True if image is encoded image data rather than a file path.
+    """
+    return isinstance(image, (bytes, bytearray, memoryview, np.ndarray))
+
+def read_image_header(image):
+    """
+    Read the format and pixel size of a PNG or JPEG image from its header,
+    without decoding it.
+
+    The size is the stored one; cv2 decoding applies the EXIF orientation of
+    JPEG images, which may swap width and height.
+
+    Args:
+        image: Path to the image file, or the encoded image as bytes or a
+            buffer.
+
+    Returns:
+        tuple: (format, width, height) with format "png" or "jpeg", or None
+        if the image is not a readable PNG or JPEG.
+    """
+    try:
+        if is_image_buffer(image):
+            view = memoryview(image).cast('B')
+            return _parse_image_header(lambda offset, size: bytes(view[offset:offset + size]))
+        with open(image, 'rb') as f:
+            def read(offset, size):
+                f.seek(offset)
+                return f.read(size)
+            return _parse_image_header(read)
+    except (OSError, TypeError, ValueError):
+        return None
+
+def estimate_preview_seconds(header):
+    """
+    Estimate the run time of create_preview before decoding the image.
+
+    Args:
+        header (tuple): (format, width, height) from read_image_header.
+
+    Returns:
+        float: Estimated run time in seconds.
+    """
+    image_format, width, height = header
+    return PREVIEW_SECONDS + width * height * PREVIEW_SECONDS_PER_PIXEL[image_format]
+
+def _parse_image_header(read):
+    head = read(0, 24)
+    if head.startswith(b'\x89PNG\r\n\x1a\n') and head[12:16] == b'IHDR':
+        width, height = struct.unpack('>II', head[16:24])
+        return 'png', width, height
+    if not head.startswith(b'\xff\xd8'):
+        return None
+    offset = 2
+    while True:
+        marker = read(offset, 4)
+        if len(marker) < 4 or marker[0] != 0xFF:
+            return None
+        if marker[1] == 0xFF:
+            # Fill byte before the marker code
+            offset += 1
+            continue
+        if marker[1] == 0x01 or 0xD0 <= marker[1] <= 0xD7:
+            # Markers without a segment
+            offset += 2
+            continue
+        if marker[1] in JPEG_SOF_MARKERS:
+            frame = read(offset + 4, 5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack('>HH', frame[1:5])
+            return 'jpeg', width, height
+        offset += 2 + struct.unpack('>H', marker[2:4])[0]
+
+def scaled_kernel(size, factor):
+    """
+    Scale a Gaussian blur kernel size to an image resized by factor.
+
+    Args:
+        size (int): Kernel size in pixels of the original image.
+        factor (float): Resize factor of the image.
+
+    Returns:
+        int: Odd kernel size of at least 1.
+    """
+    return max(1, 2 * round((size * factor - 1) / 2) + 1)
+
+def resize_rows(image, resolution, row_start, row_stop):
+    """
+    Compute rows of the INTER_AREA resized image without resizing all of it.
+
+    A crop of the source with a few rows of margin is resized instead. The
+    crop starts on a source row that maps to an even output row, so the
+    crop maps onto the full resize exactly and rounds its size the same
+    way (OpenCV rounds half to even), giving identical rows. When
+    upscaling, output rows that land exactly on a source row can differ
+    slightly, as OpenCV's floating point source coordinates round
+    differently for the crop.
+
+    Args:
+        image (numpy.ndarray): Source image.
+        resolution (float): Resize factor.
+        row_start (int): First output row.
+        row_stop (int): Output row after the last one.
+
+    Returns:
+        numpy.ndarray: The requested rows of the resized image.
+    """
+    if resolution == 1.0:
+        return image[row_start:row_stop]
+    step = 2 * Fraction(resolution).limit_denominator(1000).denominator
+    margin = int(np.ceil(1 / resolution)) + 2
+    src_start = max(0, int(row_start / resolution) - margin) // step * step
+    src_stop = min(image.shape[0], int(np.ceil(row_stop / resolution)) + margin)
+    crop = cv2.resize(image[src_start:src_stop], (0, 0), fx=resolution, fy=resolution, interpolation=cv2.INTER_AREA)
+    offset = round(src_start * resolution)
+    return crop[row_start - offset:row_stop - offset]
 
 class LithophaneCreator:
     """
@@ -17,9 +204,62 @@ class LithophaneCreator:
         smoothness (int): Smoothness factor for Gaussian blur.
         grayscale (bool): Flag to convert the image to grayscale.
         top_surface_smoothness (int): Smoothness factor for the top surface.
-        repair_mesh (bool): Flag to perform mesh repair using PyMeshFix.
+        repair_mesh (bool): Flag to perform mesh repair using PyMeshFix. The
+            repair runs in a separate process within repair_timeout and
+            repair_memory_mb; when it exceeds them or fails, the unrepaired
+            mesh is kept and stats['repair'] says so.
+        repair_timeout (float): Wall-clock limit of a repair in seconds, or
+            None (default: Config.REPAIR_TIMEOUT).
+        repair_memory_mb (int): Memory limit of a repair in MB, or None
+            (default: Config.REPAIR_MEMORY_MB).
+        topology (str): Mesh layout, one of TOPOLOGIES. The "closed" layout only
+            emits the top surface, the perimeter walls and the bottom, so it is
+            watertight without repair.
+        max_error (float): Maximum vertical error in mm for adaptive triangulation
+            of the top surface. 0 keeps the uniform grid; a positive value builds
+            a closed mesh with large triangles in flat areas.
+        memory_budget_mb (int): When set, generate the mesh in bands of rows and
+            stream them to the STL file, keeping the working memory for the
+            depth map and mesh under this budget whatever the image size. The
+            decoded source image is still held in full. Not available with
+            repair or adaptive triangulation, which need the whole mesh.
+        workers (int): Number of processes that mesh bands of the depth map in
+            parallel and write them straight into the STL file. Like the
+            memory budget, not available with repair or adaptive
+            triangulation; ignored when a memory budget is set.
+        output_format (str): File format of the mesh, one of
+            mesh_formats.FORMATS. The indexed formats (3MF and PLY) and
+            gzip-compressed STL are several times smaller than STL. Tiled
+            generation writes STL or gzip-compressed STL, parallel generation
+            only STL.
+        progress (callable): Called with a stage name and the completed
+            fraction of the stage, from 0 to 1, as the pipeline runs; see
+            jobs.report_progress. Every stage reports its start and end, and
+            STL writes, including the bands of tiled generation, report each
+            batch of triangles.
+        depth_folder (str): Folder in which unit depth maps are also kept as
+            float32 files named after the depth stage key, so that other
+            processes, such as the other job workers, reuse them; None keeps
+            them in the stage cache only. The files are never removed here.
+        depth_file (str): Name of the file in depth_folder holding the
+            depth map of the last unit_depth_map call, or None.
+        stats (dict): Depth map size and triangle counts of the last mesh
+            created, including the reduction achieved against the uniform
+            grid, the pipeline stages that were served from cache, and the
+            timing spans of the stages that ran (see metrics.span). After
+            repairs, 'repair' holds their total seconds and outcome, one of
+            mesh_repair.REPAIRED, TIMEOUT or FAILED, with the error of the
+            last one that fell back to the unrepaired mesh.
     """
-    def __init__(self, max_depth, base_thickness, output_width, invert, resolution, smoothness, grayscale, top_surface_smoothness, repair_mesh=True):
+    def __init__(self, max_depth, base_thickness, output_width, invert, resolution, smoothness, grayscale, top_surface_smoothness, repair_mesh=True, topology='grid', max_error=0.0, memory_budget_mb=None, workers=1, output_format='stl', progress=None, depth_folder=None):
+        if topology not in TOPOLOGIES:
+            raise ValueError(f"Unknown topology: {topology}")
+        if (memory_budget_mb or workers > 1) and (repair_mesh or max_error > 0):
+            raise ValueError("Tiled generation cannot be combined with mesh repair or adaptive triangulation")
+        if output_format not in FORMATS:
+            raise ValueError(f"Unknown output format: {output_format}")
+        if (memory_budget_mb and output_format not in ('stl', 'stl.gz')) or (workers > 1 and output_format != 'stl'):
+            raise ValueError(f"Tiled generation cannot write {output_format} files")
         self.max_depth = max_depth
         self.base_thickness = base_thickness
         self.output_width = output_width
@@ -29,45 +269,202 @@ class LithophaneCreator:
         self.grayscale = grayscale
         self.top_surface_smoothness = top_surface_smoothness
         self.repair_mesh = repair_mesh
+        self.repair_timeout = Config.REPAIR_TIMEOUT or None
+        self.repair_memory_mb = Config.REPAIR_MEMORY_MB or None
+        self.topology = topology
+        self.max_error = max_error
+        self.memory_budget_mb = memory_budget_mb
+        self.workers = workers
+        self.output_format = output_format
+        self.progress = progress
+        self.depth_folder = depth_folder
+        self.depth_file = None
+        self.stats = {}
 
-    def create_lithophane(self, image_path, output_path):
+    def estimate_cost(self, width, height, variants=1):
         """
-        Create a lithophane from the provided image and save it as an STL file.
+        Estimate the peak memory and run time of create_lithophane, or of
+        create_variants, before decoding the image, e.g. from
+        read_image_header.
 
         Args:
-            image_path (str): Path to the input image file.
-            output_path (str): Path to the output STL file.
+            width (int): Width of the source image in pixels.
+            height (int): Height of the source image in pixels.
+            variants (int): Number of meshes built one after another from
+                the depth map, as create_variants does; the meshing and
+                repair time is paid once per mesh.
 
         Returns:
-            str: Path to the fixed STL file, or original STL file if repair is not performed.
+            costs.JobCost: Estimated memory in bytes and run time in seconds.
+            The repair terms are capped by repair_memory_mb and
+            repair_timeout, beyond which it falls back to the unrepaired
+            mesh.
+        """
+        pixels = width * height * self.resolution ** 2
+        layout = 'adaptive' if self.max_error > 0 else self.topology
+        seconds = pixels * COST_SECONDS_PER_PIXEL[layout]
+        if self.memory_budget_mb:
+            # The decoded source and the bands
+            memory = width * height * (1 if self.grayscale else 3) + self.memory_budget_mb * 2**20
+        else:
+            memory = width * height * (1 if self.grayscale else 3) + pixels * COST_BYTES_PER_PIXEL[layout]
+        if self.repair_mesh:
+            repair_memory = pixels * REPAIR_BYTES_PER_PIXEL
+            repair_seconds = pixels * REPAIR_SECONDS_PER_PIXEL
+            if self.repair_memory_mb:
+                repair_memory = min(repair_memory, self.repair_memory_mb * 2**20)
+            if self.repair_timeout:
+                repair_seconds = min(repair_seconds, self.repair_timeout)
+            memory += repair_memory
+            seconds += repair_seconds
+        return JobCost(int(memory), seconds * variants)
+
+    def _decode_key(self, image):
+        if is_image_buffer(image):
+            return (hashlib.sha256(memoryview(image).cast('B')).hexdigest(), self.grayscale, self.resolution)
+        if not os.path.exists(image):
+            raise ValueError("Image not found or unable to load")
+        stat = os.stat(image)
+        return (os.path.abspath(image), stat.st_mtime_ns, stat.st_size, self.grayscale, self.resolution)
+
+    def load_image(self, image):
         """
+        Decode stage: load the image as a resized single channel image.
+
+        The result is cached by file identity (or content, for image data),
+        grayscale and resolution.
+
+        Args:
+            image: Path to the input image file, or the encoded image as
+                bytes or a buffer.
+
+        Returns:
+            numpy.ndarray: 2D uint8 image.
+        """
+        decoded, hit = decode_cache.get_or_compute(self._decode_key(image), lambda: self._decode(image))
+        self._record_stage('decode', hit)
+        return decoded
+
+    def _read_source(self, image, scale=1.0):
+        """
+        Decode the source image, shrinking JPEG images while decoding when
+        the image is to be scaled down anyway.
+
+        libjpeg scales by 1/2, 1/4 or 1/8 in the DCT domain, which is much
+        faster and needs much less memory than decoding the full image and
+        resizing it. The largest factor that does not go below scale is
+        used; the rest of the scaling is left to the caller. Image data is
+        decoded in memory with cv2.imdecode.
+
+        Args:
+            image: Path to the input image file, or the encoded image as
+                bytes or a buffer.
+            scale (float): Resize factor the caller applies to the image.
+
+        Returns:
+            tuple: (image, scale) with the decoded image, single channel
+            when grayscale is set, and the resize factor still to apply.
+        """
+        flags = cv2.IMREAD_GRAYSCALE if self.grayscale else cv2.IMREAD_COLOR
+        header = read_image_header(image) if scale < 1.0 else None
+        if header is not None and header[0] == 'jpeg':
+            for factor, grayscale_flag, color_flag in REDUCED_DECODE_FLAGS:
+                if scale * factor <= 1.0:
+                    flags = grayscale_flag if self.grayscale else color_flag
+                    scale *= factor
+                    break
+
         # Load the image
-        image = cv2.imread(image_path)
-        if image is None:
+        if is_image_buffer(image):
+            data = np.frombuffer(image, dtype=np.uint8)
+            decoded = cv2.imdecode(data, flags) if data.size else None
+        else:
+            decoded = cv2.imread(image, flags)
+        if decoded is None:
             raise ValueError("Image not found or unable to load")
+        return decoded, scale
 
-        # Optionally convert to grayscale
-        if self.grayscale:
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    def _decode(self, image):
+        with self._span('decode'):
+            image, scale = self._read_source(image, self.resolution)
 
-        # Adjust resolution
-        if self.resolution != 1.0:
-            image = cv2.resize(image, (0, 0), fx=self.resolution, fy=self.resolution, interpolation=cv2.INTER_AREA)
+            # Adjust resolution
+            if scale != 1.0:
+                image = cv2.resize(image, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
 
-        # If the image is not already grayscale, convert it
-        if len(image.shape) == 3:
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            # If the image is not already grayscale, convert it
+            if len(image.shape) == 3:
+                image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return image
 
+    def unit_depth_map(self, image):
+        """
+        Depth stage: normalized and blurred depth map in the range [0, 1].
+
+        The blurs are linear, so the depth map for any max_depth is this map
+        scaled by max_depth. The result is cached by the decode parameters,
+        invert and both smoothness settings, and also stored in depth_folder
+        when set.
+
+        Args:
+            image: Path to the input image file, or the encoded image as
+                bytes or a buffer.
+
+        Returns:
+            numpy.ndarray: 2D float64 depth map.
+        """
+        key = self._decode_key(image) + (self.invert, self.smoothness, self.top_surface_smoothness)
+        path = os.path.join(self.depth_folder, self._depth_file_name(key)) if self.depth_folder else None
+        depth_image = depth_cache.get(key)
+        if depth_image is None and path is not None:
+            depth_image = self._load_depth_file(key, path)
+        self._record_stage('depth', depth_image is not None)
+        if depth_image is None:
+            decoded = self.load_image(image)
+            with self._span('depth'):
+                depth_image = depth_cache.put(key, self._unit_depth(decoded))
+            if path is not None:
+                self._store_depth_file(depth_image, path)
+        self.depth_file = os.path.basename(path) if path is not None and os.path.exists(path) else None
+        return depth_image
+
+    @staticmethod
+    def _depth_file_name(key):
+        return hashlib.sha256(repr(key).encode()).hexdigest() + DEPTH_FILE_EXTENSION
+
+    def _load_depth_file(self, key, path):
+        try:
+            depth_image = np.load(path).astype(np.float64)
+        except (OSError, ValueError):
+            # Not stored yet, evicted, or cut short
+            return None
+        return depth_cache.put(key, depth_image)
+
+    def _store_depth_file(self, depth_image, path):
+        # Stored as float32, half the size and as precise as the viewer levels
+        # of detail. Written under a temporary name and renamed, so that
+        # other processes never load a partial file; failing to store it
+        # only costs reuse
+        partial_path = None
+        try:
+            fd, partial_path = tempfile.mkstemp(dir=self.depth_folder, prefix='.', suffix='.partial.npy')
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, depth_image.astype(np.float32))
+            os.replace(partial_path, path)
+        except OSError:
+            if partial_path is not None and os.path.exists(partial_path):
+                os.remove(partial_path)
+
+    def _unit_depth(self, image):
         # Normalize the image to the range [0, 1]
         normalized_image = image / 255.0
 
         # Optionally invert the image so that light areas are raised
         if self.invert:
-            depth_image = normalized_image * self.max_depth
+            depth_image = normalized_image
         else:
             # Invert the image so that dark areas are raised
-            inverted_image = 1.0 - normalized_image
-            depth_image = inverted_image * self.max_depth
+            depth_image = 1.0 - normalized_image
 
         # Apply smoothness (Gaussian blur) to the depth image
         if self.smoothness > 0:
@@ -77,120 +474,519 @@ class LithophaneCreator:
         if len(depth_image.shape) != 2:
             raise ValueError(f"depth_image has an unexpected shape: {depth_image.shape}")
 
+        # Apply top surface smoothing using Gaussian blur
+        if self.top_surface_smoothness > 0:
+            depth_image = cv2.GaussianBlur(depth_image, (self.top_surface_smoothness, self.top_surface_smoothness), 0)
+        return depth_image
+
+    def build_mesh(self, unit_depth):
+        """
+        Mesh stage: build the indexed mesh for a unit depth map.
+
+        Only the z values depend on max_depth and base_thickness, so the face
+        index array of the uniform topologies is cached by grid size.
+
+        Args:
+            unit_depth (numpy.ndarray): Depth map from unit_depth_map.
+
+        Returns:
+            tuple: (vertices, faces) arrays.
+        """
+        with self._span('mesh'):
+            return self._build_mesh(unit_depth)
+
+    def _build_mesh(self, unit_depth):
+        depth_image = unit_depth * self.max_depth
+
         # Get the dimensions of the input image
         height, width = depth_image.shape
 
         # Calculate the scaling factor for the width
         x_scale = self.output_width / width
-        # Calculate the new height based on the aspect ratio
-        output_height = height * x_scale
-
-        # Apply top surface smoothing using Gaussian blur
-        if self.top_surface_smoothness > 0:
-            depth_image = cv2.GaussianBlur(depth_image, (self.top_surface_smoothness, self.top_surface_smoothness), 0)
 
         # Create a 3D model from the depth image
-        vertices = []
-        faces = []
-
-        # Generate top vertices
-        for y in range(height):
-            for x in range(width):
-                z = depth_image[y, x] + self.base_thickness
-                vertices.append([x * x_scale, y * x_scale, z])
-
-        # Generate bottom vertices
-        for y in range(height):
-            for x in range(width):
-                vertices.append([x * x_scale, y * x_scale, 0])
-
-        # Generate faces for the top surface
-        for y in range(height - 1):
-            for x in range(width - 1):
-                v1 = y * width + x
-                v2 = v1 + 1
-                v3 = v1 + width
-                v4 = v3 + 1
-                faces.append([v1, v2, v3])
-                faces.append([v2, v4, v3])
-
-        # Generate faces for the bottom surface
-        offset = height * width
-        for y in range(height - 1):
-            for x in range(width - 1):
-                v1 = y * width + x + offset
-                v2 = v1 + 1
-                v3 = v1 + width
-                v4 = v3 + 1
-                faces.append([v1, v3, v2])
-                faces.append([v2, v3, v4])
-
-        # Generate faces for the sides
-        for y in range(height - 1):
-            for x in range(width - 1):
-                v1_top = y * width + x
-                v2_top = v1_top + 1
-                v1_bottom = v1_top + offset
-                v2_bottom = v1_bottom + 1
-                faces.append([v1_top, v2_top, v1_bottom])
-                faces.append([v2_top, v2_bottom, v1_bottom])
-
-                v3_top = v1_top + width
-                v4_top = v3_top + 1
-                v3_bottom = v3_top + offset
-                v4_bottom = v3_bottom + 1
-                faces.append([v3_top, v4_top, v3_bottom])
-                faces.append([v4_top, v4_bottom, v3_bottom])
-
-        vertices = np.array(vertices)
-        faces = np.array(faces)
-
-        # Create the mesh
-        lithophane_mesh = mesh.Mesh(np.zeros(faces.shape[0], dtype=mesh.Mesh.dtype))
-        for i, face in enumerate(faces):
-            for j in range(3):
-                lithophane_mesh.vectors[i][j] = vertices[face[j], :]
+        if self.max_error > 0:
+            vertices, faces = adaptive_mesh(depth_image, self.max_error, x_scale, self.base_thickness)
+            uniform_triangles = closed_triangle_count(height, width)
+        elif self.topology == 'closed':
+            vertices = closed_vertices(depth_image, x_scale, self.base_thickness)
+            faces = self._faces(height, width, 'closed')
+            uniform_triangles = len(faces)
+        else:
+            vertices = grid_vertices(depth_image, x_scale, self.base_thickness)
+            faces = self._faces(height, width, 'grid')
+            uniform_triangles = len(faces)
 
-        # Save the mesh to an STL file
-        lithophane_mesh.save(output_path)
+        self.stats.update({
+            'image_size': [width, height],
+            'triangles': len(faces),
+            'uniform_triangles': uniform_triangles,
+            'triangle_reduction': 1 - len(faces) / uniform_triangles,
+        })
+        return vertices, faces
 
-        if self.repair_mesh:
-            # Post-process the STL file using PyMeshFix
-            meshfix = pymeshfix.MeshFix(vertices, faces)
-            meshfix.repair()
-            vertices_fixed, faces_fixed = meshfix.return_arrays()
+    def _faces(self, height, width, topology):
+        builder = closed_faces if topology == 'closed' else grid_faces
+        faces, hit = faces_cache.get_or_compute((topology, height, width), lambda: builder(height, width))
+        self._record_stage('faces', hit)
+        return faces
+
+    @contextmanager
+    def _span(self, stage):
+        self._progress(stage, 0.0)
+        with span(self.stats.setdefault('spans', []), stage) as record:
+            yield record
+        self._progress(stage, 1.0)
+
+    def _progress(self, stage, fraction):
+        if self.progress is not None:
+            self.progress(stage, fraction)
 
-            # Create a fixed mesh
-            fixed_mesh = mesh.Mesh(np.zeros(faces_fixed.shape[0], dtype=mesh.Mesh.dtype))
-            for i, face in enumerate(faces_fixed):
-                for j in range(3):
-                    fixed_mesh.vectors[i][j] = vertices_fixed[face[j], :]
+    def _stage_progress(self, stage):
+        """
+        Returns:
+            callable: Reports the completed fraction of a stage, or None
+            without a progress callback.
+        """
+        return functools.partial(self._progress, stage) if self.progress is not None else None
+
+    def _record_stage(self, stage, hit):
+        cached = self.stats.setdefault('cached_stages', [])
+        if hit and stage not in cached:
+            cached.append(stage)
+
+    def repair(self, vertices, faces, output_path):
+        """
+        Repair stage: fix the mesh with PyMeshFix and save it.
+
+        Args:
+            vertices (numpy.ndarray): Vertex array.
+            faces (numpy.ndarray): Face array.
+            output_path (str): Path of the unrepaired STL file.
+
+        Returns:
+            str: Path to the fixed STL file, or output_path if the repair
+            fell back to the unrepaired mesh.
+        """
+        with self._span('repair'):
+            points, fixed_faces, repaired = self._repair_arrays(vertices, faces)
+            if not repaired:
+                return output_path
 
             # Save the fixed mesh to an STL file
             fixed_output_path = output_path.replace(".stl", "_fixed.stl")
-            fixed_mesh.save(fixed_output_path)
-            return fixed_output_path
+            write_binary_stl(fixed_output_path, points, fixed_faces)
+        return fixed_output_path
+
+    def _repair_arrays(self, vertices, faces):
+        """
+        Repair a mesh within the repair limits, recording the time taken and
+        the outcome in stats['repair'].
+
+        Returns:
+            tuple: (vertices, faces, repaired); the input arrays and False
+            when the repair fell back to the unrepaired mesh.
+        """
+        start = time.perf_counter()
+        repair = self.stats.setdefault('repair', {'outcome': REPAIRED, 'seconds': 0.0})
+        try:
+            vertices, faces = repair_arrays(vertices, faces, self.repair_timeout, self.repair_memory_mb)
+            repaired = True
+        except RepairError as e:
+            repair['outcome'] = e.outcome
+            repair['error'] = str(e)
+            repaired = False
+        repair['seconds'] += time.perf_counter() - start
+        return vertices, faces, repaired
+
+    def _band_rows(self, width):
+        """
+        Number of cell rows per band that keeps tiled generation in budget.
+
+        Args:
+            width (int): Number of vertex columns.
+
+        Returns:
+            int: Rows per band, at least 2.
+        """
+        triangles_per_cell = 2 if self.topology == 'closed' else 8
+        bytes_per_row = width * (TILED_BYTES_PER_PIXEL + triangles_per_cell * TILED_BYTES_PER_TRIANGLE)
+        return max(2, (self.memory_budget_mb * 2**20 // 2) // bytes_per_row)
+
+    def _depth_rows(self, source, scale, row_start, row_stop, height):
+        """
+        Compute rows of the unit depth map from the source image.
+
+        The rows are computed with enough extra rows around them for both
+        blurs, so they match the same rows of the full depth map.
+
+        Args:
+            source (numpy.ndarray): Decoded source image.
+            scale (float): Resize factor from the source to the depth map.
+            row_start (int): First depth map row.
+            row_stop (int): Depth map row after the last one.
+            height (int): Number of rows of the full depth map.
+
+        Returns:
+            numpy.ndarray: Depth map rows.
+        """
+        halo = self.smoothness // 2 + self.top_surface_smoothness // 2
+        extended_start, extended_stop = max(0, row_start - halo), min(height, row_stop + halo)
+        image = resize_rows(source, scale, extended_start, extended_stop)
+
+        # If the image is not already grayscale, convert it
+        if len(image.shape) == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return self._unit_depth(image)[row_start - extended_start:row_stop - extended_start]
+
+    def create_tiled_lithophane(self, image, output_path):
+        """
+        Create a lithophane band by band, streaming triangles to the STL file.
+
+        Bands of rows overlap by one vertex row, so the output has the same
+        triangles as create_lithophane, but only one band of depth map and
+        mesh data is held in memory at a time.
+
+        Args:
+            image: Path to the input image file, or the encoded image as
+                bytes or a buffer.
+            output_path (str): Path to the output STL file.
+
+        Returns:
+            str: Path to the STL file.
+        """
+        if self.repair_mesh or self.max_error > 0:
+            raise ValueError("Tiled generation cannot be combined with mesh repair or adaptive triangulation")
+        self.stats = {}
+        with self._span('decode'):
+            source, scale = self._read_source(image, self.resolution)
+        if scale != 1.0:
+            height, width = round(source.shape[0] * scale), round(source.shape[1] * scale)
+        else:
+            height, width = source.shape[:2]
+        x_scale = self.output_width / width
+
+        if self.topology == 'closed':
+            triangle_count = closed_triangle_count(height, width)
+        else:
+            triangle_count = grid_triangle_count(height, width)
+        band_rows = self._band_rows(width)
+        chunk_size = max(1024, (self.memory_budget_mb * 2**20 // 2) // TILED_BYTES_PER_RECORD)
+
+        with self._span('bands'), open(output_path, 'wb') as raw:
+            f = gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=GZIP_LEVEL, mtime=0) if self.output_format == 'stl.gz' else raw
+            with f, BinaryStlWriter(f, triangle_count, progress=self._stage_progress('bands')) as writer:
+                for row_start in range(0, height - 1, band_rows):
+                    row_stop = min(row_start + band_rows, height - 1)
+                    depth_band = self._depth_rows(source, scale, row_start, row_stop + 1, height) * self.max_depth
+                    vertices, faces = band_mesh(depth_band, row_start, height, x_scale, self.base_thickness, self.topology)
+                    writer.write_indexed(vertices, faces, chunk_size)
+
+        self.stats.update({
+            'image_size': [width, height],
+            'triangles': triangle_count,
+            'uniform_triangles': triangle_count,
+            'triangle_reduction': 0.0,
+            'bands': -(-(height - 1) // band_rows),
+        })
+        return output_path
+
+    def create_parallel_lithophane(self, image, output_path):
+        """
+        Create a lithophane with bands of the mesh built on a process pool.
+
+        The depth map comes from the cached pipeline stages as usual; the
+        workers read it from shared memory and write their triangles into
+        the preallocated STL file at precomputed offsets.
+
+        Args:
+            image: Path to the input image file, or the encoded image as
+                bytes or a buffer.
+            output_path (str): Path to the output STL file.
+
+        Returns:
+            str: Path to the STL file.
+        """
+        if self.repair_mesh or self.max_error > 0:
+            raise ValueError("Tiled generation cannot be combined with mesh repair or adaptive triangulation")
+        self.stats = {}
+        unit_depth = self.unit_depth_map(image)
+        x_scale = self.output_width / unit_depth.shape[1]
+        with self._span('bands'):
+            triangle_count, bands = write_parallel_stl(
+                output_path, unit_depth, self.max_depth, x_scale, self.base_thickness, self.topology, self.workers
+            )
+        self.stats.update({
+            'image_size': [unit_depth.shape[1], unit_depth.shape[0]],
+            'triangles': triangle_count,
+            'uniform_triangles': triangle_count,
+            'triangle_reduction': 0.0,
+            'bands': bands,
+        })
+        return output_path
+
+    def create_preview(self, image, output_path, max_size):
+        """
+        Create a quick low resolution preview of the lithophane.
+
+        The source image is shrunk so that its longer side is at most max_size
+        pixels (and never larger than the full resolution depth map) before
+        the depth stage, with the blur sizes scaled to match, and meshed with
+        the closed topology so no repair is needed. The preview has the same
+        outer dimensions as the full lithophane.
+
+        Args:
+            image: Path to the input image file, or the encoded image as
+                bytes or a buffer.
+            output_path (str): Path to the output STL file.
+            max_size (int): Maximum width or height of the depth map in pixels.
+
+        Returns:
+            str: Path to the STL file.
+        """
+        self.stats = {}
+        preview, unit_depth = self._preview_depth(image, max_size)
+        vertices, faces = preview.build_mesh(unit_depth)
+        with self._span('write'):
+            write_binary_stl(output_path, vertices, faces, progress=self._stage_progress('write'))
+        return output_path
+
+    def _preview_depth(self, image, max_size):
+        """
+        Compute a low resolution unit depth map, see create_preview.
+
+        Args:
+            image: Path to the input image file, or the encoded image as
+                bytes or a buffer.
+            max_size (int): Maximum width or height of the depth map in pixels.
+
+        Returns:
+            tuple: (preview, unit_depth) with a copy of this creator whose
+            settings match the depth map, and the depth map.
+        """
+        with self._span('decode'):
+            # The header gives the scale before decoding, so large JPEG
+            # images are shrunk while decoding
+            header = read_image_header(image)
+            if header is not None and not min(header[1:]):
+                header = None
+            scale = min(1.0, self.resolution, max_size / max(header[1:])) if header else 1.0
+            source, _ = self._read_source(image, scale)
+            if header is None:
+                height, width = source.shape[:2]
+                scale = min(1.0, self.resolution, max_size / max(height, width))
+            elif (source.shape[1] > source.shape[0]) == (header[1] > header[2]):
+                width, height = header[1:]
+            else:
+                # Rotated by its EXIF orientation
+                height, width = header[1:]
+            size = (max(2, round(width * scale)), max(2, round(height * scale))) if scale < 1.0 else (width, height)
+            if source.shape[1::-1] != size:
+                source = cv2.resize(source, size, interpolation=cv2.INTER_AREA)
+            if len(source.shape) == 3:
+                source = cv2.cvtColor(source, cv2.COLOR_BGR2GRAY)
+
+        # Blur sizes are given in pixels of the full resolution depth map
+        full_width = round(width * self.resolution) if self.resolution != 1.0 else width
+        preview_width = source.shape[1]
+        factor = preview_width / full_width
+        preview = copy.copy(self)
+        preview.output_width = self.output_width * (full_width - 1) / full_width * preview_width / (preview_width - 1)
+        preview.smoothness = scaled_kernel(self.smoothness, factor)
+        preview.top_surface_smoothness = scaled_kernel(self.top_surface_smoothness, factor)
+        preview.topology, preview.max_error = 'closed', 0.0
+
+        with self._span('depth'):
+            unit_depth = preview._unit_depth(source)
+        return preview, unit_depth
+
+    def create_lods(self, image, output_path, sizes):
+        """
+        Create levels of detail of the lithophane for the in-browser viewer.
+
+        Each level is the unit depth map shrunk so that its longer side is
+        at most one of sizes, meshed with the closed topology and the same
+        outer dimensions as the full lithophane, and written with
+        mesh_formats.write_lod. The depth map comes from the stage cache, so
+        after create_lithophane only the meshing runs. With a memory budget,
+        where the full depth map is never held, a preview depth map of the
+        largest size is used instead.
+
+        Args:
+            image: Path to the input image file, or the encoded image as
+                bytes or a buffer.
+            output_path (str): Path to the output file.
+            sizes (list): Maximum width or height of each level in pixels.
+
+        Returns:
+            str: Path to the levels of detail file.
+        """
+        with self._span('lod'):
+            if self.memory_budget_mb:
+                preview, unit_depth = self._preview_depth(image, max(sizes))
+                output_width = preview.output_width
+            else:
+                unit_depth = self.unit_depth_map(image)
+                output_width = self.output_width
+            height, width = unit_depth.shape
+            extent = output_width * (width - 1) / width
+
+            levels = []
+            for size in sorted({min(size, max(height, width)) for size in sizes}):
+                scale = size / max(height, width)
+                level_depth = unit_depth
+                if scale < 1.0:
+                    level_size = (max(2, round(width * scale)), max(2, round(height * scale)))
+                    level_depth = cv2.resize(unit_depth, level_size, interpolation=cv2.INTER_AREA)
+                level_height, level_width = level_depth.shape
+                vertices = closed_vertices(level_depth * self.max_depth, extent / (level_width - 1), self.base_thickness)
+                levels.append((vertices, self._faces(level_height, level_width, 'closed')))
+            write_lod(output_path, levels)
+        self.stats['lod_triangles'] = [len(faces) for _, faces in levels]
+        return output_path
+
+    def create_variants(self, image, output_path, variants):
+        """
+        Create several lithophanes of one image, differing only in
+        VARIANT_PARAMS, as STL files in a zip archive.
+
+        The decode and depth stages run once and every variant reuses the
+        cached face index array, as only the vertices change, so each
+        variant after the first costs its vertices, repair if enabled, and
+        its write. The whole depth map is used, whatever the memory budget
+        and workers.
+
+        Args:
+            image: Path to the input image file, or the encoded image as
+                bytes or a buffer.
+            output_path (str): Path to the output zip file.
+            variants (list): Dicts of VARIANT_PARAMS overriding the settings
+                of this creator, one per STL file.
+
+        Returns:
+            str: Path to the zip file.
+        """
+        if not variants:
+            raise ValueError("No variants requested")
+        for overrides in variants:
+            unknown = set(overrides) - set(VARIANT_PARAMS)
+            if unknown:
+                raise ValueError(f"Variants can only change {', '.join(VARIANT_PARAMS)}, not {', '.join(sorted(unknown))}")
+
+        self.stats = {}
+        unit_depth = self.unit_depth_map(image)
+        files = []
+        # Stored uncompressed: deflate takes many times longer than meshing
+        with zipfile.ZipFile(output_path, 'w', compression=zipfile.ZIP_STORED) as archive:
+            for index, overrides in enumerate(variants, 1):
+                variant = copy.copy(self)
+                vars(variant).update(overrides)
+                vertices, faces = variant.build_mesh(unit_depth)
+                repaired = None
+                if self.repair_mesh:
+                    with self._span('repair'):
+                        vertices, faces, repaired = self._repair_arrays(vertices, faces)
+                name = f"lithophane_{index}_depth{variant.max_depth}_base{variant.base_thickness}_width{variant.output_width}.stl"
+                with self._span('write'), archive.open(name, 'w', force_zip64=True) as f:
+                    with BinaryStlWriter(f, len(faces), progress=self._stage_progress('write')) as writer:
+                        writer.write_indexed(vertices, faces)
+                files.append({"name": name, "triangles": len(faces), **overrides})
+                if repaired is not None:
+                    files[-1]["repaired"] = repaired
+                self._progress('variants', index / len(variants))
+        self.stats['variants'] = files
+        self.stats['triangles'] = sum(file['triangles'] for file in files)
+        return output_path
+
+    def create_lithophane(self, image, output_path):
+        """
+        Create a lithophane from the provided image and save it as a mesh file.
+
+        The decode, depth and face topology stages are cached, so changing
+        only max_depth, base_thickness or output_width reuses the previous
+        depth map and faces. With a memory budget the mesh is generated by
+        create_tiled_lithophane instead, and with several workers by
+        create_parallel_lithophane.
+
+        Args:
+            image: Path to the input image file, or the encoded image as
+                bytes or a buffer.
+            output_path (str): Path to the output file, with the extension of
+                output_format.
+
+        Returns:
+            str: Path to the fixed STL file, or original STL file if repair is not performed
+            or fell back to the unrepaired mesh.
+            Meshes in other formats are written to output_path after repair.
+        """
+        if self.memory_budget_mb:
+            return self.create_tiled_lithophane(image, output_path)
+        if self.workers > 1:
+            return self.create_parallel_lithophane(image, output_path)
+
+        self.stats = {}
+        vertices, faces = self.build_mesh(self.unit_depth_map(image))
+
+        if self.output_format != 'stl':
+            # Other formats are only written once, after the optional repair
+            if self.repair_mesh:
+                with self._span('repair'):
+                    vertices, faces, _ = self._repair_arrays(vertices, faces)
+            with self._span('write'):
+                write_mesh(output_path, vertices, faces, self.output_format)
+            return output_path
+
+        # Save the mesh to an STL file
+        with self._span('write'):
+            write_binary_stl(output_path, vertices, faces, progress=self._stage_progress('write'))
+
+        if self.repair_mesh:
+            return self.repair(vertices, faces, output_path)
         else:
             return output_path
 
-if __name__ == "__main__":
-    processor = LithophaneCreator(
-        max_depth=10,
-        base_thickness=4,
-        output_width=200,
-        invert=True,
-        resolution=0.5,
-        smoothness=1,
-        grayscale=True,
-        top_surface_smoothness=9,
-        repair_mesh=True
-    )
-
-    input_image_path = "./uploads/test.jpg"  # Provide a valid test image path
-    output_stl_path = "./outputs/test_output.stl"
-
-    if os.path.exists(input_image_path):
-        fixed_output_path = processor.create_lithophane(input_image_path, output_stl_path)
-        print(f"Lithophane created successfully: {fixed_output_path}")
-    else:
-        print(f"Input image path does not exist: {input_image_path}")
+
+def set_stage_cache_budget(max_bytes):
+    """
+    Resize the stage caches of this process, split as at import: a quarter
+    each for decoded images and depth maps, half for face index arrays.
+
+    Args:
+        max_bytes (int): Size budget for all stage caches.
+    """
+    decode_cache.resize(max_bytes // 4)
+    depth_cache.resize(max_bytes // 4)
+    faces_cache.resize(max_bytes // 2)
+
+def warm_up(size=64):
+    """
+    Load the conversion engine and run a small conversion through it.
+
+    Imports PyMeshFix, which is otherwise imported by every repair process,
+    and converts a synthetic image with both topologies so that first-call
+    initialization in OpenCV, NumPy and the writers is paid up front. Call
+    it in the master process of a prefork server so the forked workers, and
+    the repair processes they fork, share the loaded modules copy-on-write.
+    The stage caches are emptied afterwards.
+
+    Args:
+        size (int): Side of the synthetic image in pixels.
+
+    Returns:
+        float: Seconds spent.
+    """
+    start = time.perf_counter()
+    import pymeshfix  # noqa: F401
+    y, x = np.mgrid[0:size, 0:size]
+    image = cv2.imencode('.png', ((x + y) * 255 // (2 * size)).astype(np.uint8))[1].tobytes()
+    with tempfile.TemporaryDirectory() as folder:
+        for topology in TOPOLOGIES:
+            processor = LithophaneCreator(
+                max_depth=Config.MAX_DEPTH, base_thickness=Config.BASE_THICKNESS, output_width=Config.OUTPUT_WIDTH,
+                invert=False, resolution=1.0, smoothness=Config.SMOOTHNESS, grayscale=True,
+                top_surface_smoothness=Config.TOP_SURFACE_SMOOTHNESS, repair_mesh=False, topology=topology
+            )
+            processor.create_lithophane(image, os.path.join(folder, f'{topology}.stl'))
+    for cache in (decode_cache, depth_cache, faces_cache):
+        cache.clear()
+    return time.perf_counter() - start
@@ -0,0 +1,379 @@
+import atexit
+import logging
+import math
+import multiprocessing
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from costs import JobCost  # noqa: F401 (re-exported for callers of submit)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+logger = logging.getLogger(__name__)
+
+
+# Progress queue of this worker process and the job it is running, see
+# report_progress
+_worker_events = None
+_worker_job = None
+_worker_last = None
+
+
+class JobRejected(Exception):
+    """
+    Raised when a job cannot be admitted.
+
+    Attributes:
+        retry_after (int): Seconds after which the job may be admitted, or
+            None if it never fits the budget.
+    """
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Job:
+    """
+    A unit of work submitted to the JobManager.
+
+    Attributes:
+        id (str): Unique job identifier.
+        future (concurrent.futures.Future): Future of the work's result.
+        submitted_at (float): Submission time (time.time()).
+        cost (JobCost): Estimated cost, if given.
+        started_at (float): Time the job was handed to the process pool, or
+            None while it waits for budget.
+        progress (dict): Latest stage and completed fraction reported by
+            the job, or None.
+    """
+    def __init__(self, job_id, future, cost=None):
+        self.id = job_id
+        self.future = future
+        self.submitted_at = time.time()
+        self.cost = cost
+        self.started_at = None
+        self.progress = None
+        self._pool_future = None
+        self._version = 0
+        self._changed = threading.Condition()
+        future.add_done_callback(lambda _: self._notify())
+
+    def set_progress(self, stage, fraction):
+        """
+        Record reported progress and wake up the watchers of the job.
+
+        Args:
+            stage (str): Pipeline stage.
+            fraction (float): Completed fraction of the stage, from 0 to 1.
+        """
+        with self._changed:
+            self.progress = {"stage": stage, "fraction": fraction}
+            self._version += 1
+            self._changed.notify_all()
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    def wait_for_progress(self, version, timeout=None):
+        """
+        Block until the job reports progress after a version, or finishes.
+
+        Args:
+            version (int): Version returned by the previous call, 0 at first.
+            timeout (float): Maximum number of seconds to wait.
+
+        Returns:
+            tuple: (version, progress) of the latest progress; the version is
+            unchanged on timeout or when the job finished without news.
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self._version != version or self.future.done(), timeout)
+            return self._version, self.progress
+
+    @property
+    def status(self):
+        """
+        str: One of QUEUED, RUNNING, DONE or FAILED.
+        """
+        if self.future.done():
+            return FAILED if self.future.cancelled() or self.future.exception() is not None else DONE
+        return RUNNING if self._pool_future is not None and self._pool_future.running() else QUEUED
+
+    def to_dict(self):
+        """
+        Describe the job for a JSON response.
+
+        Returns:
+            dict: The job id and status, plus the result when done or the error
+            message when failed.
+        """
+        status = self.status
+        info = {"job_id": self.id, "status": status}
+        if status in (QUEUED, RUNNING) and self.progress is not None:
+            info["progress"] = self.progress
+        if status == DONE:
+            info["result"] = self.future.result()
+        elif status == FAILED:
+            info["error"] = "Job cancelled" if self.future.cancelled() else str(self.future.exception())
+        return info
+
+
+class JobManager:
+    """
+    Run jobs on a bounded process pool and keep track of their status.
+
+    The pool is created on first use, so importing this module does not
+    start any processes.
+
+    With a memory budget, jobs are admitted by their estimated cost: a job
+    is handed to the pool only while the jobs in flight fit the budget
+    with it, otherwise it waits in a bounded first-in first-out queue.
+    Jobs that would overflow the queue, or that are larger than the whole
+    budget, are rejected with JobRejected.
+
+    Workers publish progress with report_progress on a single queue, read by
+    one listener thread that updates the jobs, so any number of watchers can
+    wait for progress without polling.
+
+    Attributes:
+        max_workers (int): Maximum number of worker processes.
+        history (int): Number of finished jobs kept for status queries.
+        memory_budget (int): Bytes of estimated memory of the jobs in
+            flight, or None for no admission control.
+        max_queued (int): Maximum number of jobs waiting for budget.
+        initializer (callable): Picklable function each worker process
+            calls with no arguments when it starts, or None.
+        rejected (int): Number of rejected jobs.
+    """
+    def __init__(self, max_workers=None, history=1000, memory_budget=None, max_queued=32, initializer=None):
+        self.max_workers = max_workers
+        self.history = history
+        self.memory_budget = memory_budget
+        self.max_queued = max_queued
+        self.initializer = initializer
+        self.rejected = 0
+        self._executor = None
+        self._jobs = OrderedDict()
+        self._waiting = deque()
+        self._running = {}
+        self._in_flight_bytes = 0
+        self._events = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._events = multiprocessing.Queue()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, initializer=_init_worker, initargs=(self._events, self.initializer)
+            )
+            threading.Thread(target=self._listen, args=(self._events,), name='job-progress', daemon=True).start()
+            atexit.register(self.shutdown)
+        return self._executor
+
+    def _listen(self, events):
+        while True:
+            event = events.get()
+            if event is None:
+                return
+            job_id, stage, fraction = event
+            job = self.get(job_id)
+            if job is not None:
+                job.set_progress(stage, fraction)
+
+    def submit(self, fn, *args, cost=None, **kwargs):
+        """
+        Queue a job on the process pool.
+
+        Args:
+            fn (callable): Picklable function to run in a worker process.
+            *args: Positional arguments for fn.
+            cost (JobCost): Estimated cost of the job, used for admission
+                when the manager has a memory budget.
+            **kwargs: Keyword arguments for fn.
+
+        Returns:
+            Job: The queued job.
+
+        Raises:
+            JobRejected: If the job does not fit the budget or the queue.
+        """
+        with self._lock:
+            memory = cost.memory_bytes if cost is not None and self.memory_budget else 0
+            if self.memory_budget and memory > self.memory_budget:
+                self.rejected += 1
+                raise JobRejected(
+                    f"Job needs about {memory / 2**20:.0f} MB, more than the {self.memory_budget / 2**20:.0f} MB budget"
+                )
+            fits = not self.memory_budget or (not self._waiting and self._in_flight_bytes + memory <= self.memory_budget)
+            if not fits and len(self._waiting) >= self.max_queued:
+                self.rejected += 1
+                raise JobRejected("Too many jobs queued", retry_after=self._retry_after(memory))
+
+            job = Job(uuid.uuid4().hex, Future(), cost)
+            job.future.add_done_callback(_log_failure)
+            self._jobs[job.id] = job
+            self._prune()
+            if fits:
+                self._start(job, memory, fn, args, kwargs)
+            else:
+                self._waiting.append((job, memory, fn, args, kwargs))
+        if fits:
+            self._watch(job)
+        return job
+
+    def _start(self, job, memory, fn, args, kwargs):
+        # Called with the lock held; the caller must _watch the job after
+        # releasing it
+        self._in_flight_bytes += memory
+        self._running[job.id] = (job, memory)
+        job.started_at = time.time()
+        job._pool_future = self._get_executor().submit(_run_job, job.id, fn, args, kwargs)
+
+    def _watch(self, job):
+        # Called without the lock: the callback runs at once, on this
+        # thread, if the job has already finished
+        job._pool_future.add_done_callback(lambda future, job=job: self._finish(job, future))
+
+    def _finish(self, job, future):
+        started = []
+        with self._lock:
+            _, memory = self._running.pop(job.id)
+            self._in_flight_bytes -= memory
+            # First in, first out, so large jobs are not starved by small ones
+            while self._waiting and self._in_flight_bytes + self._waiting[0][1] <= self.memory_budget:
+                waiting = self._waiting.popleft()
+                self._start(*waiting)
+                started.append(waiting[0])
+        for waiting_job in started:
+            self._watch(waiting_job)
+        if future.cancelled():
+            job.future.cancel()
+        elif future.exception() is not None:
+            job.future.set_exception(future.exception())
+        else:
+            job.future.set_result(future.result())
+
+    def _retry_after(self, memory):
+        """
+        Estimate when a job could be queued, from the estimated finish times
+        of the jobs in flight. Called with the lock held.
+
+        Args:
+            memory (int): Estimated memory of the job in bytes.
+
+        Returns:
+            int: Seconds, at least 1.
+        """
+        now = time.time()
+        needed = self._in_flight_bytes + sum(waiting[1] for waiting in self._waiting) + memory - self.memory_budget
+        finishes = sorted(
+            (job.started_at + (job.cost.seconds if job.cost else 0), memory)
+            for job, memory in self._running.values()
+        )
+        wait = 0.0
+        for finish, freed in finishes:
+            wait = finish - now
+            needed -= freed
+            if needed <= 0:
+                break
+        return max(1, math.ceil(wait))
+
+    def stats(self):
+        """
+        Report the queue depth and budget usage.
+
+        Returns:
+            dict: Numbers of jobs in flight (handed to the process pool),
+            waiting for budget and rejected, the memory budget and the
+            estimated memory of the jobs in flight.
+        """
+        with self._lock:
+            return {
+                "in_flight": len(self._running),
+                "queued": len(self._waiting),
+                "rejected": self.rejected,
+                "memory_budget_bytes": self.memory_budget or 0,
+                "in_flight_bytes": self._in_flight_bytes,
+                "budget_usage": self._in_flight_bytes / self.memory_budget if self.memory_budget else 0.0,
+            }
+
+    def get(self, job_id):
+        """
+        Look up a job by id.
+
+        Args:
+            job_id (str): Job identifier.
+
+        Returns:
+            Job: The job, or None if it is unknown or was pruned.
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.future.done()]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
+
+    def shutdown(self):
+        """
+        Stop the worker processes, cancelling queued jobs.
+        """
+        with self._lock:
+            waiting = [job for job, *_ in self._waiting]
+            self._waiting.clear()
+        for job in waiting:
+            job.future.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._events.put(None)
+
+
+def _log_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        exc = future.exception()
+        logger.error("Error processing job: %s", exc, exc_info=(type(exc), exc, exc.__traceback__))
+
+
+def _init_worker(events, initializer):
+    global _worker_events
+    _worker_events = events
+    if initializer is not None:
+        initializer()
+
+
+def _run_job(job_id, fn, args, kwargs):
+    global _worker_job, _worker_last
+    _worker_job, _worker_last = job_id, None
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _worker_job = None
+
+
+def report_progress(stage, fraction):
+    """
+    Publish the progress of the job running in this worker process.
+
+    Events are throttled to one per percent of each stage. Outside a
+    JobManager worker this does nothing.
+
+    Args:
+        stage (str): Pipeline stage.
+        fraction (float): Completed fraction of the stage, from 0 to 1.
+    """
+    global _worker_last
+    if _worker_events is None or _worker_job is None:
+        return
+    step = (stage, int(fraction * 100))
+    if step != _worker_last:
+        _worker_last = step
+        _worker_events.put((_worker_job, stage, fraction))
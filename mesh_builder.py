@@ -0,0 +1,364 @@
+import numpy as np
+
+
+def top_vertices(depth_image, x_scale, base_thickness, row_offset=0):
+    """
+    Build the top surface vertex grid for a heightfield.
+
+    Args:
+        depth_image (numpy.ndarray): 2D array of depths.
+        x_scale (float): Size of one pixel in output units.
+        base_thickness (float): Thickness added below the depth map.
+        row_offset (int): Row of the full depth map that depth_image starts
+            at, when building one band of a larger heightfield.
+
+    Returns:
+        numpy.ndarray: Vertex array of shape (height * width, 3) in row-major
+        pixel order.
+    """
+    height, width = depth_image.shape
+    vertices = np.empty((height, width, 3), dtype=np.float64)
+    vertices[:, :, 0] = np.arange(width) * x_scale
+    vertices[:, :, 1] = (np.arange(row_offset, row_offset + height) * x_scale)[:, np.newaxis]
+    vertices[:, :, 2] = depth_image + base_thickness
+    return vertices.reshape(-1, 3)
+
+
+def grid_vertices(depth_image, x_scale, base_thickness, row_offset=0):
+    """
+    Build the top and bottom vertex grids for a heightfield.
+
+    The first ``height * width`` rows are the top surface (raised by the depth
+    map), the next ``height * width`` rows are the flat bottom surface, both in
+    row-major pixel order.
+
+    Args:
+        depth_image (numpy.ndarray): 2D array of depths.
+        x_scale (float): Size of one pixel in output units.
+        base_thickness (float): Thickness added below the depth map.
+        row_offset (int): Row of the full depth map that depth_image starts at.
+
+    Returns:
+        numpy.ndarray: Vertex array of shape (2 * height * width, 3).
+    """
+    top = top_vertices(depth_image, x_scale, base_thickness, row_offset)
+    bottom = top.copy()
+    bottom[:, 2] = 0
+    return np.concatenate([top, bottom])
+
+
+def _cell_corners(height, width, offset=0):
+    """
+    Return the four corner vertex indices of every grid cell.
+
+    Args:
+        height (int): Number of vertex rows.
+        width (int): Number of vertex columns.
+        offset (int): Index of the first vertex of the grid.
+
+    Returns:
+        tuple: Flat arrays (v1, v2, v3, v4) for the top-left, top-right,
+        bottom-left and bottom-right corners, in row-major cell order.
+    """
+    v1 = (np.arange(height - 1)[:, np.newaxis] * width + np.arange(width - 1)).ravel() + offset
+    v2 = v1 + 1
+    v3 = v1 + width
+    v4 = v3 + 1
+    return v1, v2, v3, v4
+
+
+def top_faces(height, width):
+    """
+    Build the upward facing triangles of the top surface grid.
+
+    Args:
+        height (int): Number of vertex rows.
+        width (int): Number of vertex columns.
+
+    Returns:
+        numpy.ndarray: Face array of shape (2 * (height - 1) * (width - 1), 3).
+    """
+    v1, v2, v3, v4 = _cell_corners(height, width)
+    return np.stack([v1, v2, v3, v2, v4, v3], axis=1).reshape(-1, 3)
+
+
+def grid_faces(height, width):
+    """
+    Build the triangle index array for a heightfield grid.
+
+    This reproduces the original face layout: two top triangles and two
+    bottom triangles per cell, followed by four "side" triangles per cell.
+    The side triangles form internal walls, so the result is not a manifold
+    and needs repair before slicing.
+
+    Args:
+        height (int): Number of vertex rows.
+        width (int): Number of vertex columns.
+
+    Returns:
+        numpy.ndarray: Face array of shape (8 * (height - 1) * (width - 1), 3).
+    """
+    offset = height * width
+    v1, v2, v3, v4 = _cell_corners(height, width)
+    b1, b2, b3, b4 = _cell_corners(height, width, offset)
+
+    top = top_faces(height, width)
+    bottom = np.stack([b1, b3, b2, b2, b3, b4], axis=1).reshape(-1, 3)
+    sides = np.stack([
+        v1, v2, b1, v2, b2, b1,
+        v3, v4, b3, v4, b4, b3,
+    ], axis=1).reshape(-1, 3)
+    return np.concatenate([top, bottom, sides])
+
+
+def perimeter_loop(height, width):
+    """
+    Return the top surface vertices on the outer rim of the grid.
+
+    The loop runs counter-clockwise when seen from above (the same winding as
+    the top faces), starting at the first vertex.
+
+    Args:
+        height (int): Number of vertex rows.
+        width (int): Number of vertex columns.
+
+    Returns:
+        numpy.ndarray: Vertex indices of length 2 * (height + width) - 4.
+    """
+    last_row = (height - 1) * width
+    return np.concatenate([
+        np.arange(width - 1),
+        np.arange(height - 1) * width + width - 1,
+        last_row + np.arange(width - 1, 0, -1),
+        np.arange(height - 1, 0, -1) * width,
+    ])
+
+
+def base_vertices(vertices, loop):
+    """
+    Build the bottom vertices that close a surface bounded by loop.
+
+    Args:
+        vertices (numpy.ndarray): Top surface vertex array of shape (n, 3).
+        loop (numpy.ndarray): Counter-clockwise rim vertex indices.
+
+    Returns:
+        numpy.ndarray: The rim projected to z = 0 followed by one centre
+        vertex, shape (len(loop) + 1, 3).
+    """
+    rim = vertices[loop]
+    rim[:, 2] = 0
+    centre = (rim.min(axis=0) + rim.max(axis=0)) / 2
+    return np.concatenate([rim, centre[np.newaxis]])
+
+
+def wall_and_base_faces(loop, vertex_count):
+    """
+    Build the perimeter walls and the flat bottom for a surface bounded by loop.
+
+    The bottom vertices are expected right after the top surface vertices in
+    the layout produced by base_vertices. Each rim edge gets a two triangle
+    wall, and the bottom is a fan around the centre vertex, so the bottom
+    costs one triangle per rim edge instead of two per grid cell.
+
+    Args:
+        loop (numpy.ndarray): Counter-clockwise rim vertex indices.
+        vertex_count (int): Number of top surface vertices.
+
+    Returns:
+        numpy.ndarray: Face array of shape (3 * len(loop), 3).
+    """
+    p = loop
+    q = np.roll(loop, -1)
+    pb = vertex_count + np.arange(len(loop))
+    qb = np.roll(pb, -1)
+    centre = np.full(len(loop), vertex_count + len(loop))
+    walls = np.stack([q, p, pb, q, pb, qb], axis=1).reshape(-1, 3)
+    base = np.stack([qb, pb, centre], axis=1)
+    return np.concatenate([walls, base])
+
+
+def closed_vertices(depth_image, x_scale, base_thickness):
+    """
+    Build the vertices for the watertight heightfield topology.
+
+    Args:
+        depth_image (numpy.ndarray): 2D array of depths.
+        x_scale (float): Size of one pixel in output units.
+        base_thickness (float): Thickness added below the depth map.
+
+    Returns:
+        numpy.ndarray: Top grid vertices followed by the bottom rim and centre.
+    """
+    height, width = depth_image.shape
+    top = top_vertices(depth_image, x_scale, base_thickness)
+    return np.concatenate([top, base_vertices(top, perimeter_loop(height, width))])
+
+
+def closed_faces(height, width):
+    """
+    Build the faces for the watertight heightfield topology.
+
+    Only the top surface, the four perimeter walls and the bottom are emitted,
+    giving a closed, consistently oriented 2-manifold that needs no repair.
+
+    Args:
+        height (int): Number of vertex rows.
+        width (int): Number of vertex columns.
+
+    Returns:
+        numpy.ndarray: Face array of shape
+        (2 * (height - 1) * (width - 1) + 3 * (2 * (height + width) - 4), 3).
+    """
+    return np.concatenate([
+        top_faces(height, width),
+        wall_and_base_faces(perimeter_loop(height, width), height * width),
+    ])
+
+
+def grid_triangle_count(height, width):
+    """
+    Returns:
+        int: Number of triangles produced by grid_faces(height, width).
+    """
+    return 8 * (height - 1) * (width - 1)
+
+
+def closed_triangle_count(height, width):
+    """
+    Returns:
+        int: Number of triangles produced by closed_faces(height, width).
+    """
+    return 2 * (height - 1) * (width - 1) + 3 * (2 * (height + width) - 4)
+
+
+def closed_band_triangle_count(row_start, row_stop, height, width):
+    """
+    Returns:
+        int: Number of triangles produced by closed_band_mesh for the band of
+        vertex rows row_start to row_stop.
+    """
+    walls = 2 * (row_stop - row_start)
+    if row_start == 0:
+        walls += width - 1
+    if row_stop == height - 1:
+        walls += width - 1
+    base = 2 * (height + width) - 4 if row_start == 0 else 0
+    return 2 * (row_stop - row_start) * (width - 1) + 2 * walls + base
+
+
+def closed_band_mesh(depth_band, row_start, height, x_scale, base_thickness):
+    """
+    Build the part of the closed topology that belongs to one band of rows.
+
+    Bands of a height-row heightfield overlap by one vertex row. Each band
+    holds the top faces of its cells and the walls along its rows; the first
+    band also holds the top rim wall and the whole bottom, the last band the
+    bottom rim wall. Concatenating all bands gives exactly the triangles of
+    closed_faces, so a heightfield can be streamed band by band.
+
+    Args:
+        depth_band (numpy.ndarray): Depths of vertex rows row_start to
+            row_start + len(depth_band) - 1.
+        row_start (int): First vertex row of the band.
+        height (int): Number of vertex rows of the full heightfield.
+        x_scale (float): Size of one pixel in output units.
+        base_thickness (float): Thickness added below the depth map.
+
+    Returns:
+        tuple: (vertices, faces) arrays of the band.
+    """
+    band_height, width = depth_band.shape
+    row_stop = row_start + band_height - 1
+    top_count = band_height * width
+
+    # Bottom rim and centre of the full heightfield; they only depend on x/y
+    loop = perimeter_loop(height, width)
+    rim = np.zeros((len(loop) + 1, 3))
+    rim[:-1, 0] = (loop % width) * x_scale
+    rim[:-1, 1] = (loop // width) * x_scale
+    rim[-1, :2] = ((width - 1) * x_scale / 2, (height - 1) * x_scale / 2)
+    vertices = np.concatenate([top_vertices(depth_band, x_scale, base_thickness, row_start), rim])
+
+    # Walls of the rim edges that start in this band
+    p_row, q_row = loop // width, np.roll(loop, -1) // width
+    edge_row = np.minimum(p_row, q_row)
+    owned = (edge_row >= row_start) & (edge_row < row_stop)
+    if row_stop == height - 1:
+        owned |= (p_row == height - 1) & (q_row == height - 1)
+    walls_and_base = wall_and_base_faces(loop, height * width)
+    rim_faces = walls_and_base[:2 * len(loop)].reshape(len(loop), 2, 3)[owned].reshape(-1, 3)
+    if row_start == 0:
+        rim_faces = np.concatenate([rim_faces, walls_and_base[2 * len(loop):]])
+
+    # Renumber the rim faces: band top rows first, then the bottom rim and centre
+    rim_faces = np.where(rim_faces < height * width, rim_faces - row_start * width, rim_faces - height * width + top_count)
+    return vertices, np.concatenate([top_faces(band_height, width), rim_faces])
+
+
+def check_manifold(faces):
+    """
+    Check whether a triangle mesh is a closed, consistently oriented manifold.
+
+    Args:
+        faces (numpy.ndarray): Face array of shape (m, 3).
+
+    Returns:
+        dict: Edge statistics with the keys ``boundary_edges`` (edges used by
+        one face), ``non_manifold_edges`` (edges used by more than two faces),
+        ``misoriented_edges`` (edges traversed twice in the same direction),
+        ``degenerate_faces``, ``euler_characteristic`` and ``watertight``.
+    """
+    directed = faces[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2)
+    undirected = np.sort(directed, axis=1)
+    _, edge_counts = np.unique(undirected, axis=0, return_counts=True)
+    _, directed_counts = np.unique(directed, axis=0, return_counts=True)
+
+    degenerate_faces = int(np.count_nonzero(
+        (faces[:, 0] == faces[:, 1]) | (faces[:, 1] == faces[:, 2]) | (faces[:, 0] == faces[:, 2])
+    ))
+    report = {
+        'boundary_edges': int(np.count_nonzero(edge_counts == 1)),
+        'non_manifold_edges': int(np.count_nonzero(edge_counts > 2)),
+        'misoriented_edges': int(np.count_nonzero(directed_counts > 1)),
+        'degenerate_faces': degenerate_faces,
+        'euler_characteristic': len(np.unique(faces)) - len(edge_counts) + len(faces),
+    }
+    report['watertight'] = (
+        report['boundary_edges'] == 0
+        and report['non_manifold_edges'] == 0
+        and report['misoriented_edges'] == 0
+        and degenerate_faces == 0
+    )
+    return report
+
+
+def signed_volume(vertices, faces):
+    """
+    Compute the signed volume enclosed by a closed mesh.
+
+    The volume is positive when the faces are wound with outward normals.
+
+    Args:
+        vertices (numpy.ndarray): Vertex array of shape (n, 3).
+        faces (numpy.ndarray): Face array of shape (m, 3).
+
+    Returns:
+        float: The signed volume.
+    """
+    v0, v1, v2 = (vertices[faces[:, i]] for i in range(3))
+    return float(np.einsum('ij,ij->', v0, np.cross(v1, v2)) / 6)
+
+
+def faces_to_triangles(vertices, faces):
+    """
+    Expand an indexed mesh into per-triangle vertex coordinates.
+
+    Args:
+        vertices (numpy.ndarray): Vertex array of shape (n, 3).
+        faces (numpy.ndarray): Face array of shape (m, 3).
+
+    Returns:
+        numpy.ndarray: Triangle array of shape (m, 3, 3).
+    """
+    return vertices[faces]
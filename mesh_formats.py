@@ -0,0 +1,236 @@
+import gzip
+import zipfile
+
+import numpy as np
+
+from stl_writer import BinaryStlWriter, write_binary_stl, DEFAULT_CHUNK_SIZE
+
+# Output formats, named by their file extension.
+FORMATS = ('stl', 'stl.gz', '3mf', 'ply')
+MIMETYPES = {
+    'stl': 'model/stl',
+    'stl.gz': 'model/stl',
+    '3mf': 'model/3mf',
+    'ply': 'application/octet-stream',
+}
+# Compression level of gzip STL and 3MF; higher levels are several times
+# slower for a few percent smaller files.
+GZIP_LEVEL = 1
+
+PLY_FACE_DTYPE = np.dtype([('count', 'u1'), ('indices', '<i4', (3,))])
+
+CONTENT_TYPES_3MF = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="model" ContentType="application/vnd.ms-package.3dmanufacturing-3dmodel+xml"/>'
+    '</Types>\n'
+)
+RELS_3MF = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Target="/3D/3dmodel.model" Id="rel0" Type="http://schemas.microsoft.com/3dmanufacturing/2013/01/3dmodel"/>'
+    '</Relationships>\n'
+)
+MODEL_3MF_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<model unit="millimeter" xml:lang="en-US" xmlns="http://schemas.microsoft.com/3dmanufacturing/core/2015/02">\n'
+    '<resources><object id="1" type="model"><mesh><vertices>\n'
+)
+MODEL_3MF_TAIL = '</triangles></mesh></object></resources><build><item objectid="1"/></build></model>\n'
+
+# Levels of detail for the viewer: LOD_MAGIC, the number of levels, a table
+# with the vertex count, face count and byte offset of each level, coarsest
+# first, then the levels as little-endian float32 vertices followed by
+# uint32 faces.
+LOD_MAGIC = b'LOD1'
+LOD_TABLE_DTYPE = np.dtype([('vertices', '<u4'), ('faces', '<u4'), ('offset', '<u8')])
+
+
+def format_of(filename):
+    """
+    Find the output format of a mesh file from its name.
+
+    Args:
+        filename (str): File name.
+
+    Returns:
+        str: One of FORMATS, or None if the extension is not a mesh format.
+    """
+    for output_format in sorted(FORMATS, key=len, reverse=True):
+        if filename.lower().endswith('.' + output_format):
+            return output_format
+    return None
+
+
+def write_stl_gz(path, vertices, faces, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Write an indexed mesh as a gzip-compressed binary STL file.
+
+    Args:
+        path (str): Path to the output file.
+        vertices (numpy.ndarray): Vertex array of shape (n, 3).
+        faces (numpy.ndarray): Face array of shape (m, 3).
+        chunk_size (int): Number of triangles processed per batch.
+
+    Returns:
+        str: Path to the written file.
+    """
+    with open(path, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=GZIP_LEVEL, mtime=0) as f:
+        with BinaryStlWriter(f, len(faces)) as writer:
+            writer.write_indexed(vertices, faces, chunk_size)
+    return path
+
+
+def write_ply(path, vertices, faces, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Write an indexed mesh as a binary little-endian PLY file.
+
+    Each vertex is stored once, so the file is several times smaller than an
+    STL of the same heightfield.
+
+    Args:
+        path (str): Path to the output file.
+        vertices (numpy.ndarray): Vertex array of shape (n, 3).
+        faces (numpy.ndarray): Face array of shape (m, 3).
+        chunk_size (int): Number of vertices or faces converted per batch.
+
+    Returns:
+        str: Path to the written file.
+    """
+    header = (
+        "ply\n"
+        "format binary_little_endian 1.0\n"
+        "comment image-to-stl\n"
+        f"element vertex {len(vertices)}\n"
+        "property float x\nproperty float y\nproperty float z\n"
+        f"element face {len(faces)}\n"
+        "property list uchar int vertex_indices\n"
+        "end_header\n"
+    )
+    with open(path, 'wb') as f:
+        f.write(header.encode('ascii'))
+        for start in range(0, len(vertices), chunk_size):
+            f.write(np.asarray(vertices[start:start + chunk_size], dtype='<f4').tobytes())
+        for start in range(0, len(faces), chunk_size):
+            chunk = faces[start:start + chunk_size]
+            records = np.empty(len(chunk), dtype=PLY_FACE_DTYPE)
+            records['count'] = 3
+            records['indices'] = chunk
+            f.write(records.tobytes())
+    return path
+
+
+def _xml_rows(template, array, chunk_size):
+    """
+    Format the rows of an array as XML elements, one batch at a time.
+
+    Args:
+        template (str): Element template with one placeholder per column.
+        array (numpy.ndarray): 2D array.
+        chunk_size (int): Number of rows formatted per batch.
+
+    Yields:
+        bytes: Encoded elements of a batch of rows.
+    """
+    for start in range(0, len(array), chunk_size):
+        rows = array[start:start + chunk_size]
+        yield ((template * len(rows)) % tuple(rows.ravel().tolist())).encode('ascii')
+
+
+def write_3mf(path, vertices, faces, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Write an indexed mesh as a 3MF package.
+
+    The package is a deflate-compressed zip holding a single mesh object in
+    millimetres.
+
+    Args:
+        path (str): Path to the output file.
+        vertices (numpy.ndarray): Vertex array of shape (n, 3).
+        faces (numpy.ndarray): Face array of shape (m, 3).
+        chunk_size (int): Number of vertices or faces formatted per batch.
+
+    Returns:
+        str: Path to the written file.
+    """
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=GZIP_LEVEL) as package:
+        package.writestr('[Content_Types].xml', CONTENT_TYPES_3MF)
+        package.writestr('_rels/.rels', RELS_3MF)
+        with package.open('3D/3dmodel.model', 'w', force_zip64=True) as model:
+            model.write(MODEL_3MF_HEAD.encode('ascii'))
+            for rows in _xml_rows('<vertex x="%.4f" y="%.4f" z="%.4f"/>\n', vertices, chunk_size):
+                model.write(rows)
+            model.write(b'</vertices><triangles>\n')
+            for rows in _xml_rows('<triangle v1="%d" v2="%d" v3="%d"/>\n', faces, chunk_size):
+                model.write(rows)
+            model.write(MODEL_3MF_TAIL.encode('ascii'))
+    return path
+
+
+def write_lod(path, levels):
+    """
+    Write levels of detail of a mesh for the viewer.
+
+    Each level can be sent to the browser as it is and turned into a
+    three.js BufferGeometry without parsing.
+
+    Args:
+        path (str): Path to the output file.
+        levels (list): (vertices, faces) arrays of each level, coarsest first.
+
+    Returns:
+        str: Path to the written file.
+    """
+    table = np.zeros(len(levels), dtype=LOD_TABLE_DTYPE)
+    offset = len(LOD_MAGIC) + 4 + table.nbytes
+    for entry, (vertices, faces) in zip(table, levels):
+        entry['vertices'], entry['faces'], entry['offset'] = len(vertices), len(faces), offset
+        offset += 12 * (len(vertices) + len(faces))
+    with open(path, 'wb') as f:
+        f.write(LOD_MAGIC + np.uint32(len(levels)).astype('<u4').tobytes() + table.tobytes())
+        for vertices, faces in levels:
+            f.write(np.asarray(vertices, dtype='<f4').tobytes())
+            f.write(np.asarray(faces, dtype='<u4').tobytes())
+    return path
+
+
+def read_lod_table(path):
+    """
+    Read the level table of a levels of detail file.
+
+    Args:
+        path (str): Path to a file written by write_lod.
+
+    Returns:
+        numpy.ndarray: LOD_TABLE_DTYPE records, coarsest level first; level i
+        spans 12 * (vertices + faces) bytes from offset.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(len(LOD_MAGIC) + 4)
+        if len(head) < len(LOD_MAGIC) + 4 or not head.startswith(LOD_MAGIC):
+            raise ValueError(f"Not a levels of detail file: {path}")
+        count = int(np.frombuffer(head[len(LOD_MAGIC):], dtype='<u4')[0])
+        table = f.read(count * LOD_TABLE_DTYPE.itemsize)
+        if len(table) < count * LOD_TABLE_DTYPE.itemsize:
+            raise ValueError(f"Truncated levels of detail file: {path}")
+        return np.frombuffer(table, dtype=LOD_TABLE_DTYPE)
+
+
+def write_mesh(path, vertices, faces, output_format='stl'):
+    """
+    Write an indexed mesh in one of the output formats.
+
+    Args:
+        path (str): Path to the output file.
+        vertices (numpy.ndarray): Vertex array of shape (n, 3).
+        faces (numpy.ndarray): Face array of shape (m, 3).
+        output_format (str): One of FORMATS.
+
+    Returns:
+        str: Path to the written file.
+    """
+    writers = {'stl': write_binary_stl, 'stl.gz': write_stl_gz, '3mf': write_3mf, 'ply': write_ply}
+    if output_format not in writers:
+        raise ValueError(f"Unknown output format: {output_format}")
+    return writers[output_format](path, vertices, faces)
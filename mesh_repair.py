@@ -0,0 +1,181 @@
+import faulthandler
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Outcomes of repair_arrays, as recorded in LithophaneCreator.stats['repair'].
+REPAIRED = 'repaired'
+TIMEOUT = 'timeout'
+FAILED = 'failed'
+
+
+class RepairError(Exception):
+    """
+    Mesh repair did not finish within its limits or failed.
+
+    Attributes:
+        outcome (str): TIMEOUT or FAILED.
+    """
+    def __init__(self, message, outcome=FAILED):
+        super().__init__(message)
+        self.outcome = outcome
+
+
+def _address_space():
+    """
+    Returns:
+        int: Virtual memory size of this process in bytes, or None where it
+        is not available.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _to_shared(arrays):
+    """
+    Copy arrays into one new shared memory block.
+
+    Args:
+        arrays (list): Arrays to copy.
+
+    Returns:
+        tuple: (SharedMemory, layout), where layout lists the (dtype, shape,
+        offset) of each array for _from_shared.
+    """
+    layout = []
+    offset = 0
+    for array in arrays:
+        layout.append((array.dtype.str, array.shape, offset))
+        offset += array.nbytes
+    shm = shared_memory.SharedMemory(create=True, size=max(1, offset))
+    for array, (dtype, shape, start) in zip(arrays, layout):
+        np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=start)[...] = array
+    return shm, layout
+
+
+def _from_shared(shm, layout):
+    """
+    Returns:
+        list: Views of the arrays of a shared memory block.
+    """
+    return [np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=start) for dtype, shape, start in layout]
+
+
+def _limit_memory(memory_mb):
+    """
+    Limit the address space of this process to its current size plus a
+    budget, where the platform supports it.
+
+    Args:
+        memory_mb (int): Budget in MB.
+    """
+    size = _address_space()
+    try:
+        import resource
+    except ImportError:
+        return
+    if size is not None:
+        limit = size + memory_mb * 2**20
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _repair_worker(shm_name, layout, memory_mb, conn):
+    """
+    Repair a mesh in a child process.
+
+    The mesh is read from shared memory and the repaired mesh is returned in
+    a new shared memory block, whose name and layout are sent back; the
+    parent unlinks it.
+
+    Args:
+        shm_name (str): Shared memory block holding the vertices and faces.
+        layout (list): Layout of the block, see _to_shared.
+        memory_mb (int): Memory budget of the repair in MB, or None.
+        conn (multiprocessing.connection.Connection): Pipe to the parent.
+    """
+    # A crash is reported by the parent, not as a traceback dump on stderr
+    faulthandler.disable()
+    try:
+        # Imported here since it loads PyVista and VTK, whose libraries
+        # should not count against the budget
+        import pymeshfix
+        shm = shared_memory.SharedMemory(name=shm_name)
+        if memory_mb:
+            _limit_memory(memory_mb)
+        try:
+            # PyMeshFix keeps views of the input, so the block stays mapped
+            # until it is done
+            meshfix = pymeshfix.MeshFix(*_from_shared(shm, layout))
+            meshfix.repair()
+            result, result_layout = _to_shared([np.ascontiguousarray(meshfix.points), np.ascontiguousarray(meshfix.faces)])
+            result.close()
+            del meshfix
+        finally:
+            shm.close()
+        conn.send((result.name, result_layout, None))
+    except BaseException as e:
+        conn.send((None, None, f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+
+def repair_arrays(vertices, faces, timeout=None, memory_mb=None):
+    """
+    Repair a mesh with PyMeshFix in an isolated child process.
+
+    The arrays are passed through shared memory rather than pickled. A
+    repair that runs past the timeout is killed, and one that needs more
+    memory than allowed fails in the child, so neither can take down the
+    calling process.
+
+    Args:
+        vertices (numpy.ndarray): Vertex array of shape (n, 3).
+        faces (numpy.ndarray): Face array of shape (m, 3).
+        timeout (float): Wall-clock limit in seconds, or None.
+        memory_mb (int): Memory the repair may allocate in MB, or None.
+            Enforced as an address space limit where the platform supports
+            it.
+
+    Returns:
+        tuple: (vertices, faces) arrays of the repaired mesh.
+
+    Raises:
+        RepairError: If the repair times out, runs out of memory or fails.
+    """
+    shm, layout = _to_shared([np.asarray(vertices, dtype=np.float64), np.asarray(faces, dtype=np.int32)])
+    try:
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=_repair_worker, args=(shm.name, layout, memory_mb, sender), daemon=True)
+        process.start()
+        sender.close()
+        try:
+            if not receiver.poll(timeout):
+                raise RepairError(f"Mesh repair did not finish within {timeout:g}s", TIMEOUT)
+            try:
+                result_name, result_layout, error = receiver.recv()
+            except EOFError:
+                process.join()
+                raise RepairError(f"Mesh repair process died with exit code {process.exitcode}")
+        finally:
+            if process.is_alive():
+                process.kill()
+            process.join()
+            receiver.close()
+    finally:
+        shm.close()
+        shm.unlink()
+
+    if error is not None:
+        raise RepairError(f"Mesh repair failed: {error}")
+    result = shared_memory.SharedMemory(name=result_name)
+    try:
+        points, fixed_faces = (array.copy() for array in _from_shared(result, result_layout))
+    finally:
+        result.close()
+        result.unlink()
+    return points, fixed_faces
@@ -0,0 +1,304 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+
+# Histogram buckets for stage and job durations, in seconds.
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+# Histogram buckets for resident memory, in bytes (32 MB to 16 GB).
+BYTES_BUCKETS = tuple(2**n for n in range(25, 35))
+# Histogram buckets for triangle counts.
+TRIANGLE_BUCKETS = tuple(10**n for n in range(3, 9))
+# Number of job traces kept for /logs.
+TRACE_HISTORY = 200
+
+
+def current_rss():
+    """
+    Resident set size of this process.
+
+    Returns:
+        int: Resident memory in bytes, or the peak resident memory where the
+        current value is not available.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        try:
+            import resource
+        except ImportError:
+            return 0
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        scale = 1 if os.uname().sysname == 'Darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+@contextmanager
+def span(spans, stage):
+    """
+    Time a pipeline stage and append its span to a list.
+
+    The span is a dict holding the stage name, its wall time in seconds and
+    the resident memory of the process when it ended. The caller may add
+    fields to the yielded dict.
+
+    Args:
+        spans (list): List the span is appended to.
+        stage (str): Stage name.
+
+    Yields:
+        dict: The span.
+    """
+    record = {'stage': stage}
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['seconds'] = time.perf_counter() - start
+        record['rss_bytes'] = current_rss()
+        spans.append(record)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Monotonic counter with optional labels.
+
+    Attributes:
+        name (str): Metric name.
+        help (str): Metric description.
+    """
+    type = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        """
+        Add to the counter of a label set.
+
+        Args:
+            amount (float): Increment.
+            **labels: Label values.
+        """
+        key = tuple(sorted(labels.items()))
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        """
+        Returns:
+            list: (name, labels, value) tuples in exposition order.
+        """
+        return [(self.name, key, value) for key, value in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    """
+    Value that can go up and down, with optional labels.
+    """
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        """
+        Set the value of a label set.
+
+        Args:
+            value (float): New value.
+            **labels: Label values.
+        """
+        self._values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed buckets and optional labels.
+
+    Attributes:
+        name (str): Metric name.
+        help (str): Metric description.
+        buckets (tuple): Upper bounds of the buckets, in increasing order.
+    """
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, value, **labels):
+        """
+        Record a value.
+
+        Args:
+            value (float): Observed value.
+            **labels: Label values.
+        """
+        key = tuple(sorted(labels.items()))
+        counts, total = self._series.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+        counts[bisect_left(self.buckets, value)] += 1
+        self._series[key] = (counts, total + value)
+
+    def samples(self):
+        """
+        Returns:
+            list: (name, labels, value) tuples in exposition order.
+        """
+        samples = []
+        for key, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else _format_value(bound)
+                samples.append((f'{self.name}_bucket', key + (('le', le),), cumulative))
+            samples.append((f'{self.name}_sum', key, total))
+            samples.append((f'{self.name}_count', key, cumulative))
+        return samples
+
+
+class Registry:
+    """
+    Collection of metrics rendered in the Prometheus text format.
+
+    Updates go through the registry so that they are serialized with
+    rendering.
+    """
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help):
+        """
+        Returns:
+            Counter: A new counter rendered by this registry.
+        """
+        return self._add(Counter(name, help))
+
+    def gauge(self, name, help):
+        """
+        Returns:
+            Gauge: A new gauge rendered by this registry.
+        """
+        return self._add(Gauge(name, help))
+
+    def histogram(self, name, help, buckets):
+        """
+        Returns:
+            Histogram: A new histogram rendered by this registry.
+        """
+        return self._add(Histogram(name, help, buckets))
+
+    @contextmanager
+    def updating(self):
+        """
+        Hold the registry lock while updating several metrics.
+        """
+        with self._lock:
+            yield
+
+    def render(self):
+        """
+        Render all metrics.
+
+        Returns:
+            str: Metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            for metric in self._metrics:
+                lines.append(f'# HELP {metric.name} {metric.help}')
+                lines.append(f'# TYPE {metric.name} {metric.type}')
+                for name, labels, value in metric.samples():
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+stage_seconds = registry.histogram('lithophane_stage_seconds', 'Wall time of pipeline stages.', SECONDS_BUCKETS)
+stage_rss_bytes = registry.histogram(
+    'lithophane_stage_rss_bytes', 'Resident memory of the worker at the end of pipeline stages.', BYTES_BUCKETS
+)
+job_seconds = registry.histogram('lithophane_job_seconds', 'Time from job submission to completion.', SECONDS_BUCKETS)
+job_triangles = registry.histogram('lithophane_job_triangles', 'Triangles in generated meshes.', TRIANGLE_BUCKETS)
+jobs_total = registry.counter('lithophane_jobs_total', 'Finished conversion jobs by status.')
+repair_seconds = registry.histogram(
+    'lithophane_repair_seconds', 'Wall time of mesh repairs per job by outcome.', SECONDS_BUCKETS
+)
+
+# Most recent job traces, newest last
+traces = deque(maxlen=TRACE_HISTORY)
+traces_lock = threading.Lock()
+
+
+def record_job(job_id, status, params, seconds, stats=None, error=None):
+    """
+    Aggregate the spans of a finished job and keep its trace.
+
+    Args:
+        job_id (str): Job identifier.
+        status (str): Final job status.
+        params (dict): Conversion parameters.
+        seconds (float): Time from submission to completion.
+        stats (dict): LithophaneCreator.stats of the job, as far as it got.
+        error (str): Error message, if it failed.
+    """
+    stats = stats or {}
+    spans = stats.get('spans', [])
+    with registry.updating():
+        jobs_total.inc(status=status)
+        job_seconds.observe(seconds)
+        if 'triangles' in stats:
+            job_triangles.observe(stats['triangles'])
+        if 'repair' in stats:
+            repair_seconds.observe(stats['repair']['seconds'], outcome=stats['repair']['outcome'])
+        for record in spans:
+            stage_seconds.observe(record['seconds'], stage=record['stage'])
+            stage_rss_bytes.observe(record['rss_bytes'], stage=record['stage'])
+
+    trace = {
+        'job_id': job_id,
+        'status': status,
+        'finished_at': time.time(),
+        'seconds': seconds,
+        'params': params,
+        'image_size': stats.get('image_size'),
+        'triangles': stats.get('triangles'),
+        'stages': spans,
+    }
+    if 'repair' in stats:
+        trace['repair'] = stats['repair']
+    if error is not None:
+        trace['error'] = error
+    with traces_lock:
+        traces.append(trace)
+
+
+def recent_traces(limit=None):
+    """
+    Args:
+        limit (int): Maximum number of traces to return.
+
+    Returns:
+        list: Job traces, newest first.
+    """
+    with traces_lock:
+        recent = list(reversed(traces))
+    return recent[:limit] if limit else recent
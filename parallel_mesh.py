@@ -0,0 +1,191 @@
+import atexit
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from mesh_builder import (
+    grid_vertices, grid_faces, closed_band_mesh, grid_triangle_count, closed_band_triangle_count,
+)
+from stl_writer import STL_DTYPE, HEADER_SIZE, DEFAULT_CHUNK_SIZE, _header, triangle_normals
+
+# Bands per worker, so that uneven bands still keep every worker busy.
+BANDS_PER_WORKER = 4
+
+# Band pool of this process, kept from one conversion to the next, see
+# _get_executor
+_executor = None
+_executor_workers = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(workers):
+    """
+    Return the band pool of this process, created on first use.
+
+    Starting processes costs more than meshing a small image, so the pool
+    is reused by later conversions with the same number of workers.
+
+    Args:
+        workers (int): Number of worker processes.
+
+    Returns:
+        concurrent.futures.ProcessPoolExecutor: The pool.
+    """
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ProcessPoolExecutor(max_workers=workers)
+            _executor_workers = workers
+        return _executor
+
+
+def _shutdown_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+
+
+def _forget_executor():
+    # In a forked child, such as a job worker: the pool belongs to the parent
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+atexit.register(_shutdown_executor)
+os.register_at_fork(after_in_child=_forget_executor)
+
+
+def band_mesh(depth_band, row_start, height, x_scale, base_thickness, topology):
+    """
+    Build the triangles of one band of rows of a heightfield.
+
+    Bands overlap by one vertex row; concatenating all bands gives the same
+    triangles as meshing the whole heightfield at once.
+
+    Args:
+        depth_band (numpy.ndarray): Depths of the vertex rows of the band.
+        row_start (int): First vertex row of the band.
+        height (int): Number of vertex rows of the full heightfield.
+        x_scale (float): Size of one pixel in output units.
+        base_thickness (float): Thickness added below the depth map.
+        topology (str): Mesh layout, "grid" or "closed".
+
+    Returns:
+        tuple: (vertices, faces) arrays of the band.
+    """
+    if topology == 'closed':
+        return closed_band_mesh(depth_band, row_start, height, x_scale, base_thickness)
+    vertices = grid_vertices(depth_band, x_scale, base_thickness, row_start)
+    return vertices, grid_faces(*depth_band.shape)
+
+
+def band_triangle_count(row_start, row_stop, height, width, topology):
+    """
+    Returns:
+        int: Number of triangles band_mesh produces for the band of vertex
+        rows row_start to row_stop.
+    """
+    if topology == 'closed':
+        return closed_band_triangle_count(row_start, row_stop, height, width)
+    return grid_triangle_count(row_stop - row_start + 1, width)
+
+
+def _write_band(task):
+    """
+    Mesh one band in a worker process and write it into the STL file.
+
+    The depth map is read from shared memory and the triangles are written
+    through a memory map at the band's offset, so neither is pickled.
+
+    Args:
+        task (tuple): (shm_name, shape, path, first, row_start, row_stop,
+            x_scale, base_thickness, topology, chunk_size).
+
+    Returns:
+        int: Number of triangles written.
+    """
+    shm_name, shape, path, first, row_start, row_stop, x_scale, base_thickness, topology, chunk_size = task
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        depth_image = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        vertices, faces = band_mesh(depth_image[row_start:row_stop + 1], row_start, shape[0], x_scale, base_thickness, topology)
+        del depth_image
+    finally:
+        shm.close()
+
+    records = np.memmap(path, dtype=STL_DTYPE, mode='r+', offset=HEADER_SIZE + 4 + first * STL_DTYPE.itemsize, shape=(len(faces),))
+    for start in range(0, len(faces), chunk_size):
+        triangles = vertices[faces[start:start + chunk_size]]
+        chunk = records[start:start + len(triangles)]
+        chunk['vectors'] = triangles
+        chunk['normals'] = triangle_normals(triangles)
+    records.flush()
+    del records
+    return len(faces)
+
+
+def write_parallel_stl(path, unit_depth, max_depth, x_scale, base_thickness, topology, workers, bands=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Mesh a heightfield in bands on a process pool and write one binary STL.
+
+    The depth map is copied once into shared memory, and the bands run on a
+    pool kept by this process for later calls. The file is preallocated
+    with the final triangle count, and every worker writes its band's records
+    at an offset computed from the triangle counts of the bands before it.
+
+    Args:
+        path (str): Path to the output STL file.
+        unit_depth (numpy.ndarray): 2D depth map in [0, 1].
+        max_depth (float): Depth of a unit value in output units.
+        x_scale (float): Size of one pixel in output units.
+        base_thickness (float): Thickness added below the depth map.
+        topology (str): Mesh layout, "grid" or "closed".
+        workers (int): Number of worker processes.
+        bands (int): Number of bands (default: BANDS_PER_WORKER per worker).
+        chunk_size (int): Number of triangles gathered per batch in a worker.
+
+    Returns:
+        tuple: (triangle_count, bands) of the written mesh.
+    """
+    height, width = unit_depth.shape
+    bands = min(height - 1, bands or workers * BANDS_PER_WORKER)
+    edges = np.linspace(0, height - 1, bands + 1).round().astype(int)
+    counts = [band_triangle_count(start, stop, height, width, topology) for start, stop in zip(edges[:-1], edges[1:])]
+    firsts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    triangle_count = int(sum(counts))
+
+    with open(path, 'wb') as f:
+        f.write(_header(triangle_count))
+        f.truncate(HEADER_SIZE + 4 + triangle_count * STL_DTYPE.itemsize)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(1, unit_depth.size * 8))
+    try:
+        depth_image = np.ndarray(unit_depth.shape, dtype=np.float64, buffer=shm.buf)
+        np.multiply(unit_depth, max_depth, out=depth_image)
+        del depth_image
+        tasks = [
+            (shm.name, (height, width), path, int(first), int(start), int(stop), x_scale, base_thickness, topology, chunk_size)
+            for first, start, stop in zip(firsts, edges[:-1], edges[1:])
+        ]
+        try:
+            written = sum(_get_executor(workers).map(_write_band, tasks))
+        except BrokenProcessPool:
+            # A worker died; start a new pool next time
+            _shutdown_executor()
+            raise
+    finally:
+        shm.close()
+        shm.unlink()
+
+    if written != triangle_count:
+        raise ValueError(f"STL header declares {triangle_count} triangles but {written} were written")
+    return triangle_count, bands
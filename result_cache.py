@@ -0,0 +1,268 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+def image_digest(image_bytes):
+    """
+    Compute the content address of an uploaded image.
+
+    Args:
+        image_bytes (bytes): Raw bytes of the uploaded image.
+
+    Returns:
+        str: Hex SHA-256 digest of the image.
+    """
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def cache_key(digest, params):
+    """
+    Compute the content address of a conversion.
+
+    Args:
+        digest (str): Digest of the image, see image_digest.
+        params (dict): Normalized LithophaneCreator parameters.
+
+    Returns:
+        str: Hex SHA-256 digest of the image digest and the parameters.
+    """
+    return hashlib.sha256(f"{digest}:{json.dumps(params, sort_keys=True)}".encode()).hexdigest()
+
+
+class FolderLRU:
+    """
+    Keep the total size of the files in a folder under a byte budget.
+
+    Files are tracked in least recently used order. Existing files are picked
+    up on creation, oldest modification time first.
+
+    Attributes:
+        folder (str): Folder holding the files.
+        max_bytes (int): Size budget for the folder.
+        total_bytes (int): Current size of the tracked files.
+        evictions (int): Number of files removed to stay under budget.
+    """
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.evictions = 0
+        self._files = OrderedDict()
+        self._lock = threading.Lock()
+        entries = []
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            if os.path.isfile(path):
+                entries.append((os.path.getmtime(path), name, os.path.getsize(path)))
+        for _, name, size in sorted(entries):
+            self._files[name] = size
+            self.total_bytes += size
+
+    def names(self):
+        """
+        Returns:
+            list: Tracked file names, least recently used first.
+        """
+        with self._lock:
+            return list(self._files)
+
+    def touch(self, name):
+        """
+        Mark a file as recently used.
+
+        Args:
+            name (str): File name inside the folder.
+
+        Returns:
+            bool: True if the file is tracked and still exists.
+        """
+        with self._lock:
+            if name not in self._files:
+                return False
+            if not os.path.exists(os.path.join(self.folder, name)):
+                self.total_bytes -= self._files.pop(name)
+                return False
+            self._files.move_to_end(name)
+            return True
+
+    def add(self, name, protected=()):
+        """
+        Start tracking a new file and evict old files if over budget.
+
+        Args:
+            name (str): File name inside the folder.
+            protected (iterable): File names that must not be evicted.
+
+        Returns:
+            list: Names of the evicted files.
+        """
+        size = os.path.getsize(os.path.join(self.folder, name))
+        with self._lock:
+            self.total_bytes += size - self._files.pop(name, 0)
+            self._files[name] = size
+        return self.evict(protected=set(protected) | {name})
+
+    def evict(self, protected=()):
+        """
+        Delete least recently used files until the folder fits the budget.
+
+        Args:
+            protected (iterable): File names that must not be evicted.
+
+        Returns:
+            list: Names of the evicted files.
+        """
+        evicted = []
+        with self._lock:
+            for name in list(self._files):
+                if self.total_bytes <= self.max_bytes:
+                    break
+                if name in protected:
+                    continue
+                self.total_bytes -= self._files.pop(name)
+                try:
+                    os.remove(os.path.join(self.folder, name))
+                except FileNotFoundError:
+                    pass
+                evicted.append(name)
+            self.evictions += len(evicted)
+        return evicted
+
+
+class ResultCache:
+    """
+    Content-addressed cache of generated meshes.
+
+    Output files are named after their cache key (see cache_key), optionally
+    followed by a suffix such as "_fixed", so the cache index can be rebuilt
+    from the output folder after a restart. Companion files of an output,
+    such as its viewer levels of detail, share its key but have one of
+    COMPANION_EXTENSIONS and are never returned by lookup. Both the output
+    and the upload folders are kept under a size budget with LRU eviction.
+    The unit depth maps the job workers share (see
+    LithophaneCreator.depth_folder) are companion files too, named after
+    their depth stage key.
+
+    Attributes:
+        outputs (FolderLRU): Generated meshes.
+        uploads (FolderLRU): Uploaded source images.
+        hits (int): Number of lookups served from the cache.
+        misses (int): Number of lookups that required a new conversion.
+    """
+    COMPANION_EXTENSIONS = ('.lod', '.depth.npy')
+
+    def __init__(self, output_folder, upload_folder, max_output_bytes, max_upload_bytes):
+        self.outputs = FolderLRU(output_folder, max_output_bytes)
+        self.uploads = FolderLRU(upload_folder, max_upload_bytes)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._index = {}
+        for name in self.outputs.names():
+            if not name.endswith(self.COMPANION_EXTENSIONS):
+                self._index[self._key_of(name)] = name
+
+    @staticmethod
+    def _key_of(name):
+        return name.split('.', 1)[0].split('_', 1)[0]
+
+    def lookup(self, key):
+        """
+        Find the output file of a previous conversion.
+
+        Args:
+            key (str): Cache key of the conversion.
+
+        Returns:
+            str: Output file name on a hit, None on a miss.
+        """
+        with self._lock:
+            name = self._index.get(key)
+            if name is not None and not self.outputs.touch(name):
+                del self._index[key]
+                name = None
+            if name is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return name
+
+    def store(self, key, name, protected=()):
+        """
+        Record the output file of a finished conversion.
+
+        Args:
+            key (str): Cache key of the conversion.
+            name (str): Output file name inside the output folder.
+            protected (iterable): Output file names that must not be evicted.
+        """
+        with self._lock:
+            self._index[key] = name
+        for evicted in self.outputs.add(name, protected):
+            self._forget(evicted)
+
+    def add_companion(self, name, protected=()):
+        """
+        Track a new companion file of an output, evicting old outputs if
+        over budget. Companion files are evicted on their own.
+
+        Args:
+            name (str): File name inside the output folder.
+            protected (iterable): Output file names that must not be evicted.
+        """
+        for evicted in self.outputs.add(name, protected):
+            self._forget(evicted)
+
+    def companion(self, key, extension):
+        """
+        Find a companion file of an output and mark it as recently used.
+
+        Args:
+            key (str): Cache key of the conversion.
+            extension (str): One of COMPANION_EXTENSIONS.
+
+        Returns:
+            str: File name on a hit, None if it is missing.
+        """
+        name = key + extension
+        return name if self.outputs.touch(name) else None
+
+    def add_upload(self, name, protected=()):
+        """
+        Track a newly saved upload, evicting old uploads if over budget.
+
+        Args:
+            name (str): File name inside the upload folder.
+            protected (iterable): Upload names that must not be evicted.
+        """
+        self.uploads.add(name, protected)
+
+    def _forget(self, name):
+        with self._lock:
+            key = self._key_of(name)
+            if self._index.get(key) == name:
+                del self._index[key]
+
+    def stats(self):
+        """
+        Report the cache counters.
+
+        Returns:
+            dict: Hit and miss counts, hit ratio, eviction counts and the
+            current size of both folders.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._index),
+                "output_bytes": self.outputs.total_bytes,
+                "output_evictions": self.outputs.evictions,
+                "upload_bytes": self.uploads.total_bytes,
+                "upload_evictions": self.uploads.evictions,
+            }
@@ -0,0 +1,133 @@
+import threading
+from collections import OrderedDict
+
+
+def _nbytes(value):
+    """
+    Estimate the memory held by a cached value.
+
+    Args:
+        value: A NumPy array, or a tuple/list of them.
+
+    Returns:
+        int: Total size of the arrays in bytes.
+    """
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(item) for item in value)
+    return getattr(value, 'nbytes', 0)
+
+
+def _freeze(value):
+    """
+    Make cached arrays read-only so callers cannot corrupt later hits.
+    """
+    if isinstance(value, (tuple, list)):
+        for item in value:
+            _freeze(item)
+    elif hasattr(value, 'setflags'):
+        value.setflags(write=False)
+    return value
+
+
+class StageCache:
+    """
+    In-process LRU cache for intermediate pipeline results.
+
+    Entries are NumPy arrays (or tuples of arrays) keyed by the parameters the
+    stage depends on. The cache is bounded by the total size of its entries;
+    an entry larger than the budget is never stored.
+
+    Attributes:
+        max_bytes (int): Size budget for all entries.
+        total_bytes (int): Current size of all entries.
+        hits (int): Number of lookups served from the cache.
+        misses (int): Number of lookups that had to compute the value.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Look up an entry, marking it as recently used.
+
+        Args:
+            key (hashable): Stage parameters.
+
+        Returns:
+            The cached value, or None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        """
+        Store an entry, evicting least recently used entries to fit the budget.
+
+        Args:
+            key (hashable): Stage parameters.
+            value: The value to cache; its arrays are made read-only.
+
+        Returns:
+            The value.
+        """
+        size = _nbytes(value)
+        _freeze(value)
+        if size > self.max_bytes:
+            return value
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+        return value
+
+    def resize(self, max_bytes):
+        """
+        Change the size budget, evicting least recently used entries to fit.
+
+        Args:
+            max_bytes (int): New size budget.
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached value for key, computing and storing it on a miss.
+
+        Args:
+            key (hashable): Stage parameters.
+            compute (callable): Function returning the value.
+
+        Returns:
+            tuple: (value, hit) where hit is True if the value came from the cache.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value, True
+        return self.put(key, compute()), False
+
+    def clear(self):
+        """
+        Drop all entries.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
@@ -23,25 +23,113 @@ document.getElementById('upload-form').addEventListener('submit', function(event
     })
     .then(response => response.json())
     .then(data => {
-        document.getElementById('processing-animation').style.display = 'none';  // Hide the processing animation
-        if (data.success) {
-            var downloadLink = document.getElementById('download-link');
-            downloadLink.href = data.stl_url;
-            downloadLink.style.display = 'block';
-
-            var viewStlButton = document.getElementById('view-stl-button');
-            viewStlButton.setAttribute('data-url', data.stl_url);
-            viewStlButton.style.display = 'block';
+        if (data.success && data.stl_url) {
+            showResult(data.stl_url, data.lod_url);  // Served from the result cache
+        } else if (data.success) {
+            if (data.preview_url) {
+                showPreview(data.preview_url);
+            }
+            watchJob(data.events_url, data.status_url);
+        } else if (data.retry_after) {
+            showError(data.error + ' - the server is busy, try again in ' + data.retry_after + ' s');
         } else {
-            console.error(data.error);
+            showError(data.error);
         }
     })
     .catch(error => {
-        document.getElementById('processing-animation').style.display = 'none';  // Hide the processing animation
-        console.error('Error:', error);
+        showError(error);
     });
 });
 
+function watchJob(eventsUrl, statusUrl) {
+    if (!window.EventSource || !eventsUrl) {
+        pollJob(statusUrl);
+        return;
+    }
+    var source = new EventSource(eventsUrl);
+    source.addEventListener('progress', function(event) {
+        showProgress(JSON.parse(event.data));
+    });
+    source.addEventListener('done', function(event) {
+        source.close();
+        var data = JSON.parse(event.data);
+        if (data.status === 'done') {
+            showResult(data.stl_url, data.lod_url, data.warning);
+        } else {
+            showError(data.error);
+        }
+    });
+    source.onerror = function() {
+        // Fall back to polling rather than reconnecting
+        source.close();
+        pollJob(statusUrl);
+    };
+}
+
+function showProgress(progress) {
+    var percent = Math.round(progress.fraction * 100);
+    document.getElementById('terminal').textContent = 'Building the mesh: ' + progress.stage + ' ' + percent + '%';
+}
+
+function pollJob(statusUrl) {
+    fetch(statusUrl)
+    .then(response => response.json())
+    .then(data => {
+        if (data.status === 'queued' || data.status === 'running') {
+            if (data.progress) {
+                showProgress(data.progress);
+            }
+            setTimeout(function() { pollJob(statusUrl); }, 500);
+        } else if (data.status === 'done') {
+            showResult(data.stl_url, data.lod_url, data.warning);
+        } else {
+            showError(data.error);
+        }
+    })
+    .catch(error => {
+        showError(error);
+    });
+}
+
+function showPreview(previewUrl) {
+    document.getElementById('processing-animation').style.display = 'none';  // Hide the processing animation
+    document.getElementById('terminal').textContent = 'Showing a preview while the full resolution STL is built...';
+
+    // Only the full resolution STL is offered for download
+    document.getElementById('download-link').style.display = 'none';
+
+    var viewStlButton = document.getElementById('view-stl-button');
+    viewStlButton.setAttribute('data-url', previewUrl);
+    viewStlButton.removeAttribute('data-lod-url');
+    viewStlButton.textContent = 'View Preview';
+    viewStlButton.style.display = 'block';
+}
+
+function showResult(stlUrl, lodUrl, warning) {
+    document.getElementById('processing-animation').style.display = 'none';  // Hide the processing animation
+    document.getElementById('terminal').textContent = warning || '';  // E.g. a mesh repair that fell back to the unrepaired mesh
+
+    var downloadLink = document.getElementById('download-link');
+    downloadLink.href = stlUrl;
+    downloadLink.style.display = 'block';
+
+    var viewStlButton = document.getElementById('view-stl-button');
+    viewStlButton.setAttribute('data-url', stlUrl);
+    if (lodUrl) {
+        viewStlButton.setAttribute('data-lod-url', lodUrl);  // The viewer loads levels of detail instead
+    } else {
+        viewStlButton.removeAttribute('data-lod-url');
+    }
+    viewStlButton.textContent = 'View STL';
+    viewStlButton.style.display = 'block';
+}
+
+function showError(error) {
+    document.getElementById('processing-animation').style.display = 'none';  // Hide the processing animation
+    document.getElementById('terminal').textContent = 'Error: ' + error;
+    console.error('Error:', error);
+}
+
 function updateOutputWidthLabel() {
     const outputWidth = parseInt(document.getElementById('output_width').value, 10);
     const widthInMM = (outputWidth / 96) * 25.4;
@@ -52,5 +140,9 @@ function viewStl() {
     var button = document.getElementById('view-stl-button');
     var stlUrl = button.getAttribute('data-url');
     var viewerUrl = window.location.origin + "/viewer?file=" + encodeURIComponent(stlUrl);
+    var lodUrl = button.getAttribute('data-lod-url');
+    if (lodUrl) {
+        viewerUrl += "&lod=" + encodeURIComponent(lodUrl);
+    }
     window.open(viewerUrl, "STL Viewer", "width=800,height=600");
 }
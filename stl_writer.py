@@ -0,0 +1,166 @@
+import numpy as np
+
+# Record layout of a binary STL triangle (identical to numpy-stl's Mesh.dtype).
+STL_DTYPE = np.dtype([
+    ('normals', '<f4', (3,)),
+    ('vectors', '<f4', (3, 3)),
+    ('attr', '<u2', (1,)),
+])
+HEADER_SIZE = 80
+DEFAULT_CHUNK_SIZE = 1 << 18
+DEFAULT_HEADER = b'image-to-stl binary STL'
+
+
+def triangle_normals(triangles):
+    """
+    Compute unit normals for a batch of triangles.
+
+    Args:
+        triangles (numpy.ndarray): Triangle array of shape (n, 3, 3).
+
+    Returns:
+        numpy.ndarray: Float32 array of shape (n, 3). Degenerate triangles get
+        a zero normal.
+    """
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    np.divide(normals, lengths, out=normals, where=lengths > 0)
+    return normals.astype(np.float32, copy=False)
+
+
+def _records(triangles):
+    """
+    Pack a batch of triangles into binary STL records.
+
+    Args:
+        triangles (numpy.ndarray): Triangle array of shape (n, 3, 3).
+
+    Returns:
+        numpy.ndarray: Structured array with dtype STL_DTYPE.
+    """
+    records = np.zeros(len(triangles), dtype=STL_DTYPE)
+    records['vectors'] = triangles
+    records['normals'] = triangle_normals(triangles)
+    return records
+
+
+def _header(triangle_count, header=DEFAULT_HEADER):
+    """
+    Build the 84 byte binary STL header.
+
+    Args:
+        triangle_count (int): Number of triangles in the file.
+        header (bytes): Free-form header text, truncated to 80 bytes.
+
+    Returns:
+        bytes: The header followed by the little-endian triangle count.
+    """
+    return header[:HEADER_SIZE].ljust(HEADER_SIZE, b' ') + np.uint32(triangle_count).tobytes()
+
+
+class BinaryStlWriter:
+    """
+    Stream triangles to a binary STL file in batches.
+
+    The triangle count must be known up front so the header can be written
+    before any triangle data; writing a different number of triangles raises
+    on close.
+
+    Attributes:
+        triangle_count (int): Number of triangles declared in the header.
+        written (int): Number of triangles written so far.
+        progress (callable): Called with the fraction of the triangles
+            written after each batch, if set.
+    """
+    def __init__(self, fileobj, triangle_count, header=DEFAULT_HEADER, progress=None):
+        self.fileobj = fileobj
+        self.triangle_count = int(triangle_count)
+        self.written = 0
+        self.progress = progress
+        self.fileobj.write(_header(self.triangle_count, header))
+
+    def write_triangles(self, triangles):
+        """
+        Append a batch of triangles, computing their normals.
+
+        Args:
+            triangles (numpy.ndarray): Triangle array of shape (n, 3, 3).
+        """
+        self.fileobj.write(_records(triangles).tobytes())
+        self.written += len(triangles)
+        if self.progress is not None and self.triangle_count:
+            self.progress(self.written / self.triangle_count)
+
+    def write_indexed(self, vertices, faces, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Append an indexed mesh, gathering at most chunk_size triangles at a time.
+
+        Args:
+            vertices (numpy.ndarray): Vertex array of shape (n, 3).
+            faces (numpy.ndarray): Face array of shape (m, 3).
+            chunk_size (int): Number of triangles gathered per batch.
+        """
+        for start in range(0, len(faces), chunk_size):
+            self.write_triangles(vertices[faces[start:start + chunk_size]])
+
+    def close(self):
+        """
+        Check that the declared number of triangles was written.
+
+        Raises:
+            ValueError: If the triangle count does not match the header.
+        """
+        if self.written != self.triangle_count:
+            raise ValueError(f"STL header declares {self.triangle_count} triangles but {self.written} were written")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+
+def write_binary_stl(path, vertices, faces, chunk_size=DEFAULT_CHUNK_SIZE, use_mmap=False, header=DEFAULT_HEADER, progress=None):
+    """
+    Write an indexed mesh to a binary STL file.
+
+    Triangles are gathered and their normals computed in chunks, so at most
+    chunk_size triangles are held in memory besides the indexed arrays.
+
+    Args:
+        path (str): Path to the output STL file.
+        vertices (numpy.ndarray): Vertex array of shape (n, 3).
+        faces (numpy.ndarray): Face array of shape (m, 3).
+        chunk_size (int): Number of triangles processed per batch.
+        use_mmap (bool): Preallocate the file and fill it through a memory map
+            instead of buffered writes.
+        header (bytes): Free-form header text, truncated to 80 bytes.
+        progress (callable): Called with the fraction of the triangles
+            written after each batch.
+
+    Returns:
+        str: Path to the written STL file.
+    """
+    triangle_count = len(faces)
+    if not use_mmap:
+        with open(path, 'wb') as f, BinaryStlWriter(f, triangle_count, header, progress) as writer:
+            writer.write_indexed(vertices, faces, chunk_size)
+        return path
+
+    with open(path, 'wb') as f:
+        f.write(_header(triangle_count, header))
+        f.truncate(HEADER_SIZE + 4 + triangle_count * STL_DTYPE.itemsize)
+    if triangle_count == 0:
+        return path
+    records = np.memmap(path, dtype=STL_DTYPE, mode='r+', offset=HEADER_SIZE + 4, shape=(triangle_count,))
+    for start in range(0, triangle_count, chunk_size):
+        triangles = vertices[faces[start:start + chunk_size]]
+        chunk = records[start:start + len(triangles)]
+        chunk['vectors'] = triangles
+        chunk['normals'] = triangle_normals(triangles)
+        if progress is not None:
+            progress((start + len(triangles)) / triangle_count)
+    records.flush()
+    del records
+    return path
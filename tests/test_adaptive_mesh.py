@@ -0,0 +1,53 @@
+import unittest
+import numpy as np
+from adaptive_mesh import adaptive_mesh
+from mesh_builder import check_manifold, closed_faces
+
+
+def surface_error(depth_image, vertices, faces, base_thickness):
+    """Largest vertical distance between the top surface and the depth samples."""
+    top = faces[(vertices[faces][:, :, 2] > 0).all(axis=1)]
+    error = np.zeros(depth_image.shape)
+    covered = np.zeros(depth_image.shape, dtype=bool)
+    for face in top:
+        p = vertices[face]
+        a = np.array([[p[1, 0] - p[0, 0], p[2, 0] - p[0, 0]], [p[1, 1] - p[0, 1], p[2, 1] - p[0, 1]]])
+        ys, xs = np.mgrid[int(p[:, 1].min()):int(p[:, 1].max()) + 1, int(p[:, 0].min()):int(p[:, 0].max()) + 1]
+        l1, l2 = np.linalg.solve(a, np.stack([xs.ravel() - p[0, 0], ys.ravel() - p[0, 1]]))
+        inside = (l1 >= -1e-9) & (l2 >= -1e-9) & (l1 + l2 <= 1 + 1e-9)
+        z = p[0, 2] + l1 * (p[1, 2] - p[0, 2]) + l2 * (p[2, 2] - p[0, 2])
+        ys, xs = ys.ravel()[inside], xs.ravel()[inside]
+        error[ys, xs] = np.maximum(error[ys, xs], np.abs(z[inside] - base_thickness - depth_image[ys, xs]))
+        covered[ys, xs] = True
+    return error, covered
+
+
+class TestAdaptiveMesh(unittest.TestCase):
+
+    def setUp(self):
+        # Flat background on the left, a wave and a sharp ridge on the right
+        y, x = np.mgrid[0:37, 0:29]
+        self.depth_image = np.where(x > 14, np.sin(y / 5.0) * 3, 1.0) + (x == 20) * 2
+
+    def test_watertight(self):
+        for max_error in [0.0, 0.1, 2.0]:
+            _, faces = adaptive_mesh(self.depth_image, max_error, 1.0, 4)
+            report = check_manifold(faces)
+            self.assertTrue(report['watertight'], (max_error, report))
+            self.assertEqual(report['euler_characteristic'], 2)
+
+    def test_error_bound(self):
+        for max_error in [0.0, 0.1, 0.5]:
+            vertices, faces = adaptive_mesh(self.depth_image, max_error, 1.0, 4)
+            error, covered = surface_error(self.depth_image, vertices, faces, 4)
+            self.assertTrue(covered.all())
+            self.assertLessEqual(error.max(), max_error + 1e-9)
+
+    def test_triangle_reduction(self):
+        depth_image = np.zeros((200, 300))
+        depth_image[50:80, 100:120] = 5
+        _, faces = adaptive_mesh(depth_image, 0.05, 1.0, 4)
+        self.assertLess(len(faces), len(closed_faces(200, 300)) / 10)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,21 @@
 import unittest
 import os
 import json
-from app import app
+import gzip
+import io
+import zipfile
+import time
+import subprocess
+import sys
+import threading
+from werkzeug.datastructures import MultiDict
+import app as app_module
+from app import app, job_manager, parse_params, estimate_job_cost, process_image, init_job_worker, get_result_cache, finish_job
+from config import Config
+from jobs import JobCost, JobManager
+import image_processing
+import metrics
+from image_processing import LithophaneCreator, decode_cache, depth_cache, faces_cache
 import cv2
 import numpy as np
 
@@ -56,10 +70,356 @@ class TestApp(unittest.TestCase):
             }
             response = self.client.post('/', data=data, content_type='multipart/form-data')
         
-        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.status_code, 202)
         response_data = json.loads(response.data)
         self.assertTrue(response_data['success'])
-        self.assertIn('stl_url', response_data)
+        self.assertIn('job_id', response_data)
+
+        status = self.wait_for_job(response_data['status_url'])
+        self.assertEqual(status['status'], 'done')
+        self.assertTrue(status['success'])
+        self.assertIn('stl_url', status)
+        self.assertGreater(status['stats']['triangles'], 0)
+
+    def test_cached_result(self):
+        data = {'file': None, 'grayscale': 'true', 'topology': 'closed'}
+        with open(self.test_image_path, 'rb') as img:
+            data['file'] = (img, 'test_image.jpg')
+            response_data = json.loads(self.client.post('/', data=data, content_type='multipart/form-data').data)
+        status = self.wait_for_job(response_data['status_url'])
+        self.assertEqual(status['status'], 'done')
+
+        # The same image and settings are served from the cache, even under another name
+        with open(self.test_image_path, 'rb') as img:
+            data['file'] = (img, 'renamed.jpg')
+            response = self.client.post('/', data=data, content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 200)
+        response_data = json.loads(response.data)
+        self.assertTrue(response_data['cached'])
+        self.assertEqual(response_data['stl_url'], status['stl_url'])
+
+        stats = json.loads(self.client.get('/cache/stats').data)
+        self.assertGreaterEqual(stats['hits'], 1)
+
+    def test_preview(self):
+        with open(self.test_image_path, 'rb') as img:
+            response = self.client.post('/', data={'file': (img, 'test_image.jpg'), 'grayscale': 'true'}, content_type='multipart/form-data')
+        response_data = json.loads(response.data)
+        self.assertIn('preview_url', response_data)
+        preview = self.client.get(response_data['preview_url'])
+        self.assertEqual(preview.status_code, 200)
+
+        # The full resolution mesh replaces the preview, which stays cached for later requests
+        status = self.wait_for_job(response_data['status_url'])
+        self.assertNotEqual(status['stl_url'], response_data['preview_url'])
+        self.assertGreater(status['stats']['triangles'], int.from_bytes(preview.data[80:84], 'little'))
+
+    def test_preview_budget(self):
+        # Another upload is building its preview, which this one must not wait for
+        building = threading.Event()
+        done = threading.Event()
+        def build_preview():
+            with app_module.preview_lock:
+                building.set()
+                done.wait(5)
+        builder = threading.Thread(target=build_preview, daemon=True)
+        builder.start()
+        building.wait()
+        try:
+            image = np.random.default_rng().integers(0, 256, (100, 100), dtype=np.uint8)
+            start = time.monotonic()
+            response = self.client.post('/', data={'file': (io.BytesIO(cv2.imencode('.jpg', image)[1].tobytes()), 'busy.jpg'), 'grayscale': 'true'}, content_type='multipart/form-data')
+            elapsed = time.monotonic() - start
+        finally:
+            done.set()
+            builder.join()
+        response_data = json.loads(response.data)
+        self.assertEqual(response.status_code, 202)
+        self.assertLess(elapsed, 1)
+        self.assertNotIn('preview_url', response_data)
+        self.assertEqual(response_data['preview_skipped'], 'busy')
+        self.assertEqual(self.wait_for_job(response_data['status_url'])['status'], 'done')
+
+        # Large PNG images are decoded at full size, too slowly for a preview
+        image = np.zeros((3000, 3000), dtype=np.uint8)
+        response = self.client.post('/', data={'file': (io.BytesIO(cv2.imencode('.png', image)[1].tobytes()), 'large.png'), 'grayscale': 'true', 'resolution': '0.1'}, content_type='multipart/form-data')
+        response_data = json.loads(response.data)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response_data['preview_skipped'], 'too_large')
+        self.assertEqual(self.wait_for_job(response_data['status_url'])['status'], 'done')
+
+    def test_levels_of_detail(self):
+        with open(self.test_image_path, 'rb') as img:
+            response = self.client.post('/', data={'file': (img, 'test_image.jpg'), 'grayscale': 'true', 'topology': 'closed'}, content_type='multipart/form-data')
+        status = self.wait_for_job(json.loads(response.data)['status_url'])
+        self.assertIn('lod_url', status)
+        levels = json.loads(self.client.get(status['lod_url']).data)['levels']
+        self.assertGreaterEqual(len(levels), 1)
+        self.assertEqual([level['triangles'] for level in levels], sorted(level['triangles'] for level in levels))
+        for level in levels:
+            data = self.client.get(level['url']).data
+            self.assertEqual(len(data), 12 * (level['vertices'] + level['triangles']))
+            faces = np.frombuffer(data[12 * level['vertices']:], '<u4')
+            self.assertLess(faces.max(), level['vertices'])
+        self.assertEqual(self.client.get(status['lod_url'] + f"/{len(levels)}").status_code, 404)
+        self.assertEqual(self.client.get('/lod/unknown').status_code, 404)
+
+        # Cached results link their levels too
+        with open(self.test_image_path, 'rb') as img:
+            response = self.client.post('/', data={'file': (img, 'test_image.jpg'), 'grayscale': 'true', 'topology': 'closed'}, content_type='multipart/form-data')
+        self.assertEqual(json.loads(response.data)['lod_url'], status['lod_url'])
+
+    def test_admission_control(self):
+        # Meshing a 20000x20000 depth map is estimated beyond the whole budget
+        large_image = cv2.imencode('.jpg', np.zeros((2000, 2000), dtype=np.uint8))[1].tobytes()
+        data = {'file': (io.BytesIO(large_image), 'large.jpg'), 'grayscale': 'true', 'resolution': 10}
+        response = self.client.post('/', data=data, content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(json.loads(response.data)['success'])
+
+        # With the budget taken and no queue, new jobs are told when to retry
+        max_queued = job_manager.max_queued
+        job_manager.max_queued = 0
+        try:
+            blocker = job_manager.submit(time.sleep, 1, cost=JobCost(job_manager.memory_budget, 1))
+            stats = json.loads(self.client.get('/queue/stats').data)
+            self.assertEqual(stats['budget_usage'], 1.0)
+            with open(self.test_image_path, 'rb') as img:
+                response = self.client.post('/', data={'file': (img, 'test_image.jpg'), 'max_depth': 3}, content_type='multipart/form-data')
+        finally:
+            job_manager.max_queued = max_queued
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response.headers['Retry-After']), 1)
+        blocker.future.result(timeout=30)
+
+        stats = json.loads(self.client.get('/queue/stats').data)
+        self.assertGreaterEqual(stats['rejected'], 2)
+        self.assertEqual(stats['in_flight_bytes'], 0)
+        metrics_text = self.client.get('/metrics').data.decode()
+        self.assertIn('lithophane_jobs_rejected_total{reason="too_large"}', metrics_text)
+        self.assertIn('lithophane_jobs_rejected_total{reason="queue_full"}', metrics_text)
+
+    def test_admission_of_large_repairs(self):
+        # Repair is bounded by its limits, so a large image with the repair
+        # checkbox checked fits the default budget and falls back if needed
+        large_image = cv2.imencode('.jpg', np.zeros((3000, 4000), dtype=np.uint8))[1].tobytes()
+        params = parse_params(MultiDict({'repair_mesh': 'true', 'resolution': '0.5', 'topology': 'grid'}))
+        self.assertTrue(params['repair_mesh'])
+        cost = estimate_job_cost(large_image, params)
+        self.assertLessEqual(cost.memory_bytes, job_manager.memory_budget)
+        self.assertLessEqual(cost.seconds, Config.REPAIR_TIMEOUT + 60)
+
+    def test_depth_map_shared_by_workers(self):
+        # Each manager has its own worker process, as two workers of one pool
+        # would, so only the depth map file can carry over
+        for cache in (decode_cache, depth_cache, faces_cache):
+            cache.clear()
+        with open(self.test_image_path, 'rb') as img:
+            image_bytes = img.read()
+        params = parse_params(MultiDict({'grayscale': 'true', 'topology': 'closed'}))
+        results = []
+        for max_depth in (3, 5):
+            manager = JobManager(max_workers=1, initializer=init_job_worker)
+            try:
+                output_filepath = os.path.join(app.config['OUTPUT_FOLDER'], f'shared_depth_{max_depth}.stl')
+                job = manager.submit(process_image, image_bytes, output_filepath, **{**params, 'max_depth': max_depth})
+                results.append(job.future.result(timeout=60))
+            finally:
+                manager.shutdown()
+        computed = [[span['stage'] for span in result['stats']['spans']] for result in results]
+        self.assertIn('depth', computed[0])
+        self.assertNotIn('depth', computed[1])
+        self.assertIn('depth', results[1]['stats']['cached_stages'])
+        self.assertEqual(results[0]['depth'], results[1]['depth'])
+        self.assertTrue(os.path.exists(os.path.join(app.config['OUTPUT_FOLDER'], results[0]['depth'])))
+
+        # The worker caches stay allocated between jobs, so the jobs get the rest
+        if Config.ADMISSION_BUDGET_MB:
+            self.assertEqual(job_manager.memory_budget, max(1, Config.ADMISSION_BUDGET_MB - Config.STAGE_CACHE_MB) * 2**20)
+
+    def test_variants_cost(self):
+        image = cv2.imencode('.jpg', np.zeros((3000, 4000), dtype=np.uint8))[1].tobytes()
+        variants = [{'max_depth': 3}, {'max_depth': 5}]
+        params = parse_params(MultiDict({'resolution': '0.5', 'topology': 'grid'}))
+        params['output_format'] = 'stl'
+        memory_budget_mb = Config.MEMORY_BUDGET_MB
+        Config.MEMORY_BUDGET_MB = 64
+        try:
+            banded = estimate_job_cost(image, params)
+            cost = estimate_job_cost(image, params, variants)
+        finally:
+            Config.MEMORY_BUDGET_MB = memory_budget_mb
+        # Variants hold whole meshes even where conversions are banded
+        whole = LithophaneCreator(**params).estimate_cost(4000, 3000)
+        self.assertLess(banded.memory_bytes, cost.memory_bytes)
+        self.assertEqual(cost.memory_bytes, whole.memory_bytes)
+        self.assertAlmostEqual(cost.seconds, 2 * whole.seconds)
+
+        # Each variant is repaired on its own
+        params['repair_mesh'] = True
+        single = estimate_job_cost(image, params)
+        cost = estimate_job_cost(image, params, variants)
+        self.assertEqual(cost.memory_bytes, single.memory_bytes)
+        self.assertAlmostEqual(cost.seconds, 2 * single.seconds)
+
+    def test_variants(self):
+        data = {'file': None, 'grayscale': 'true', 'topology': 'closed',
+                'variants': json.dumps([{'max_depth': 3}, {'max_depth': 5, 'base_thickness': 2}])}
+        with open(self.test_image_path, 'rb') as img:
+            data['file'] = (img, 'test_image.jpg')
+            response = self.client.post('/variants', data=data, content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 202)
+        status = self.wait_for_job(json.loads(response.data)['status_url'])
+        self.assertEqual(status['status'], 'done')
+        self.assertTrue(status['stl_url'].endswith('.zip'))
+        self.assertEqual(len(status['stats']['variants']), 2)
+
+        events = self.client.get(json.loads(response.data)['events_url'])
+        self.assertEqual(events.mimetype, 'text/event-stream')
+        body = events.get_data(as_text=True)
+        self.assertIn('event: done', body)
+        done = json.loads(body.split('event: done\ndata: ')[1])
+        self.assertEqual(done['stl_url'], status['stl_url'])
+
+        download = self.client.get(status['stl_url'])
+        with zipfile.ZipFile(io.BytesIO(download.data)) as archive:
+            self.assertEqual(len(archive.namelist()), 2)
+            for name, variant in zip(archive.namelist(), status['stats']['variants']):
+                self.assertEqual(len(archive.read(name)), 84 + 50 * variant['triangles'])
+
+        for variants in ('not json', '[]', '[{"resolution": 2}]', '[{"max_depth": 50}]'):
+            with open(self.test_image_path, 'rb') as img:
+                response = self.client.post('/variants', data={'file': (img, 'test_image.jpg'), 'variants': variants}, content_type='multipart/form-data')
+            self.assertEqual(response.status_code, 400)
+
+    def test_failed_job(self):
+        # A file with an image extension that cannot be decoded
+        invalid_image_path = os.path.join(app.config['UPLOAD_FOLDER'], 'invalid.jpg')
+        with open(invalid_image_path, 'w') as f:
+            f.write('not an image')
+        with open(invalid_image_path, 'rb') as img:
+            response = self.client.post('/', data={'file': (img, 'invalid.jpg')}, content_type='multipart/form-data')
+
+        status = self.wait_for_job(json.loads(response.data)['status_url'])
+        self.assertEqual(status['status'], 'failed')
+        self.assertFalse(status['success'])
+        self.assertIn('unable to load', status['error'])
+        self.assertEqual(self.client.get(f"/jobs/{status['job_id']}/result").status_code, 500)
+
+    def test_failed_job_depth_file(self):
+        # Fails writing the mesh, after the depth map file was stored, in a
+        # worker forked while the writer is broken
+        def write_binary_stl(*args, **kwargs):
+            raise OSError("disk full")
+        with open(self.test_image_path, 'rb') as img:
+            image_bytes = img.read()
+        params = parse_params(MultiDict({'grayscale': 'true', 'smoothness': '7'}))
+        writer = image_processing.write_binary_stl
+        image_processing.write_binary_stl = write_binary_stl
+        manager = JobManager(max_workers=1)
+        try:
+            output_filepath = os.path.join(app.config['OUTPUT_FOLDER'], 'failed.stl')
+            job = manager.submit(process_image, image_bytes, output_filepath, **params)
+            with self.assertRaises(OSError) as failed:
+                job.future.result(timeout=60)
+        finally:
+            manager.shutdown()
+            image_processing.write_binary_stl = writer
+        depth_file = failed.exception.depth_file
+        self.assertTrue(depth_file.endswith('.depth.npy'))
+
+        cache = get_result_cache()
+        finish_job(cache, 'failed', job, params)
+        self.assertIn(depth_file, cache.outputs.names())
+        # The trace keeps the stages run before the failure
+        trace = next(trace for trace in metrics.recent_traces() if trace['job_id'] == job.id)
+        self.assertEqual(trace['status'], 'failed')
+        self.assertEqual([stage['stage'] for stage in trace['stages']][:2], ['decode', 'depth'])
+
+    def test_failed_lods(self):
+        # Levels of detail are optional, so their failure keeps the mesh
+        def create_lods(*args, **kwargs):
+            raise MemoryError
+        with open(self.test_image_path, 'rb') as img:
+            image_bytes = img.read()
+        params = parse_params(MultiDict({'grayscale': 'true', 'topology': 'closed'}))
+        output_filepath = os.path.join(app.config['OUTPUT_FOLDER'], 'no_lods.stl')
+        original = LithophaneCreator.create_lods
+        LithophaneCreator.create_lods = create_lods
+        try:
+            with self.assertLogs('app', 'ERROR'):
+                result = process_image(image_bytes, output_filepath, **params)
+        finally:
+            LithophaneCreator.create_lods = original
+        self.assertIsNone(result['lod'])
+        self.assertEqual(result['filename'], 'no_lods.stl')
+        self.assertTrue(os.path.exists(output_filepath))
+        self.assertFalse(os.path.exists(os.path.join(app.config['OUTPUT_FOLDER'], 'no_lods.lod')))
+
+    def test_logs_and_metrics(self):
+        # A new image, so no stage is served from the worker caches
+        cv2.imwrite(self.test_image_path, np.random.default_rng().integers(0, 256, (100, 100, 3), dtype=np.uint8))
+        data = {'file': None, 'grayscale': 'true', 'topology': 'closed', 'max_depth': 7}
+        with open(self.test_image_path, 'rb') as img:
+            data['file'] = (img, 'test_image.jpg')
+            response_data = json.loads(self.client.post('/', data=data, content_type='multipart/form-data').data)
+        status = self.wait_for_job(response_data['status_url'])
+
+        # The trace is recorded by a callback that may run just after the job is done
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            logs = json.loads(self.client.get('/logs').data)['logs']
+            if logs and logs[0]['job_id'] == status['job_id']:
+                break
+            time.sleep(0.05)
+        trace = logs[0]
+        self.assertEqual(trace['job_id'], status['job_id'])
+        self.assertEqual(trace['params']['max_depth'], 7)
+        self.assertEqual(trace['image_size'], [50, 50])
+        self.assertEqual(trace['triangles'], status['stats']['triangles'])
+        self.assertEqual([stage['stage'] for stage in trace['stages']], ['decode', 'depth', 'mesh', 'write', 'lod'])
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        text = response.data.decode()
+        self.assertIn('lithophane_stage_seconds_bucket{stage="mesh",le="+Inf"}', text)
+        self.assertIn('lithophane_jobs_total{status="done"}', text)
+        self.assertIn('lithophane_result_cache_bytes{folder="outputs"}', text)
+
+    def test_gzip_download(self):
+        data = {'file': None, 'grayscale': 'true', 'topology': 'closed', 'output_format': 'stl.gz'}
+        with open(self.test_image_path, 'rb') as img:
+            data['file'] = (img, 'test_image.jpg')
+            response_data = json.loads(self.client.post('/', data=data, content_type='multipart/form-data').data)
+        status = self.wait_for_job(response_data['status_url'])
+        self.assertTrue(status['stl_url'].endswith('.stl.gz'))
+
+        # Clients that accept gzip get the compressed file as is
+        response = self.client.get(status['stl_url'], headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('.stl', response.headers['Content-Disposition'])
+        self.assertNotIn('.gz', response.headers['Content-Disposition'])
+        stl_data = gzip.decompress(response.data)
+        self.assertEqual(len(stl_data), 84 + 50 * status['stats']['triangles'])
+
+        # Other clients get the STL decompressed
+        response = self.client.get(status['stl_url'])
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.data, stl_data)
+
+    def test_unknown_job(self):
+        response = self.client.get('/jobs/missing')
+        self.assertEqual(response.status_code, 404)
+
+    def wait_for_job(self, status_url, timeout=60):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            status = json.loads(self.client.get(status_url).data)
+            if status['status'] in ('done', 'failed'):
+                return status
+            time.sleep(0.1)
+        self.fail(f"Job did not finish: {status}")
 
     def test_download_file(self):
         # Create a test output file
@@ -71,5 +431,35 @@ class TestApp(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.headers['Content-Disposition'], 'attachment; filename=test_output_fixed.stl')
 
+    def test_startup(self):
+        # A fresh interpreter, since this one has loaded the engine already
+        result = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], capture_output=True, text=True, timeout=120)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        startup = json.loads(result.stdout)
+        self.assertEqual(startup['status'], 200)
+        # Neither importing the app nor serving the viewer loads the engine
+        self.assertEqual(startup['engine_after_import'], [])
+        self.assertEqual(startup['engine_after_request'], [])
+        self.assertEqual(startup['engine_after_warm_up'], ['cv2', 'image_processing', 'pymeshfix'])
+        self.assertLess(startup['import_seconds'], 5)
+        self.assertLess(startup['first_request_seconds'], 1)
+
+# Imports the app in a fresh interpreter, requests the viewer and warms up,
+# reporting the time taken and the engine modules loaded at each step
+STARTUP_SCRIPT = """
+import json, sys, time
+engine = lambda: sorted(name for name in ('cv2', 'image_processing', 'pymeshfix') if name in sys.modules)
+start = time.perf_counter()
+from app import app, warm_up
+startup = {'import_seconds': time.perf_counter() - start, 'engine_after_import': engine()}
+start = time.perf_counter()
+startup['status'] = app.test_client().get('/viewer').status_code
+startup['first_request_seconds'] = time.perf_counter() - start
+startup['engine_after_request'] = engine()
+startup['warm_up_seconds'] = warm_up()
+startup['engine_after_warm_up'] = engine()
+print(json.dumps(startup))
+"""
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import contextlib
+import io
+import os
+import shutil
+import stat
+import cv2
+import numpy as np
+from stl import mesh
+from cli import main, find_images, current_umask
+
+class TestCli(unittest.TestCase):
+
+    def setUp(self):
+        self.input_folder = 'test_cli_inputs'
+        self.output_folder = 'test_cli_outputs'
+        os.makedirs(os.path.join(self.input_folder, 'nested'))
+        image = np.ones((40, 60, 3), dtype=np.uint8) * 255
+        image = cv2.putText(image, 'T', (5, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2, cv2.LINE_AA)
+        for name in ('a.png', 'b.jpg', os.path.join('nested', 'c.png')):
+            cv2.imwrite(os.path.join(self.input_folder, name), image)
+        with open(os.path.join(self.input_folder, 'notes.txt'), 'w') as f:
+            f.write('not an image')
+
+    def tearDown(self):
+        for folder in (self.input_folder, self.output_folder):
+            shutil.rmtree(folder, ignore_errors=True)
+
+    def run_cli(self, *args):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            code = main([*args, '-o', self.output_folder, '--workers', '2', '--topology', 'closed'])
+        return code, output.getvalue()
+
+    def test_find_images(self):
+        found = list(find_images([self.input_folder, os.path.join(self.input_folder, '*.png')]))
+        self.assertEqual([relative for _, relative in found], ['a.png', 'b.jpg'])
+        found = list(find_images([self.input_folder], recursive=True))
+        self.assertEqual(sorted(relative for _, relative in found), ['a.png', 'b.jpg', os.path.join('nested', 'c.png')])
+
+    def test_convert_and_skip(self):
+        code, output = self.run_cli(self.input_folder, '--recursive')
+        self.assertEqual(code, 0)
+        self.assertIn('Converted 3, skipped 0, failed 0 of 3 images', output)
+        self.assertIn('triangles/s', output)
+        for name in ('a.stl', 'b.stl', os.path.join('nested', 'c.stl')):
+            stl_mesh = mesh.Mesh.from_file(os.path.join(self.output_folder, name))
+            self.assertGreater(len(stl_mesh.vectors), 0)
+        self.assertEqual(sorted(os.listdir(self.output_folder)), ['a.stl', 'b.stl', 'nested'])
+        # Outputs get the mode of a newly created file, not the private mode of mkstemp
+        mode = os.stat(os.path.join(self.output_folder, 'a.stl')).st_mode
+        self.assertEqual(stat.S_IMODE(mode), 0o666 & ~current_umask())
+
+        # Outputs newer than their images are skipped unless forced
+        code, output = self.run_cli(self.input_folder, '--recursive')
+        self.assertIn('Converted 0, skipped 3, failed 0 of 3 images', output)
+        code, output = self.run_cli(os.path.join(self.input_folder, 'a.png'), '--force')
+        self.assertIn('Converted 1, skipped 0, failed 0 of 1 images', output)
+
+    def test_failed_image(self):
+        with open(os.path.join(self.input_folder, 'broken.png'), 'w') as f:
+            f.write('not an image')
+        code, output = self.run_cli(self.input_folder)
+        self.assertEqual(code, 1)
+        self.assertIn('broken.png: failed', output)
+        self.assertIn('Converted 2, skipped 0, failed 1 of 3 images', output)
+        self.assertFalse(os.path.exists(os.path.join(self.output_folder, 'broken.stl')))
+
+    def test_output_collision(self):
+        other_folder = os.path.join(self.input_folder, 'nested', 'other')
+        os.makedirs(other_folder)
+        shutil.copy(os.path.join(self.input_folder, 'a.png'), other_folder)
+        errors = io.StringIO()
+        with contextlib.redirect_stderr(errors):
+            code, output = self.run_cli(self.input_folder, other_folder)
+        self.assertEqual(code, 2)
+        self.assertIn(f"would all be written to {os.path.join(self.output_folder, 'a.stl')}", errors.getvalue())
+        self.assertFalse(os.path.exists(self.output_folder))
+
+if __name__ == '__main__':
+    unittest.main()
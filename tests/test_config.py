@@ -18,6 +18,23 @@ class TestConfig(unittest.TestCase):
         self.assertEqual(Config.GRAY_SCALE, os.getenv('GRAY_SCALE', 'True').lower() == 'true')
         self.assertEqual(Config.TOP_SURFACE_SMOOTHNESS, int(os.getenv('TOP_SURFACE_SMOOTHNESS', 9)))
         self.assertEqual(Config.INVERT, os.getenv('INVERT', 'False').lower() == 'true')
+        self.assertEqual(Config.TOPOLOGY, os.getenv('TOPOLOGY', 'grid'))
+        self.assertEqual(Config.MAX_ERROR, float(os.getenv('MAX_ERROR', 0.0)))
+        self.assertEqual(Config.WORKERS, int(os.getenv('WORKERS', os.cpu_count() or 1)))
+        self.assertEqual(Config.OUTPUT_CACHE_MB, int(os.getenv('OUTPUT_CACHE_MB', 1024)))
+        self.assertEqual(Config.UPLOAD_CACHE_MB, int(os.getenv('UPLOAD_CACHE_MB', 256)))
+        self.assertEqual(Config.STAGE_CACHE_MB, int(os.getenv('STAGE_CACHE_MB', 512)))
+        self.assertEqual(Config.MEMORY_BUDGET_MB, int(os.getenv('MEMORY_BUDGET_MB', 0)))
+        self.assertEqual(Config.MESH_WORKERS, int(os.getenv('MESH_WORKERS', 1)))
+        self.assertEqual(Config.PREVIEW_SIZE, int(os.getenv('PREVIEW_SIZE', 128)))
+        self.assertEqual(Config.PREVIEW_BUDGET_MS, int(os.getenv('PREVIEW_BUDGET_MS', 300)))
+        self.assertEqual(Config.OUTPUT_FORMAT, os.getenv('OUTPUT_FORMAT', 'stl'))
+        self.assertEqual(Config.ADMISSION_BUDGET_MB, int(os.getenv('ADMISSION_BUDGET_MB', 4608)))
+        self.assertEqual(Config.ADMISSION_QUEUE, int(os.getenv('ADMISSION_QUEUE', 32)))
+        self.assertEqual(Config.REPAIR_TIMEOUT, float(os.getenv('REPAIR_TIMEOUT', 300)))
+        self.assertEqual(Config.REPAIR_MEMORY_MB, int(os.getenv('REPAIR_MEMORY_MB', 2048)))
+        self.assertEqual(Config.WARM_UP, os.getenv('WARM_UP', 'True').lower() == 'true')
+        self.assertEqual(Config.LOD_SIZES, tuple(int(size) for size in os.getenv('LOD_SIZES', '64,256,1024').split(',') if size.strip()))
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,9 +1,15 @@
 import unittest
 import os
-from image_processing import LithophaneCreator
+from image_processing import LithophaneCreator, decode_cache, depth_cache, faces_cache, read_image_header
 import numpy as np
 from stl import mesh
+from mesh_builder import check_manifold, closed_triangle_count
 import cv2
+import tracemalloc
+import tempfile
+import gzip
+import zipfile
+from mesh_formats import read_lod_table
 
 class TestLithophaneCreator(unittest.TestCase):
 
@@ -43,6 +49,331 @@ class TestLithophaneCreator(unittest.TestCase):
         # Load the STL file and check if it contains vertices
         stl_mesh = mesh.Mesh.from_file(fixed_output_path)
         self.assertGreater(len(stl_mesh.points), 0)
+        self.assertEqual(self.processor.stats['repair']['outcome'], 'repaired')
+
+    def test_repair_fallback(self):
+        self.processor.repair_timeout = 0.001
+        output_path = self.processor.create_lithophane(self.test_image_path, self.output_stl_path)
+        # The unrepaired mesh is kept, and flagged
+        self.assertEqual(output_path, self.output_stl_path)
+        self.assertFalse(os.path.exists(self.fixed_output_stl_path))
+        self.assertEqual(self.processor.stats['repair']['outcome'], 'timeout')
+        self.assertIn('did not finish', self.processor.stats['repair']['error'])
+        self.assertEqual(len(mesh.Mesh.from_file(output_path)), self.processor.stats['triangles'])
+
+    def test_create_closed_lithophane(self):
+        processor = LithophaneCreator(
+            max_depth=10,
+            base_thickness=4,
+            output_width=200,
+            invert=True,
+            resolution=0.5,
+            smoothness=1,
+            grayscale=True,
+            top_surface_smoothness=9,
+            repair_mesh=False,
+            topology='closed'
+        )
+        output_path = processor.create_lithophane(self.test_image_path, self.output_stl_path)
+        self.assertEqual(output_path, self.output_stl_path)
+
+        # Rebuild the index array from the STL and check it is a closed manifold
+        stl_mesh = mesh.Mesh.from_file(output_path)
+        _, faces = np.unique(stl_mesh.vectors.reshape(-1, 3), axis=0, return_inverse=True)
+        self.assertTrue(check_manifold(faces.reshape(-1, 3))['watertight'])
+
+    def test_create_adaptive_lithophane(self):
+        processor = LithophaneCreator(
+            max_depth=10,
+            base_thickness=4,
+            output_width=200,
+            invert=True,
+            resolution=0.5,
+            smoothness=1,
+            grayscale=True,
+            top_surface_smoothness=9,
+            repair_mesh=False,
+            max_error=0.1
+        )
+        faces_cache.clear()
+        output_path = processor.create_lithophane(self.test_image_path, self.output_stl_path)
+        stl_mesh = mesh.Mesh.from_file(output_path)
+        self.assertEqual(len(stl_mesh.vectors), processor.stats['triangles'])
+        width, height = processor.stats['image_size']
+        self.assertEqual(processor.stats['uniform_triangles'], closed_triangle_count(height, width))
+        self.assertLess(processor.stats['triangles'], processor.stats['uniform_triangles'])
+        self.assertGreater(processor.stats['triangle_reduction'], 0)
+        # The uniform mesh is only counted, never built
+        self.assertEqual(faces_cache.total_bytes, 0)
+
+    def test_stage_cache_reuse(self):
+        for cache in (decode_cache, depth_cache, faces_cache):
+            cache.clear()
+        self.processor.repair_mesh = False
+        self.processor.create_lithophane(self.test_image_path, self.output_stl_path)
+        self.assertEqual(self.processor.stats['cached_stages'], [])
+        first = mesh.Mesh.from_file(self.output_stl_path)
+
+        # Only z values change, so the depth map and faces are reused
+        self.processor.max_depth = 5
+        self.processor.base_thickness = 2
+        self.processor.create_lithophane(self.test_image_path, self.output_stl_path)
+        self.assertEqual(sorted(self.processor.stats['cached_stages']), ['depth', 'faces'])
+        second = mesh.Mesh.from_file(self.output_stl_path)
+        np.testing.assert_allclose(second.vectors[:, :, :2], first.vectors[:, :, :2])
+        np.testing.assert_allclose(
+            second.vectors[:, :, 2],
+            np.where(first.vectors[:, :, 2] > 0, (first.vectors[:, :, 2] - 4) / 2 + 2, 0),
+            atol=1e-5
+        )
+
+        # A new blur setting recomputes the depth map from the cached decode
+        self.processor.top_surface_smoothness = 5
+        self.processor.create_lithophane(self.test_image_path, self.output_stl_path)
+        self.assertEqual(sorted(self.processor.stats['cached_stages']), ['decode', 'faces'])
+
+    def test_depth_folder(self):
+        self.processor.repair_mesh = False
+        for cache in (decode_cache, depth_cache, faces_cache):
+            cache.clear()
+        with tempfile.TemporaryDirectory() as folder:
+            self.processor.depth_folder = folder
+            depth = self.processor.unit_depth_map(self.test_image_path)
+            self.assertEqual(os.listdir(folder), [self.processor.depth_file])
+
+            # Another process has none of the stage caches but shares the folder
+            for cache in (decode_cache, depth_cache, faces_cache):
+                cache.clear()
+            self.processor.stats = {}
+            # Stored as float32
+            loaded = self.processor.unit_depth_map(self.test_image_path)
+            self.assertEqual(loaded.dtype, np.float64)
+            np.testing.assert_allclose(loaded, depth, rtol=1e-6)
+            self.assertEqual(np.load(os.path.join(folder, self.processor.depth_file)).dtype, np.float32)
+            self.assertEqual(self.processor.stats['cached_stages'], ['depth'])
+
+            # An evicted file is computed again
+            for cache in (decode_cache, depth_cache, faces_cache):
+                cache.clear()
+            os.remove(os.path.join(folder, self.processor.depth_file))
+            self.processor.stats = {}
+            self.processor.unit_depth_map(self.test_image_path)
+            self.assertEqual(self.processor.stats['cached_stages'], [])
+            self.assertEqual(os.listdir(folder), [self.processor.depth_file])
+
+    def test_create_preview(self):
+        self.processor.resolution = 1.0
+        output_path = self.processor.create_preview(self.test_image_path, self.output_stl_path, 32)
+        preview = mesh.Mesh.from_file(output_path)
+        self.assertEqual(len(preview.vectors), self.processor.stats['triangles'])
+        self.assertLess(self.processor.stats['triangles'], 2 * 32 * 32 + 12 * 32)
+        _, faces = np.unique(preview.vectors.reshape(-1, 3), axis=0, return_inverse=True)
+        self.assertTrue(check_manifold(faces.reshape(-1, 3))['watertight'])
+
+        # Same outer dimensions as the full lithophane
+        self.processor.repair_mesh = False
+        self.processor.create_lithophane(self.test_image_path, self.output_stl_path)
+        full = mesh.Mesh.from_file(self.output_stl_path)
+        np.testing.assert_allclose(preview.max_, full.max_, atol=0.5)
+        np.testing.assert_allclose(preview.min_, full.min_, atol=1e-5)
+
+    def test_create_lods(self):
+        self.processor.repair_mesh = False
+        self.processor.create_lithophane(self.test_image_path, self.output_stl_path)
+        full = mesh.Mesh.from_file(self.output_stl_path)
+        lod_path = self.processor.create_lods(self.test_image_path, 'test_output.lod', (10, 500, 25))
+        try:
+            table = read_lod_table(lod_path)
+            # Coarsest first, capped at the 50x50 depth map
+            self.assertEqual(self.processor.stats['lod_triangles'], table['faces'].tolist())
+            self.assertEqual(table['faces'].tolist(), sorted(table['faces'].tolist()))
+            self.assertEqual(len(table), 3)
+            self.assertEqual(int(table[-1]['faces']), closed_triangle_count(50, 50))
+            with open(lod_path, 'rb') as f:
+                data = f.read()
+            for entry in table:
+                offset = int(entry['offset'])
+                vertices = np.frombuffer(data[offset:offset + 12 * int(entry['vertices'])], '<f4').reshape(-1, 3)
+                # Same outer dimensions as the full lithophane
+                np.testing.assert_allclose(vertices.max(axis=0), full.max_, atol=0.5)
+                np.testing.assert_allclose(vertices.min(axis=0), full.min_, atol=1e-5)
+
+            # The memory budget builds the levels from a preview depth map
+            processor = LithophaneCreator(10, 4, 200, True, 0.5, 1, True, 9, repair_mesh=False, memory_budget_mb=1)
+            processor.create_lods(self.test_image_path, lod_path, (10, 25))
+            self.assertEqual(read_lod_table(lod_path)['faces'].tolist(), table['faces'].tolist()[:2])
+        finally:
+            os.remove(lod_path)
+
+    def test_estimate_cost(self):
+        cost = self.processor.estimate_cost(1000, 800)
+        # Repair dominates; resolution 0.5 meshes a quarter of the pixels
+        self.assertGreater(cost.seconds, 100)
+        self.processor.repair_mesh = False
+        whole = self.processor.estimate_cost(1000, 800)
+        self.assertLess(whole.memory_bytes, cost.memory_bytes / 10)
+        self.assertAlmostEqual(self.processor.estimate_cost(2000, 1600).memory_bytes / whole.memory_bytes, 4, delta=0.1)
+        self.processor.topology = 'closed'
+        self.assertLess(self.processor.estimate_cost(1000, 800).memory_bytes, whole.memory_bytes)
+        self.processor.memory_budget_mb = 16
+        self.assertLess(self.processor.estimate_cost(8000, 6000).memory_bytes, 64 * 2**20)
+
+    def test_estimate_cost_repair_limits(self):
+        self.processor.repair_memory_mb = 1024
+        self.processor.repair_timeout = 60
+        self.processor.repair_mesh = False
+        unrepaired = self.processor.estimate_cost(4000, 3000)
+        self.processor.repair_mesh = True
+        # Repair runs until its limits, then falls back
+        cost = self.processor.estimate_cost(4000, 3000)
+        self.assertEqual(cost.memory_bytes, unrepaired.memory_bytes + 1024 * 2**20)
+        self.assertAlmostEqual(cost.seconds, unrepaired.seconds + 60)
+        # Small repairs stay below the limits
+        self.assertLess(self.processor.estimate_cost(100, 100).seconds, 60)
+
+    def test_create_variants(self):
+        for cache in (decode_cache, depth_cache, faces_cache):
+            cache.clear()
+        self.processor.repair_mesh = False
+        variants = [{'max_depth': 3}, {'max_depth': 6, 'base_thickness': 2}, {'output_width': 400}]
+        zip_path = self.processor.create_variants(self.test_image_path, 'test_variants.zip', variants)
+        try:
+            # The depth map is computed once and the faces reused by every variant
+            self.assertEqual([span['stage'] for span in self.processor.stats['spans']].count('depth'), 1)
+            self.assertIn('faces', self.processor.stats['cached_stages'])
+            with zipfile.ZipFile(zip_path) as archive:
+                names = archive.namelist()
+                self.assertEqual(names, [variant['name'] for variant in self.processor.stats['variants']])
+                for name, variant in zip(names, variants):
+                    archive.extract(name)
+                    try:
+                        expected = LithophaneCreator(10, 4, 200, True, 0.5, 1, True, 9, repair_mesh=False)
+                        vars(expected).update(variant)
+                        expected.create_lithophane(self.test_image_path, self.output_stl_path)
+                        np.testing.assert_array_equal(
+                            mesh.Mesh.from_file(name).vectors, mesh.Mesh.from_file(self.output_stl_path).vectors
+                        )
+                    finally:
+                        os.remove(name)
+        finally:
+            os.remove(zip_path)
+
+        with self.assertRaises(ValueError):
+            self.processor.create_variants(self.test_image_path, 'test_variants.zip', [{'resolution': 1.0}])
+
+    def test_output_formats(self):
+        self.processor.repair_mesh = False
+        self.processor.topology = 'closed'
+        self.processor.create_lithophane(self.test_image_path, self.output_stl_path)
+        triangles = self.processor.stats['triangles']
+        for output_format in ('stl.gz', '3mf', 'ply'):
+            self.processor.output_format = output_format
+            output_path = self.processor.create_lithophane(self.test_image_path, self.output_stl_path)
+            self.assertEqual(output_path, self.output_stl_path)
+            self.assertEqual(self.processor.stats['triangles'], triangles)
+            self.assertLess(os.path.getsize(output_path), 84 + 50 * triangles)
+
+        # Tiled generation streams gzip-compressed STL
+        processor = LithophaneCreator(10, 4, 200, True, 0.5, 1, True, 9, repair_mesh=False, memory_budget_mb=1, output_format='stl.gz')
+        processor.create_lithophane(self.test_image_path, self.output_stl_path)
+        with gzip.open(self.output_stl_path, 'rb') as f:
+            self.assertEqual(len(f.read()), 84 + 50 * processor.stats['triangles'])
+        with self.assertRaises(ValueError):
+            LithophaneCreator(10, 4, 200, True, 0.5, 1, True, 9, repair_mesh=False, memory_budget_mb=1, output_format='3mf')
+
+    def test_create_lithophane_from_bytes(self):
+        self.processor.repair_mesh = False
+        self.processor.create_lithophane(self.test_image_path, self.output_stl_path)
+        from_file = mesh.Mesh.from_file(self.output_stl_path)
+        with open(self.test_image_path, 'rb') as f:
+            image_bytes = f.read()
+        for image in (image_bytes, bytearray(image_bytes), memoryview(image_bytes)):
+            self.processor.create_lithophane(image, self.output_stl_path)
+            np.testing.assert_array_equal(mesh.Mesh.from_file(self.output_stl_path).vectors, from_file.vectors)
+
+        # Cached by content
+        self.processor.create_lithophane(bytes(image_bytes), self.output_stl_path)
+        self.assertIn('depth', self.processor.stats['cached_stages'])
+        with self.assertRaises(ValueError):
+            self.processor.create_lithophane(b'not an image', self.output_stl_path)
+
+    def test_reduced_jpeg_decode(self):
+        height, width = np.mgrid[0:300, 0:400]
+        image = (128 + 100 * np.sin(width / 30) * np.cos(height / 20)).astype(np.uint8)
+        image_bytes = cv2.imencode('.jpg', image)[1].tobytes()
+        self.assertEqual(read_image_header(image_bytes), ('jpeg', 400, 300))
+        self.assertEqual(read_image_header(cv2.imencode('.png', image)[1]), ('png', 400, 300))
+        self.assertIsNone(read_image_header(b'not an image'))
+
+        full = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_GRAYSCALE)
+        for resolution in (0.5, 0.25, 0.3, 0.1):
+            self.processor.resolution = resolution
+            source, scale = self.processor._read_source(image_bytes, resolution)
+            self.assertLess(source.shape[0], 300)
+            self.assertGreaterEqual(scale * source.shape[0], 300 * resolution - 1)
+
+            # Close to decoding the full image and resizing it
+            decoded = self.processor._decode(image_bytes)
+            expected = cv2.resize(full, (0, 0), fx=resolution, fy=resolution, interpolation=cv2.INTER_AREA)
+            self.assertEqual(decoded.shape, expected.shape)
+            difference = np.abs(decoded.astype(int) - expected)
+            self.assertLessEqual(difference.max(), 5)
+            self.assertLess(difference.mean(), 2)
+
+    def _sorted_triangles(self, path):
+        vectors = mesh.Mesh.from_file(path).vectors.reshape(-1, 9)
+        return vectors[np.lexsort(vectors.T[::-1])]
+
+    def test_tiled_lithophane_matches_full(self):
+        for topology in ('grid', 'closed'):
+            for resolution in (0.5, 0.7, 1.0):
+                options = dict(
+                    max_depth=10, base_thickness=4, output_width=200, invert=True, resolution=resolution,
+                    smoothness=3, grayscale=True, top_surface_smoothness=9, repair_mesh=False, topology=topology,
+                )
+                LithophaneCreator(**options).create_lithophane(self.test_image_path, self.output_stl_path)
+                expected = self._sorted_triangles(self.output_stl_path)
+
+                # A tiny budget forces many bands of a few rows each
+                processor = LithophaneCreator(memory_budget_mb=0.05, **options)
+                processor.create_lithophane(self.test_image_path, self.output_stl_path)
+                self.assertGreater(processor.stats['bands'], 5)
+                np.testing.assert_allclose(self._sorted_triangles(self.output_stl_path), expected, atol=1e-5)
+
+    def test_parallel_lithophane_matches_full(self):
+        for topology in ('grid', 'closed'):
+            options = dict(
+                max_depth=10, base_thickness=4, output_width=200, invert=True, resolution=0.5,
+                smoothness=3, grayscale=True, top_surface_smoothness=9, repair_mesh=False, topology=topology,
+            )
+            LithophaneCreator(**options).create_lithophane(self.test_image_path, self.output_stl_path)
+            expected = self._sorted_triangles(self.output_stl_path)
+
+            processor = LithophaneCreator(workers=2, **options)
+            processor.create_lithophane(self.test_image_path, self.output_stl_path)
+            self.assertEqual(processor.stats['bands'], 8)
+            np.testing.assert_allclose(self._sorted_triangles(self.output_stl_path), expected, atol=1e-5)
+
+    def test_tiled_lithophane_memory(self):
+        cv2.imwrite(self.test_image_path, cv2.resize(self.test_image, (1500, 1500)))
+        options = dict(
+            max_depth=10, base_thickness=4, output_width=200, invert=True, resolution=1.0, smoothness=1,
+            grayscale=True, top_surface_smoothness=9, repair_mesh=False, topology='closed',
+        )
+        peaks = []
+        for memory_budget_mb in (None, 8):
+            processor = LithophaneCreator(memory_budget_mb=memory_budget_mb, **options)
+            for cache in (decode_cache, depth_cache, faces_cache):
+                cache.clear()
+            tracemalloc.start()
+            processor.create_lithophane(self.test_image_path, self.output_stl_path)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        self.assertLess(peaks[1], peaks[0] / 5)
+
+    def test_tiled_lithophane_rejects_repair(self):
+        with self.assertRaises(ValueError):
+            LithophaneCreator(10, 4, 200, True, 0.5, 1, True, 9, repair_mesh=True, memory_budget_mb=64)
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+import threading
+import time
+from concurrent.futures import Future
+from jobs import JobManager, JobCost, JobRejected, QUEUED, DONE, FAILED, report_progress
+
+def report_stages(delay):
+    report_progress('mesh', 0.5)
+    time.sleep(delay)
+    report_progress('write', 1.0)
+    return 'done'
+
+_initialized = False
+
+def initialize():
+    global _initialized
+    _initialized = True
+
+def initialized():
+    return _initialized
+
+class TestJobManager(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = JobManager(max_workers=2, memory_budget=100, max_queued=1)
+
+    def tearDown(self):
+        self.manager.shutdown()
+
+    def test_admission(self):
+        first = self.manager.submit(time.sleep, 0.5, cost=JobCost(60, 0.5))
+        # Over budget with the first job, so it waits even though a worker is free
+        second = self.manager.submit(time.sleep, 0, cost=JobCost(60, 0.1))
+        self.assertEqual(second.status, QUEUED)
+        stats = self.manager.stats()
+        self.assertEqual((stats['in_flight'], stats['queued'], stats['in_flight_bytes']), (1, 1, 60))
+
+        # The queue is full
+        with self.assertRaises(JobRejected) as rejected:
+            self.manager.submit(time.sleep, 0, cost=JobCost(10, 0.1))
+        self.assertGreaterEqual(rejected.exception.retry_after, 1)
+
+        # Larger than the whole budget
+        with self.assertRaises(JobRejected) as rejected:
+            self.manager.submit(time.sleep, 0, cost=JobCost(101, 0.1))
+        self.assertIsNone(rejected.exception.retry_after)
+        self.assertEqual(self.manager.stats()['rejected'], 2)
+
+        # The waiting job starts when the first one frees its budget
+        second.future.result(timeout=30)
+        self.assertGreaterEqual(second.started_at, first.submitted_at + 0.4)
+        self.assertEqual(first.status, DONE)
+        self.assertEqual(self.manager.stats()['in_flight_bytes'], 0)
+
+    def test_progress(self):
+        job = self.manager.submit(report_stages, 0.5)
+        version, progress = job.wait_for_progress(0, timeout=30)
+        self.assertGreater(version, 0)
+        self.assertEqual(progress, {'stage': 'mesh', 'fraction': 0.5})
+        self.assertEqual(job.to_dict()['progress'], progress)
+        self.assertEqual(job.future.result(timeout=30), 'done')
+        # Waiting on a finished job returns at once
+        start = time.monotonic()
+        job.wait_for_progress(version, timeout=30)
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_initializer(self):
+        manager = JobManager(max_workers=1, initializer=initialize)
+        try:
+            self.assertTrue(manager.submit(initialized).future.result(timeout=30))
+        finally:
+            manager.shutdown()
+        self.assertFalse(_initialized)
+
+    def test_job_finished_before_watched(self):
+        # An executor whose jobs have already failed when submit returns, as
+        # a job failing fast may have
+        class FailedExecutor:
+            def submit(self, fn, *args):
+                future = Future()
+                future.set_exception(ValueError("unable to load image"))
+                return future
+
+        self.manager._get_executor = FailedExecutor
+        jobs = []
+        # Two jobs that fit and one that waits for the budget, started by
+        # the second one finishing
+        submitting = threading.Thread(daemon=True, target=lambda: jobs.extend(
+            self.manager.submit(time.sleep, 0, cost=JobCost(60, 0.1)) for _ in range(3)
+        ))
+        submitting.start()
+        submitting.join(timeout=10)
+        if submitting.is_alive():
+            # tearDown could not shut the deadlocked manager down
+            self.manager = JobManager(max_workers=1)
+            self.fail("submit deadlocked")
+        self.assertEqual([job.status for job in jobs], [FAILED] * 3)
+        self.assertEqual(self.manager.stats()['in_flight_bytes'], 0)
+
+    def test_no_budget(self):
+        manager = JobManager(max_workers=1)
+        try:
+            jobs = [manager.submit(time.sleep, 0, cost=JobCost(10**12, 1)) for _ in range(3)]
+            for job in jobs:
+                job.future.result(timeout=30)
+            self.assertEqual(manager.stats()['rejected'], 0)
+        finally:
+            manager.shutdown()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import numpy as np
+from mesh_builder import (
+    grid_vertices, grid_faces, faces_to_triangles, closed_vertices, closed_faces,
+    check_manifold, signed_volume,
+)
+
+
+def reference_mesh(depth_image, x_scale, base_thickness):
+    """Loop-based mesh construction the vectorized builder must match."""
+    height, width = depth_image.shape
+    vertices = []
+    faces = []
+    for y in range(height):
+        for x in range(width):
+            vertices.append([x * x_scale, y * x_scale, depth_image[y, x] + base_thickness])
+    for y in range(height):
+        for x in range(width):
+            vertices.append([x * x_scale, y * x_scale, 0])
+    for y in range(height - 1):
+        for x in range(width - 1):
+            v1 = y * width + x
+            faces.append([v1, v1 + 1, v1 + width])
+            faces.append([v1 + 1, v1 + width + 1, v1 + width])
+    offset = height * width
+    for y in range(height - 1):
+        for x in range(width - 1):
+            v1 = y * width + x + offset
+            faces.append([v1, v1 + width, v1 + 1])
+            faces.append([v1 + 1, v1 + width, v1 + width + 1])
+    for y in range(height - 1):
+        for x in range(width - 1):
+            v1 = y * width + x
+            faces.append([v1, v1 + 1, v1 + offset])
+            faces.append([v1 + 1, v1 + offset + 1, v1 + offset])
+            v3 = v1 + width
+            faces.append([v3, v3 + 1, v3 + offset])
+            faces.append([v3 + 1, v3 + offset + 1, v3 + offset])
+    return np.array(vertices), np.array(faces)
+
+
+class TestMeshBuilder(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.depth_image = rng.random((7, 11)) * 10
+
+    def test_matches_reference(self):
+        vertices, faces = grid_vertices(self.depth_image, 0.5, 4), grid_faces(7, 11)
+        ref_vertices, ref_faces = reference_mesh(self.depth_image, 0.5, 4)
+        np.testing.assert_allclose(vertices, ref_vertices)
+        np.testing.assert_array_equal(faces, ref_faces)
+
+    def test_faces_to_triangles(self):
+        vertices, faces = grid_vertices(self.depth_image, 1.0, 0), grid_faces(7, 11)
+        triangles = faces_to_triangles(vertices, faces)
+        self.assertEqual(triangles.shape, (faces.shape[0], 3, 3))
+        np.testing.assert_array_equal(triangles[5, 2], vertices[faces[5, 2]])
+
+    def test_closed_topology_is_watertight(self):
+        for height, width in [(2, 2), (7, 11), (30, 3)]:
+            report = check_manifold(closed_faces(height, width))
+            self.assertTrue(report['watertight'], (height, width, report))
+            self.assertEqual(report['euler_characteristic'], 2)
+
+    def test_closed_topology_volume(self):
+        # A flat depth map gives a box of width * height * base_thickness
+        vertices = closed_vertices(np.zeros((7, 11)), 0.5, 4)
+        self.assertAlmostEqual(signed_volume(vertices, closed_faces(7, 11)), 5 * 3 * 4)
+
+        vertices = closed_vertices(self.depth_image, 0.5, 4)
+        self.assertGreater(signed_volume(vertices, closed_faces(7, 11)), 5 * 3 * 4)
+
+    def test_closed_topology_triangle_count(self):
+        self.assertLess(len(closed_faces(200, 200)) * 3, len(grid_faces(200, 200)))
+
+    def test_grid_topology_is_not_watertight(self):
+        self.assertFalse(check_manifold(grid_faces(7, 11))['watertight'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+import gzip
+import io
+import os
+import zipfile
+import xml.etree.ElementTree as ET
+import numpy as np
+from stl import mesh
+from mesh_builder import closed_vertices, closed_faces, faces_to_triangles
+from mesh_formats import write_mesh, write_lod, read_lod_table, format_of, PLY_FACE_DTYPE
+
+NS_3MF = {'m': 'http://schemas.microsoft.com/3dmanufacturing/core/2015/02'}
+
+class TestMeshFormats(unittest.TestCase):
+
+    def setUp(self):
+        depth_image = np.random.default_rng(3).random((30, 40)) * 10
+        self.vertices = closed_vertices(depth_image, 0.5, 4)
+        self.faces = closed_faces(30, 40)
+        self.output_path = 'test_formats_output'
+
+    def tearDown(self):
+        if os.path.exists(self.output_path):
+            os.remove(self.output_path)
+
+    def test_format_of(self):
+        self.assertEqual(format_of('abc.stl'), 'stl')
+        self.assertEqual(format_of('abc.STL.GZ'), 'stl.gz')
+        self.assertEqual(format_of('abc_fixed.3mf'), '3mf')
+        self.assertIsNone(format_of('abc.png'))
+
+    def test_stl_gz(self):
+        write_mesh(self.output_path, self.vertices, self.faces, 'stl.gz')
+        with gzip.open(self.output_path, 'rb') as f:
+            stl_mesh = mesh.Mesh.from_file('unzipped.stl', fh=io.BytesIO(f.read()))
+        expected = faces_to_triangles(self.vertices, self.faces).astype(np.float32)
+        np.testing.assert_array_equal(stl_mesh.vectors, expected)
+        self.assertLess(os.path.getsize(self.output_path), 84 + 50 * len(self.faces))
+
+    def test_ply(self):
+        write_mesh(self.output_path, self.vertices, self.faces, 'ply')
+        with open(self.output_path, 'rb') as f:
+            data = f.read()
+        header, body = data.split(b'end_header\n', 1)
+        self.assertIn(f'element vertex {len(self.vertices)}'.encode(), header)
+        self.assertIn(f'element face {len(self.faces)}'.encode(), header)
+        vertex_bytes = 12 * len(self.vertices)
+        vertices = np.frombuffer(body[:vertex_bytes], dtype='<f4').reshape(-1, 3)
+        faces = np.frombuffer(body[vertex_bytes:], dtype=PLY_FACE_DTYPE)
+        np.testing.assert_allclose(vertices, self.vertices, atol=1e-5)
+        self.assertTrue((faces['count'] == 3).all())
+        np.testing.assert_array_equal(faces['indices'], self.faces)
+        # Indexed vertices make the file much smaller than the STL
+        self.assertLess(len(data), (84 + 50 * len(self.faces)) / 2)
+
+    def test_lod(self):
+        small_vertices = closed_vertices(np.ones((3, 4)), 1.0, 4)
+        small_faces = closed_faces(3, 4)
+        write_lod(self.output_path, [(small_vertices, small_faces), (self.vertices, self.faces)])
+        table = read_lod_table(self.output_path)
+        self.assertEqual(table['vertices'].tolist(), [len(small_vertices), len(self.vertices)])
+        self.assertEqual(table['faces'].tolist(), [len(small_faces), len(self.faces)])
+        with open(self.output_path, 'rb') as f:
+            data = f.read()
+        for entry, (vertices, faces) in zip(table, [(small_vertices, small_faces), (self.vertices, self.faces)]):
+            offset, vertex_bytes = int(entry['offset']), 12 * len(vertices)
+            np.testing.assert_allclose(np.frombuffer(data[offset:offset + vertex_bytes], '<f4').reshape(-1, 3), vertices, atol=1e-5)
+            np.testing.assert_array_equal(
+                np.frombuffer(data[offset + vertex_bytes:offset + vertex_bytes + 12 * len(faces)], '<u4').reshape(-1, 3), faces
+            )
+        self.assertEqual(len(data), int(table[-1]['offset']) + 12 * (len(self.vertices) + len(self.faces)))
+
+        with open(self.output_path, 'wb') as f:
+            f.write(b'solid')
+        with self.assertRaises(ValueError):
+            read_lod_table(self.output_path)
+
+    def test_3mf(self):
+        write_mesh(self.output_path, self.vertices, self.faces, '3mf')
+        with zipfile.ZipFile(self.output_path) as package:
+            self.assertIn('[Content_Types].xml', package.namelist())
+            self.assertIn('_rels/.rels', package.namelist())
+            model = ET.fromstring(package.read('3D/3dmodel.model'))
+        vertices = np.array([[float(v.get(axis)) for axis in 'xyz'] for v in model.iterfind('.//m:vertex', NS_3MF)])
+        faces = np.array([[int(t.get(k)) for k in ('v1', 'v2', 'v3')] for t in model.iterfind('.//m:triangle', NS_3MF)])
+        np.testing.assert_allclose(vertices, self.vertices, atol=1e-4)
+        np.testing.assert_array_equal(faces, self.faces)
+        self.assertEqual(model.find('m:build/m:item', NS_3MF).get('objectid'), '1')
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            write_mesh(self.output_path, self.vertices, self.faces, 'obj')
+
+if __name__ == '__main__':
+    unittest.main()
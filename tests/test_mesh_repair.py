@@ -0,0 +1,34 @@
+import unittest
+import numpy as np
+import pymeshfix
+from mesh_builder import grid_vertices, grid_faces
+from mesh_repair import repair_arrays, RepairError, TIMEOUT, FAILED
+
+class TestMeshRepair(unittest.TestCase):
+
+    def setUp(self):
+        depth_image = np.random.default_rng(3).random((12, 10)) * 10
+        self.vertices = grid_vertices(depth_image, 0.5, 4)
+        self.faces = grid_faces(12, 10)
+
+    def test_repair_arrays(self):
+        points, faces = repair_arrays(self.vertices, self.faces, timeout=60, memory_mb=2048)
+        # The same result as repairing in this process
+        meshfix = pymeshfix.MeshFix(self.vertices, self.faces)
+        meshfix.repair()
+        np.testing.assert_array_equal(points, meshfix.points)
+        np.testing.assert_array_equal(faces, meshfix.faces)
+
+    def test_timeout(self):
+        with self.assertRaises(RepairError) as raised:
+            repair_arrays(self.vertices, self.faces, timeout=0.001)
+        self.assertEqual(raised.exception.outcome, TIMEOUT)
+
+    def test_crash(self):
+        # PyMeshFix crashes on out of range indices; only the child dies
+        with self.assertRaises(RepairError) as raised:
+            repair_arrays(self.vertices, np.array([[0, 1, 10**6]]), timeout=60)
+        self.assertEqual(raised.exception.outcome, FAILED)
+
+if __name__ == '__main__':
+    unittest.main()
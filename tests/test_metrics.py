@@ -0,0 +1,59 @@
+import unittest
+import metrics
+from metrics import Histogram, Registry, span
+
+class TestMetrics(unittest.TestCase):
+
+    def test_histogram(self):
+        histogram = Histogram('test_seconds', 'Test durations.', (0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value, stage='mesh')
+        samples = {(name, labels): value for name, labels, value in histogram.samples()}
+        self.assertEqual(samples[('test_seconds_bucket', (('stage', 'mesh'), ('le', '0.1')))], 2)
+        self.assertEqual(samples[('test_seconds_bucket', (('stage', 'mesh'), ('le', '1.0')))], 3)
+        self.assertEqual(samples[('test_seconds_bucket', (('stage', 'mesh'), ('le', '+Inf')))], 4)
+        self.assertEqual(samples[('test_seconds_count', (('stage', 'mesh'),))], 4)
+        self.assertAlmostEqual(samples[('test_seconds_sum', (('stage', 'mesh'),))], 2.65)
+
+    def test_render(self):
+        registry = Registry()
+        registry.counter('test_jobs_total', 'Test jobs.').inc(status='done')
+        registry.histogram('test_seconds', 'Test durations.', (1.0,)).observe(0.5)
+        text = registry.render()
+        self.assertIn('# TYPE test_jobs_total counter\ntest_jobs_total{status="done"} 1\n', text)
+        self.assertIn('# TYPE test_seconds histogram\n', text)
+        self.assertIn('test_seconds_bucket{le="1.0"} 1\n', text)
+        self.assertIn('test_seconds_count 1\n', text)
+
+    def test_span(self):
+        spans = []
+        with span(spans, 'decode') as record:
+            record['pixels'] = 100
+        self.assertEqual(len(spans), 1)
+        self.assertEqual(spans[0]['stage'], 'decode')
+        self.assertEqual(spans[0]['pixels'], 100)
+        self.assertGreaterEqual(spans[0]['seconds'], 0)
+        self.assertGreater(spans[0]['rss_bytes'], 0)
+
+        # Spans are recorded even when the stage fails
+        with self.assertRaises(ValueError), span(spans, 'repair'):
+            raise ValueError
+        self.assertEqual(spans[1]['stage'], 'repair')
+
+    def test_record_job(self):
+        stats = {'image_size': [50, 40], 'triangles': 1000, 'spans': [{'stage': 'mesh', 'seconds': 0.2, 'rss_bytes': 2**26}],
+                 'repair': {'outcome': 'timeout', 'seconds': 3.0, 'error': 'Mesh repair did not finish within 3s'}}
+        metrics.record_job('job-1', 'done', {'max_depth': 10}, 1.5, stats=stats)
+        metrics.record_job('job-2', 'failed', {'max_depth': 10}, 0.1, error='boom')
+        recent = metrics.recent_traces(2)
+        self.assertEqual([trace['job_id'] for trace in recent], ['job-2', 'job-1'])
+        self.assertEqual(recent[0]['error'], 'boom')
+        self.assertEqual(recent[1]['image_size'], [50, 40])
+        self.assertEqual(recent[1]['stages'][0]['stage'], 'mesh')
+        self.assertEqual(recent[1]['repair']['outcome'], 'timeout')
+        text = metrics.registry.render()
+        self.assertIn('lithophane_stage_seconds_count{stage="mesh"}', text)
+        self.assertIn('lithophane_repair_seconds_count{outcome="timeout"}', text)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+import os
+import numpy as np
+from stl import mesh
+from mesh_builder import closed_vertices, closed_faces, grid_vertices, grid_faces, faces_to_triangles
+import parallel_mesh
+from parallel_mesh import band_mesh, band_triangle_count, write_parallel_stl
+
+class TestParallelMesh(unittest.TestCase):
+
+    def setUp(self):
+        self.unit_depth = np.random.default_rng(2).random((11, 7))
+        self.output_stl_path = 'test_parallel_output.stl'
+
+    def tearDown(self):
+        if os.path.exists(self.output_stl_path):
+            os.remove(self.output_stl_path)
+
+    def expected_triangles(self, topology):
+        depth_image = self.unit_depth * 10
+        if topology == 'closed':
+            vertices, faces = closed_vertices(depth_image, 0.5, 4), closed_faces(11, 7)
+        else:
+            vertices, faces = grid_vertices(depth_image, 0.5, 4), grid_faces(11, 7)
+        return faces_to_triangles(vertices, faces).astype(np.float32)
+
+    def test_band_triangle_count(self):
+        for topology in ('grid', 'closed'):
+            for start, stop in [(0, 10), (0, 3), (3, 7), (7, 10), (4, 5)]:
+                _, faces = band_mesh(self.unit_depth[start:stop + 1], start, 11, 0.5, 4, topology)
+                self.assertEqual(len(faces), band_triangle_count(start, stop, 11, 7, topology))
+
+    def test_pool_reused(self):
+        write_parallel_stl(self.output_stl_path, self.unit_depth, 10, 0.5, 4, 'closed', workers=2)
+        executor = parallel_mesh._executor
+        write_parallel_stl(self.output_stl_path, self.unit_depth, 10, 0.5, 4, 'grid', workers=2)
+        self.assertIs(parallel_mesh._executor, executor)
+        # Another worker count gets its own pool
+        write_parallel_stl(self.output_stl_path, self.unit_depth, 10, 0.5, 4, 'grid', workers=3)
+        self.assertIsNot(parallel_mesh._executor, executor)
+
+    def test_write_parallel_stl(self):
+        for topology in ('grid', 'closed'):
+            for bands in (1, 3, 10):
+                triangle_count, _ = write_parallel_stl(
+                    self.output_stl_path, self.unit_depth, 10, 0.5, 4, topology, workers=2, bands=bands, chunk_size=5
+                )
+                expected = self.expected_triangles(topology)
+                self.assertEqual(triangle_count, len(expected))
+                self.assertEqual(os.path.getsize(self.output_stl_path), 84 + 50 * len(expected))
+
+                # Triangles are grouped by band, so compare them regardless of order
+                vectors = mesh.Mesh.from_file(self.output_stl_path).vectors.reshape(-1, 9)
+                expected = expected.reshape(-1, 9)
+                np.testing.assert_array_equal(
+                    vectors[np.lexsort(vectors.T[::-1])], expected[np.lexsort(expected.T[::-1])]
+                )
+
+if __name__ == '__main__':
+    unittest.main()
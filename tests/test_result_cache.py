@@ -0,0 +1,72 @@
+import unittest
+import os
+import shutil
+from result_cache import FolderLRU, ResultCache, cache_key, image_digest
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.output_folder = 'test_cache_outputs'
+        self.upload_folder = 'test_cache_uploads'
+        os.makedirs(self.output_folder, exist_ok=True)
+        os.makedirs(self.upload_folder, exist_ok=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.output_folder, ignore_errors=True)
+        shutil.rmtree(self.upload_folder, ignore_errors=True)
+
+    def write(self, folder, name, size):
+        with open(os.path.join(folder, name), 'wb') as f:
+            f.write(b'x' * size)
+
+    def test_cache_key(self):
+        digest = image_digest(b'image')
+        self.assertEqual(cache_key(digest, {'a': 1, 'b': 2}), cache_key(digest, {'b': 2, 'a': 1}))
+        self.assertNotEqual(cache_key(digest, {'a': 1}), cache_key(digest, {'a': 2}))
+        self.assertNotEqual(cache_key(digest, {'a': 1}), cache_key(image_digest(b'other'), {'a': 1}))
+
+    def test_lru_eviction(self):
+        lru = FolderLRU(self.output_folder, max_bytes=250)
+        for name in ['a', 'b', 'c']:
+            self.write(self.output_folder, name, 100)
+            lru.add(name)
+        # a was the least recently used file
+        self.assertEqual(sorted(os.listdir(self.output_folder)), ['b', 'c'])
+
+        lru.touch('b')
+        self.write(self.output_folder, 'd', 100)
+        lru.add('d')
+        self.assertEqual(sorted(os.listdir(self.output_folder)), ['b', 'd'])
+        self.assertEqual(lru.total_bytes, 200)
+        self.assertEqual(lru.evictions, 2)
+
+    def test_hits_and_misses(self):
+        cache = ResultCache(self.output_folder, self.upload_folder, 1000, 1000)
+        key = cache_key(image_digest(b'image'), {'max_depth': 10})
+        self.assertIsNone(cache.lookup(key))
+
+        self.write(self.output_folder, f"{key}_fixed.stl", 10)
+        cache.store(key, f"{key}_fixed.stl")
+        self.assertEqual(cache.lookup(key), f"{key}_fixed.stl")
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+        # The index is rebuilt from the output folder
+        self.assertEqual(ResultCache(self.output_folder, self.upload_folder, 1000, 1000).lookup(key), f"{key}_fixed.stl")
+
+        # Companion files are tracked with the outputs but never looked up
+        self.assertIsNone(cache.companion(key, '.lod'))
+        self.write(self.output_folder, f"{key}.lod", 10)
+        cache.add_companion(f"{key}.lod", protected=[f"{key}_fixed.stl"])
+        self.assertEqual(cache.companion(key, '.lod'), f"{key}.lod")
+        self.assertEqual(cache.stats()['output_bytes'], 20)
+        restarted = ResultCache(self.output_folder, self.upload_folder, 1000, 1000)
+        self.assertEqual(restarted.lookup(key), f"{key}_fixed.stl")
+        self.assertEqual(restarted.companion(key, '.lod'), f"{key}.lod")
+
+        # Deleted outputs are misses
+        os.remove(os.path.join(self.output_folder, f"{key}_fixed.stl"))
+        self.assertIsNone(cache.lookup(key))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+import numpy as np
+from stage_cache import StageCache
+
+class TestStageCache(unittest.TestCase):
+
+    def test_hit_and_miss(self):
+        cache = StageCache(max_bytes=1000)
+        value, hit = cache.get_or_compute('a', lambda: np.zeros(10))
+        self.assertFalse(hit)
+        cached, hit = cache.get_or_compute('a', lambda: self.fail("recomputed"))
+        self.assertTrue(hit)
+        self.assertIs(cached, value)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_entries_are_read_only(self):
+        cache = StageCache(max_bytes=1000)
+        value = cache.put('a', (np.zeros(3), np.ones(3)))
+        with self.assertRaises(ValueError):
+            value[0][0] = 1
+
+    def test_size_budget(self):
+        cache = StageCache(max_bytes=200)
+        cache.put('a', np.zeros(10))
+        cache.put('b', np.zeros(10))
+        cache.get('a')
+        cache.put('c', np.zeros(10))
+        # b was the least recently used entry
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertEqual(cache.total_bytes, 160)
+
+        # Entries larger than the budget are not stored
+        cache.put('d', np.zeros(100))
+        self.assertIsNone(cache.get('d'))
+
+    def test_resize(self):
+        cache = StageCache(max_bytes=400)
+        for key in 'abc':
+            cache.put(key, np.zeros(10))
+        cache.resize(200)
+        self.assertEqual(cache.total_bytes, 160)
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+
+if __name__ == '__main__':
+    unittest.main()
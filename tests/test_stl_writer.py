@@ -0,0 +1,46 @@
+import unittest
+import io
+import os
+import numpy as np
+from stl import mesh
+from mesh_builder import grid_vertices, grid_faces, faces_to_triangles
+from stl_writer import BinaryStlWriter, write_binary_stl, triangle_normals
+
+class TestStlWriter(unittest.TestCase):
+
+    def setUp(self):
+        depth_image = np.random.default_rng(1).random((6, 9)) * 10
+        self.vertices = grid_vertices(depth_image, 0.5, 4)
+        self.faces = grid_faces(6, 9)
+        self.output_stl_path = 'test_writer_output.stl'
+
+    def tearDown(self):
+        if os.path.exists(self.output_stl_path):
+            os.remove(self.output_stl_path)
+
+    def assert_stl_matches(self, path):
+        stl_mesh = mesh.Mesh.from_file(path)
+        expected = faces_to_triangles(self.vertices, self.faces).astype(np.float32)
+        np.testing.assert_array_equal(stl_mesh.vectors, expected)
+        self.assertEqual(os.path.getsize(path), 84 + 50 * len(self.faces))
+
+    def test_write_chunked(self):
+        write_binary_stl(self.output_stl_path, self.vertices, self.faces, chunk_size=7)
+        self.assert_stl_matches(self.output_stl_path)
+
+    def test_write_mmap(self):
+        write_binary_stl(self.output_stl_path, self.vertices, self.faces, chunk_size=7, use_mmap=True)
+        self.assert_stl_matches(self.output_stl_path)
+
+    def test_normals(self):
+        triangles = np.array([[[0, 0, 0], [2, 0, 0], [0, 2, 0]], [[0, 0, 0], [1, 1, 1], [2, 2, 2]]], dtype=float)
+        np.testing.assert_allclose(triangle_normals(triangles), [[0, 0, 1], [0, 0, 0]])
+
+    def test_triangle_count_mismatch(self):
+        writer = BinaryStlWriter(io.BytesIO(), 3)
+        writer.write_triangles(np.zeros((2, 3, 3)))
+        with self.assertRaises(ValueError):
+            writer.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,16 @@
+"""
+WSGI entry point for production servers.
+
+Serve with a prefork server that imports the application in its master
+process, for example:
+
+    gunicorn --preload --workers 4 wsgi:app
+
+The conversion engine is then loaded and warmed up once, before the workers
+fork, and shared by them copy-on-write (see app.warm_up and Config.WARM_UP).
+"""
+from app import app, warm_up
+from config import Config
+
+if Config.WARM_UP:
+    warm_up()